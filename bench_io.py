@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from lunar.loader import read_contours
+from lunar.table_io import write_table, zstandard
+
+# Benchmark plain, gzip and zstd contour tables: write time, read time and size.
+# The fixture is tiled `scale` times with shifted frame numbers to reach a realistic night size.
+
+ap = argparse.ArgumentParser(description="Benchmark compressed vs. plain TSV contour I/O.")
+ap.add_argument("-f", "--file", default="contours_results.tab", type=str, help="Contour fixture to scale up (default: contours_results.tab)")
+ap.add_argument("-n", "--scale", default=100, type=int, help="Number of copies of the fixture (default: 100)")
+ap.add_argument("-t", "--threads", default=None, type=int, help="Compression threads (default: all cores)")
+ap.add_argument("-d", "--dir", default=None, type=str, help="Directory for the temporary tables (default: system temp)")
+args = ap.parse_args()
+
+fixture = read_contours(args.file)
+span = int(fixture['frame'].max()) + 1
+df = pd.concat([fixture.assign(frame=fixture['frame'] + i * span) for i in range(args.scale)], ignore_index=True)
+print(f"{len(df)} rows from {args.scale} copies of {args.file}")
+
+suffixes = ['.tab', '.tab.gz'] + (['.tab.zst'] if zstandard is not None else [])
+if zstandard is None:
+    print("zstandard is not installed; skipping .zst")
+
+with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+    results = []
+    for suffix in suffixes:
+        path = os.path.join(tmp, 'bench' + suffix)
+
+        start = time.perf_counter()
+        write_table(df, path, threads=args.threads)
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        back = read_contours(path)
+        read_s = time.perf_counter() - start
+        assert len(back) == len(df)
+
+        text_mb = os.path.getsize(os.path.join(tmp, 'bench.tab')) / 1e6
+        size_mb = os.path.getsize(path) / 1e6
+        results.append({
+            'format': suffix,
+            'size_MB': round(size_mb, 1),
+            'ratio': round(text_mb / size_mb, 2),
+            'write_s': round(write_s, 2),
+            'write_MB/s': round(text_mb / write_s, 1),
+            'read_s': round(read_s, 2),
+            'read_MB/s': round(text_mb / read_s, 1),
+        })
+
+print(pd.DataFrame(results).to_string(index=False))
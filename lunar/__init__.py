@@ -1,15 +1,32 @@
 from .find_contours import find_contours_from_videos
 from .plot_contours import plot_contours
-from .identify_glare import normalize_data, cluster_data, process_large_file, clip_ends, manual_mark_glare, concatenate_and_cluster
+from .identify_glare import normalize_data, cluster_data, process_large_file, process_large_file_windowed, global_scaling, clip_ends, manual_mark_glare, concatenate_and_cluster, compare_glare_detectors
+from .grid_glare import grid_cluster
+from .glare_sweep import sweep_glare
+from .glare_mask import GlareMask, update_glare_mask
+from .glare_rules import apply_glare_rules
+from .detect_tanks import detect_tank_boundaries
+from .tank_layout import TankLayout, layout_from_boundaries
 from .plot_glare_contours import plot_glare_contours
-from .label_tanx import determine_camera, determine_tank, calculate_cXtank, analyze_contours
+from .label_tanx import determine_camera, determine_tank, calculate_cXtank, analyze_contours, label_tanks
 from .match_cameras import match_cameras
-from .plot_matched import plot_matched
+from .match_engine import match_pairs, match_pairs_window
+from .camera_offset import estimate_camera_offset
+from .plot_matched import plot_matched, matched_pairs
+from .triangulate import triangulate_matches
 from .smooth_contours import smooth_contours
+from .rolling import smooth_counts, rolling_stats
+from .classify1d import split_two, natural_breaks
+from .hmm_activity import segment_activity
 from .plot_days import plot_days
 from .add_time import add_time  # Import your new function here
 from .play_smalle_video import play_smalle_video
 from .clip_smalle import clip_smalle
+from .frame_index import build_frame_index, read_frames
+from .loader import read_contours, iter_contours
+from .contour_table import ContourTable
+from .table_io import open_table, write_table
+from .query import ingest, query, pulses_per_minute
 
 
 __all__ = [
@@ -17,6 +34,15 @@ __all__ = [
     'process_large_file', 'clip_ends', 'manual_mark_glare', 'plot_glare_contours', 'determine_camera', 
     'determine_tank', 'calculate_cXtank', 'analyze_contours', 'match_cameras',
     'plot_matched', 'smooth_contours', 'concatenate_and_cluster', 'plot_days', 'add_time', 'play_smalle_video',
-    'clip_smalle'  # Add it to the __all__ list
+    'clip_smalle',  # Add it to the __all__ list
+    'build_frame_index', 'read_frames', 'read_contours', 'iter_contours',
+    'ContourTable', 'open_table', 'write_table', 'ingest', 'query', 'pulses_per_minute',
+    'process_large_file_windowed', 'global_scaling', 'compare_glare_detectors', 'grid_cluster',
+    'sweep_glare', 'GlareMask', 'update_glare_mask', 'apply_glare_rules', 'label_tanks',
+    'detect_tank_boundaries', 'TankLayout', 'layout_from_boundaries',
+    'match_pairs', 'match_pairs_window', 'estimate_camera_offset',
+    'matched_pairs', 'triangulate_matches',
+    'smooth_counts', 'rolling_stats', 'split_two', 'natural_breaks',
+    'segment_activity'
 ]
 
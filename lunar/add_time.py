@@ -1,5 +1,7 @@
 import pandas as pd
 from datetime import datetime, timedelta
+from .loader import read_contours
+from .table_io import write_table
 
 def add_time(input_file_name, frame1_time_str, output_file_name, fps=30):
     """
@@ -13,7 +15,7 @@ def add_time(input_file_name, frame1_time_str, output_file_name, fps=30):
     - fps (int): Frames per second, defaults to 30.
     """
     # Read the input file
-    df = pd.read_csv(input_file_name, sep='\t')
+    df = read_contours(input_file_name)
 
     # Convert the frame1_time_str to a datetime object
     frame1_time = datetime.strptime(frame1_time_str, '%Y-%m-%d %H:%M:%S')
@@ -22,7 +24,7 @@ def add_time(input_file_name, frame1_time_str, output_file_name, fps=30):
     df['time'] = df['frame'].apply(lambda frame: frame1_time + timedelta(seconds=(frame - 1) / fps))
 
     # Write the modified DataFrame to a new file
-    df.to_csv(output_file_name, sep='\t', index=False)
+    write_table(df, output_file_name)
 
     print(f"New file with absolute time column saved as {output_file_name}")
 
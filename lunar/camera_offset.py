@@ -0,0 +1,93 @@
+# lunar/camera_offset.py
+
+import numpy as np
+from scipy import fft
+from .loader import TANK_LABELS
+from .rolling import frame_counts
+
+# Peak correlation below which an estimated lag is not trusted
+MIN_CORRELATION = 0.3
+
+
+def cross_correlation(a, b, max_lag):
+    """
+    Cross-correlates two series with an FFT.
+
+    The series are centred on their means and zero-padded, so the correlation is
+    linear rather than circular; the result is normalized to lie between -1 and 1.
+
+    Parameters:
+    - a (ndarray): First series (left camera counts per frame).
+    - b (ndarray): Second series, of the same length (right camera counts per frame).
+    - max_lag (int): Largest lag to return, in either direction.
+
+    Returns:
+    - tuple: (lags, correlation), where correlation[i] compares a[f] with b[f + lags[i]].
+    """
+    a = np.asarray(a, dtype=np.float64) - np.mean(a)
+    b = np.asarray(b, dtype=np.float64) - np.mean(b)
+    size = fft.next_fast_len(len(a) + len(b) - 1, real=True)
+    full = fft.irfft(np.conj(fft.rfft(a, size)) * fft.rfft(b, size), size)
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    max_lag = min(max_lag, len(a) - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlation = full[lags % size]
+    return lags, correlation / norm if norm > 0 else np.zeros(len(lags))
+
+
+def estimate_camera_offset(source, max_lag=100, chunksize=None):
+    """
+    Estimates the frame lag between the left and right camera halves.
+
+    The per-frame contour counts of left_tankN and right_tankN are cross-correlated
+    over the whole night with an FFT; the best lag is where the correlation peaks.
+    The overall lag uses the summed correlation of the tanks; a tank whose counts
+    never change on one side (no contours at all, say) has nothing to correlate and is
+    left out, with lag None and correlation 0. A positive lag
+    means the right camera runs behind: the flash in left frame f shows up in right
+    frame f + lag, which is the frame_offset match_cameras expects.
+
+    Parameters:
+    - source (str, DataFrame or ContourTable): Analyzed contour table (needs frame and tank).
+    - max_lag (int, optional): Largest lag searched, in frames (default: 100).
+    - chunksize (int, optional): Rows read per chunk (default: from the loader's memory budget).
+
+    Returns:
+    - dict: 'lag' and 'correlation' (mean peak value) overall, and 'tanks' mapping 'tank1'..'tank3'
+      to their own 'lag' and 'correlation'. The overall lag is 0 with correlation 0 when no
+      tank can be correlated.
+    """
+    _, counts = frame_counts(source, chunksize=chunksize)
+    if counts.shape[1] < 2:
+        raise ValueError("Not enough frames to estimate a camera offset")
+    tanks, total, used = {}, None, 0
+    for number in range(1, 4):
+        left = counts[TANK_LABELS.index(f'left_tank{number}')]
+        right = counts[TANK_LABELS.index(f'right_tank{number}')]
+        if np.ptp(left) == 0 or np.ptp(right) == 0:
+            # A constant series has zero norm, so its correlation would peak at an arbitrary lag
+            tanks[f'tank{number}'] = {'lag': None, 'correlation': 0.0}
+            continue
+        lags, correlation = cross_correlation(left, right, max_lag)
+        best = int(np.argmax(correlation))
+        tanks[f'tank{number}'] = {'lag': int(lags[best]), 'correlation': round(float(correlation[best]), 3)}
+        total = correlation if total is None else total + correlation
+        used += 1
+    if total is None:
+        return {'lag': 0, 'correlation': 0.0, 'tanks': tanks}
+    best = int(np.argmax(total))
+    return {'lag': int(lags[best]), 'correlation': round(float(total[best] / used), 3), 'tanks': tanks}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Estimate the frame offset between the left and right cameras.")
+    parser.add_argument("files", nargs="+", help="Analyzed contour tables, one per night")
+    parser.add_argument("-m", "--max_lag", type=int, default=100, help="Largest lag searched, in frames (default: 100)")
+    args = parser.parse_args()
+
+    for path in args.files:
+        result = estimate_camera_offset(path, max_lag=args.max_lag)
+        per_tank = ' '.join(f"{tank} {r['lag']} ({r['correlation']:.2f})" for tank, r in result['tanks'].items())
+        print(f"{path}\tlag {result['lag']} (correlation {result['correlation']:.2f})\t{per_tank}")
@@ -0,0 +1,171 @@
+# lunar/classify1d.py
+
+import numpy as np
+
+METHODS = ('exact', 'histogram')
+
+
+def _weighted_points(values, method='exact', bins=4096):
+    """
+    Reduces a series to sorted weighted points for splitting.
+
+    'exact' keeps every distinct value (one sort, through np.unique); 'histogram'
+    keeps the non-empty bins of an equal-width histogram, with the exact sum of the
+    values in each bin, and needs no sort.
+
+    Returns:
+    - tuple: (weights, sums, squares, upper), per point: the number of values, their sum and sum of
+      squares (both centred on the series mean) and the threshold that separates the point from the
+      next one (values <= upper fall at or below the point).
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}")
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        empty = np.empty(0)
+        return empty, empty, empty, empty
+    centre = values.mean()
+    if method == 'exact':
+        points, weights = np.unique(values, return_counts=True)
+        weights = weights.astype(np.float64)
+        centred = points - centre
+        # A split between two distinct values falls halfway between them
+        upper = np.append(points[:-1] + (points[1:] - points[:-1]) / 2, np.inf)
+        upper[:-1] = np.where(upper[:-1] < points[1:], upper[:-1], points[:-1])
+        return weights, weights * centred, weights * centred ** 2, upper
+    low, high = values.min(), values.max()
+    edges = np.linspace(low, high, bins + 1)
+    # Bin i holds the values in (edges[i], edges[i + 1]]; the minimum joins the first bin
+    scale = bins / (high - low) if high > low else 0.0
+    index = np.clip(np.ceil((values - low) * scale).astype(np.int64) - 1, 0, bins - 1)
+    # Correct the values that rounding put on the wrong side of an edge
+    index -= (index > 0) & (values <= edges[index])
+    index += (index < bins - 1) & (values > edges[index + 1])
+    centred = values - centre
+    weights = np.bincount(index, minlength=bins).astype(np.float64)
+    sums = np.bincount(index, weights=centred, minlength=bins)
+    squares = np.bincount(index, weights=centred ** 2, minlength=bins)
+    keep = weights > 0
+    upper = edges[1:][keep]
+    upper[-1] = np.inf
+    return weights[keep], sums[keep], squares[keep], upper
+
+
+def split_two(values, method='exact', bins=4096):
+    """
+    Finds the optimal threshold between two classes of a 1D series.
+
+    The split minimises the within-class sum of squares, which is what 2-means
+    (and Otsu's and Jenks' methods) optimise; in 1D the optimal classes are always
+    the values below and above a threshold, so every threshold is scored at once
+    from cumulative sums: a split leaving class sums S1 and S2 of n1 and n2 values
+    (centred on the series mean) is best where S1**2 / n1 + S2**2 / n2 is largest.
+
+    Parameters:
+    - values (array-like): The series (NaN values are ignored).
+    - method (str, optional): 'exact' (default) scores every split between distinct values, after
+      one sort; 'histogram' scores only splits between the bins of an equal-width histogram, in O(n).
+    - bins (int, optional): Histogram bins for method='histogram' (default: 4096).
+
+    Returns:
+    - float: The threshold; values above it form the upper class (inf when the series has a single value).
+    """
+    weights, sums, _, upper = _weighted_points(values, method, bins)
+    if len(weights) < 2:
+        return np.inf
+    n_low = np.cumsum(weights)[:-1]
+    s_low = np.cumsum(sums)[:-1]
+    n_high = weights.sum() - n_low
+    s_high = sums.sum() - s_low
+    score = s_low ** 2 / n_low + s_high ** 2 / n_high
+    return float(upper[np.argmax(score)])
+
+
+def natural_breaks(values, k, method='exact', bins=4096):
+    """
+    Finds the optimal thresholds between k classes of a 1D series (Jenks natural breaks).
+
+    Classes are runs of the sorted points (see split_two), and the runs with the
+    smallest total within-class sum of squares are found by dynamic programming over
+    the points, with the cost of every run taken from cumulative sums. Within-class
+    sums of squares satisfy the quadrangle inequality, so the best start of the last
+    class never moves left as the runs grow, and every layer of the dynamic program
+    is solved by divide and conquer: the best start for the middle run bounds the
+    search for the runs on either side. All runs of one recursion level are scored
+    at once, so the cost is O(k m log m) for m points, in O(k log m) array steps.
+
+    Parameters:
+    - values (array-like): The series (NaN values are ignored).
+    - k (int): Number of classes.
+    - method (str, optional): 'exact' (default) or 'histogram' (see split_two).
+    - bins (int, optional): Histogram bins for method='histogram' (default: 4096).
+
+    Returns:
+    - ndarray: The k - 1 increasing thresholds (inf for classes the series has too few values to fill).
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    weights, sums, squares, upper = _weighted_points(values, method, bins)
+    m = len(weights)
+    classes = min(k, m)
+    if classes < 2:
+        return np.full(k - 1, np.inf)
+    cw = np.concatenate([[0.0], np.cumsum(weights)])
+    cs = np.concatenate([[0.0], np.cumsum(sums)])
+    cq = np.concatenate([[0.0], np.cumsum(squares)])
+
+    def run_cost(starts, end):
+        # Within-class sum of squares of the points starts..end-1, for many starts at once
+        n = cw[end] - cw[starts]
+        s = cs[end] - cs[starts]
+        return np.maximum(cq[end] - cq[starts] - s ** 2 / n, 0.0)
+
+    # cost[c, i]: smallest cost of splitting the first i points into c + 1 classes
+    cost = np.full((classes, m + 1), np.inf)
+    cost[0, 1:] = run_cost(np.zeros(m, dtype=np.int64), np.arange(1, m + 1))
+    start = np.zeros((classes, m + 1), dtype=np.int64)
+    for c in range(1, classes):
+        # Runs lo..hi of end points i still to solve, whose best starts lie in first..last
+        lo, hi = np.array([c + 1]), np.array([m])
+        first, last = np.array([c]), np.array([m - 1])
+        while len(lo):
+            mid = (lo + hi) // 2
+            # The last class holds the points j..mid-1, for every start j in the search range
+            counts = np.minimum(mid - 1, last) - first + 1
+            member = np.repeat(np.arange(len(mid)), counts)
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            j = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(offsets, counts)
+            total = cost[c - 1, j] + run_cost(j, mid[member])
+            # The earliest best start of each run
+            lowest = np.minimum.reduceat(total, offsets)
+            candidates = np.flatnonzero(total == lowest[member])
+            best = j[candidates[np.unique(member[candidates], return_index=True)[1]]]
+            cost[c, mid] = lowest
+            start[c, mid] = best
+            left, right = lo <= mid - 1, mid + 1 <= hi
+            lo, hi = np.concatenate([lo[left], mid[right] + 1]), np.concatenate([mid[left] - 1, hi[right]])
+            first, last = np.concatenate([first[left], best[right]]), np.concatenate([best[left], last[right]])
+
+    breaks = []
+    i = m
+    for c in range(classes - 1, 0, -1):
+        i = start[c, i]
+        breaks.append(upper[i - 1])
+    return np.concatenate([breaks[::-1], np.full(k - classes, np.inf)])
+
+
+def assign_classes(values, thresholds):
+    """
+    Labels every value with its class, counted from the lowest.
+
+    Parameters:
+    - values (array-like): The series.
+    - thresholds (float or array-like): Increasing class thresholds (from split_two or natural_breaks).
+
+    Returns:
+    - ndarray: Class of each value, 0 for values <= thresholds[0] and so on (-1 for NaN).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    labels = np.searchsorted(np.atleast_1d(thresholds), values, side='left')
+    return np.where(np.isnan(values), -1, labels)
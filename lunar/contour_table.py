@@ -0,0 +1,204 @@
+# lunar/contour_table.py
+
+import numpy as np
+import pandas as pd
+from .loader import read_contours, CONTOUR_DTYPES, GLARE_LABELS, CAMERA_LABELS, TANK_LABELS, MATCH_LABELS
+
+# Label columns stored as small integer codes (-1 marks a missing value)
+CODED_COLUMNS = {
+    'tank': TANK_LABELS,
+    'camera': CAMERA_LABELS,
+    'glare': GLARE_LABELS,
+    'match_status': MATCH_LABELS,
+}
+
+
+class ContourTable:
+    """
+    Compact in-memory contour table with one contiguous NumPy array per column.
+
+    Numeric columns keep the loader schema types (int32 frame, float64 measurements).
+    The tank, camera, glare and match_status labels are stored as int8 codes into the
+    fixed vocabularies of lunar.loader, and the video column is stored as int32 codes
+    into a video-path list that several tables can share, so glare, analyzed and
+    matched tables of the same night hold each path only once.
+
+    Parameters:
+    - columns (dict): Column name -> 1D NumPy array, all of the same length.
+    - index (ndarray, optional): Row numbers of the rows in their source file (default: 0..n-1).
+    - videos (list, optional): Shared video-path dictionary for the 'video' codes (default: new list).
+    """
+
+    def __init__(self, columns, index=None, videos=None):
+        self.columns = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+        lengths = {len(values) for values in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns of a ContourTable must have the same length")
+        n = lengths.pop() if lengths else 0
+        self.index = np.arange(n, dtype=np.int64) if index is None else np.ascontiguousarray(index, dtype=np.int64)
+        self.videos = [] if videos is None else videos
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        """Returns the stored array of a column (a view, not a copy)."""
+        return self.columns[name]
+
+    def __repr__(self):
+        return f"ContourTable({len(self)} rows, columns={list(self.columns)})"
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    def labels(self, name):
+        """
+        Decodes a coded column back to its string labels.
+
+        Parameters:
+        - name (str): 'tank', 'camera', 'glare', 'match_status' or 'video'.
+
+        Returns:
+        - ndarray: Object array of labels, with None where the code is -1.
+        """
+        vocabulary = self.videos if name == 'video' else CODED_COLUMNS[name]
+        lookup = np.array(list(vocabulary) + [None], dtype=object)
+        return lookup[self.columns[name]]
+
+    def _encode_videos(self, values):
+        categorical = pd.Categorical(values)
+        positions = {path: i for i, path in enumerate(self.videos)}
+        for path in categorical.categories:
+            if path not in positions:
+                positions[path] = len(self.videos)
+                self.videos.append(path)
+        mapping = np.array([positions[path] for path in categorical.categories] + [-1], dtype=np.int32)
+        return mapping[categorical.codes]
+
+    @classmethod
+    def from_frame(cls, df, videos=None):
+        """
+        Builds a ContourTable from a DataFrame.
+
+        Parameters:
+        - df (DataFrame): Contour data, e.g. as returned by read_contours.
+        - videos (list, optional): Video-path dictionary to share with other tables.
+
+        Returns:
+        - ContourTable: The packed table; the DataFrame index is kept as the row numbers.
+        """
+        table = cls({}, index=df.index.to_numpy(), videos=videos)
+        for name in df.columns:
+            series = df[name]
+            if name == 'video':
+                values = table._encode_videos(series)
+            elif name in CODED_COLUMNS:
+                values = pd.Categorical(series, categories=CODED_COLUMNS[name]).codes.astype(np.int8)
+            elif isinstance(CONTOUR_DTYPES.get(name), type):
+                values = series.to_numpy(dtype=CONTOUR_DTYPES[name])
+            else:
+                values = series.to_numpy()
+            table.columns[name] = np.ascontiguousarray(values)
+        return table
+
+    @classmethod
+    def read(cls, path, columns=None, frames=None, where=None, videos=None):
+        """
+        Reads a contour table from disk with the shared loader.
+
+        Parameters:
+        - path (str): Path to the tab-delimited contour table.
+        - columns (list, optional): Columns to load (default: all columns).
+        - frames (tuple, optional): (start, stop) frame window to keep, both inclusive.
+        - where (dict, optional): Label filters passed to read_contours.
+        - videos (list, optional): Video-path dictionary to share with other tables.
+
+        Returns:
+        - ContourTable: The loaded table.
+        """
+        return cls.from_frame(read_contours(path, columns=columns, frames=frames, where=where), videos=videos)
+
+    def to_frame(self, columns=None):
+        """
+        Converts the table to a DataFrame.
+
+        Numeric columns are wrapped without copying; coded columns become pandas
+        Categoricals built from the stored codes.
+
+        Parameters:
+        - columns (list, optional): Columns to include (default: all columns).
+
+        Returns:
+        - DataFrame: The table, indexed by the stored row numbers.
+        """
+        data = {}
+        for name in (self.columns if columns is None else columns):
+            values = self.columns[name]
+            if name == 'video':
+                data[name] = pd.Categorical.from_codes(values, categories=self.videos)
+            elif name in CODED_COLUMNS:
+                data[name] = pd.Categorical.from_codes(values, categories=CODED_COLUMNS[name])
+            else:
+                data[name] = values
+        return pd.DataFrame(data, index=pd.Index(self.index), copy=False)
+
+    def take(self, rows):
+        """
+        Returns a new table with the selected rows (positions or boolean mask).
+
+        Parameters:
+        - rows (ndarray): Integer positions or a boolean mask.
+
+        Returns:
+        - ContourTable: The selected rows, sharing this table's video dictionary.
+        """
+        return ContourTable({name: values[rows] for name, values in self.columns.items()},
+                            index=self.index[rows], videos=self.videos)
+
+    def sort_by_frame(self):
+        """
+        Returns the table sorted by frame (stable, so rows of one frame keep their order).
+
+        Returns:
+        - ContourTable: A sorted copy, or the table itself if it is already sorted.
+        """
+        frame = self.columns['frame']
+        if len(frame) and np.all(frame[1:] >= frame[:-1]):
+            return self
+        return self.take(np.argsort(frame, kind='stable'))
+
+    def frame_offsets(self):
+        """
+        Returns the distinct frames of a frame-sorted table and where each one starts.
+
+        The rows of frames[i] are rows offsets[i]:offsets[i + 1].
+
+        Returns:
+        - tuple: (frames, offsets) arrays; offsets has one more entry than frames.
+        """
+        frame = self.columns['frame']
+        if len(frame) and np.any(frame[1:] < frame[:-1]):
+            raise ValueError("frame_offsets requires a frame-sorted table; call sort_by_frame() first")
+        starts = np.flatnonzero(np.diff(frame, prepend=frame[:1] - 1) != 0) if len(frame) else np.empty(0, dtype=np.int64)
+        return frame[starts], np.append(starts, len(frame))
+
+    def frame_rows(self, start, stop):
+        """
+        Returns the rows of a frame-sorted table whose frame lies in [start, stop].
+
+        Parameters:
+        - start (int): First frame (inclusive).
+        - stop (int): Last frame (inclusive).
+
+        Returns:
+        - ContourTable: The rows in the window (array slices, not copies).
+        """
+        frame = self.columns['frame']
+        lo = np.searchsorted(frame, start, side='left')
+        hi = np.searchsorted(frame, stop, side='right')
+        return ContourTable({name: values[lo:hi] for name, values in self.columns.items()},
+                            index=self.index[lo:hi], videos=self.videos)
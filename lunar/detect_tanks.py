@@ -0,0 +1,276 @@
+# lunar/detect_tanks.py
+
+import json
+import os
+import cv2
+import numpy as np
+from .loader import iter_contours, table_columns, is_path
+from .frame_index import load_frame_index, read_frames
+
+TANKS_SUFFIX = '.tanks.json'
+DEFAULT_BIN_WIDTH = 5
+DEFAULT_CAMERA_SPLIT = 2001
+# Bumped when the detection or its confidence scores change, so older sidecars are recomputed
+TANKS_VERSION = 2
+
+
+def tanks_path(path):
+    """Returns the path of the cached tank-boundary sidecar of a contour table."""
+    return str(path) + TANKS_SUFFIX
+
+
+def _sample_cx(source, sample_blocks=64):
+    """
+    Returns a sample of non-glare cX values.
+
+    Tables with a frame index are sampled by reading `sample_blocks` evenly spaced
+    index blocks; other tables (compressed or in-memory) stream only the cX column.
+    """
+    where = {'glare': 'no'} if 'glare' in table_columns(source) else None
+    blocks = load_frame_index(source, rebuild=False) if is_path(source) else None
+    if blocks is not None and len(blocks) > sample_blocks:
+        picks = blocks.iloc[np.linspace(0, len(blocks) - 1, sample_blocks).round().astype(int)]
+        pieces = []
+        for _, block in picks.iterrows():
+            piece = read_frames(source, block['frame_min'], block['frame_max'],
+                                columns=['cX'] + (['glare'] if where else []))
+            if where:
+                piece = piece[piece['glare'] == 'no']
+            pieces.append(piece['cX'].to_numpy(dtype=np.float64))
+        return np.concatenate(pieces)
+    return np.concatenate([chunk['cX'].to_numpy(dtype=np.float64)
+                           for chunk in iter_contours(source, columns=['cX'], where=where)] or [np.empty(0)])
+
+
+def _smooth(values, width):
+    kernel = np.ones(width) / width
+    return np.convolve(values, kernel, mode='same')
+
+
+def _longest_run(mask):
+    # Start and end (exclusive) of the longest run of True values, or None
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    if not len(edges):
+        return None
+    starts, ends = edges[0::2], edges[1::2]
+    longest = np.argmax(ends - starts)
+    return starts[longest], ends[longest]
+
+
+def _edge_confidence(density, edge, step, inner, outer, smooth_bins):
+    """
+    Scores an outer tank edge: the contrast between the density inside and outside
+    it, times how sharply the density rises from the edge (at `edge`, going `step`)
+    to half the tank's level; a wall rises within about the smoothing width, a
+    gradual ramp leaves the edge uncertain.
+    """
+    if inner <= 0:
+        return 0.0
+    contrast = float(np.clip(1 - outer / inner, 0, 1))
+    ahead = density[edge::step] if step > 0 else density[edge::-1]
+    risen = np.flatnonzero(ahead >= inner / 2)
+    rise = risen[0] + 1 if len(risen) else len(ahead) + 1
+    return contrast * min(1.0, smooth_bins / float(rise))
+
+
+def _wall_confidence(density, wall, a, b, inner, min_width):
+    """
+    Scores an inner wall, the valley at `wall` found in density[a:b], against the
+    level of the tanks on either side (`inner`, the lower of the two).
+
+    The score is the depth of the valley relative to that level, times its
+    prominence in the search window (1 when nothing else in it dips below half the
+    valley's depth, 0 when another valley there is as deep), times its width at half
+    depth relative to min_width bins (capped at 1). An empty bin in a sparse profile
+    is deep but neither wide nor prominent.
+    """
+    valley = density[wall]
+    if inner <= 0 or valley >= inner:
+        return 0.0
+    half = valley + (inner - valley) / 2
+    # The valley's basin: the run of bins below half depth around the wall
+    below = np.concatenate([[False], density[a:b] < half, [False]])
+    edges = np.flatnonzero(np.diff(below.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    basin = np.flatnonzero((starts <= wall - a) & (ends > wall - a))[0]
+    width = ends[basin] - starts[basin]
+    outside = np.concatenate([density[a:a + starts[basin]], density[a + ends[basin]:b]])
+    prominence = float(np.clip((outside.min() - valley) / (half - valley), 0, 1)) if len(outside) else 1.0
+    return float((1 - valley / inner) * prominence * min(1.0, width / min_width))
+
+
+def boundaries_from_profile(profile, bin_width=DEFAULT_BIN_WIDTH, origin=0.0, camera_split=DEFAULT_CAMERA_SPLIT,
+                            smooth_bins=5, edge_fraction=0.1, min_wall_bins=None):
+    """
+    Finds the 8 tank boundaries in a 1D density profile along cX.
+
+    The camera gap is the longest near-empty run in the middle half of the
+    occupied range (camera_split is used when there is none). In each camera the
+    outer tank edges are where the smoothed density first and last exceeds
+    edge_fraction of that camera's median density, and the two inner walls are the
+    deepest valleys around the thirds of the span between them.
+
+    Confidence scores lie between 0 and 1. Outer edges score the contrast between
+    the density just inside and just outside the edge, scaled down when the density
+    ramps up slowly instead of rising like a wall. Inner walls score the depth of the
+    valley relative to the tanks on either side, scaled down when the valley is
+    narrower than min_wall_bins at half depth or when another valley nearby is
+    about as deep, so a sparse or featureless profile does not give confident walls.
+
+    Parameters:
+    - profile (ndarray): Density per bin, e.g. a cX histogram.
+    - bin_width (float, optional): Width of a bin in pixels (default: 5).
+    - origin (float, optional): cX of the left edge of bin 0 (default: 0).
+    - camera_split (float, optional): Fallback split between the cameras (default: 2001).
+    - smooth_bins (int, optional): Moving-average width in bins (default: 5).
+    - edge_fraction (float, optional): Fraction of the median density that marks a tank edge (default: 0.1).
+    - min_wall_bins (int, optional): Width at half depth, in bins, of a fully confident inner wall
+      (default: smooth_bins).
+
+    Returns:
+    - tuple: (boundaries, confidence), two lists of 8 values [t1, ..., t8].
+    """
+    if min_wall_bins is None:
+        min_wall_bins = smooth_bins
+    density = _smooth(np.asarray(profile, dtype=np.float64), smooth_bins)
+    occupied = np.flatnonzero(density > 0)
+    if len(occupied) < 8:
+        raise ValueError("Not enough contours to detect tank boundaries")
+    first, last = occupied[0], occupied[-1] + 1
+
+    # Camera gap: longest near-empty run in the middle half of the occupied range
+    level = edge_fraction * np.median(density[first:last][density[first:last] > 0])
+    quarter = (last - first) // 4
+    run = _longest_run(density[first + quarter:last - quarter] < level)
+    if run is not None and run[1] > run[0]:
+        split = first + quarter + (run[0] + run[1]) // 2
+    else:
+        split = int(round((camera_split - origin) / bin_width))
+
+    boundaries, confidence = [], []
+    for lo, hi in [(first, split), (split, last)]:
+        camera = density[lo:hi]
+        inside = np.flatnonzero(camera >= edge_fraction * np.median(camera[camera > 0]))
+        if len(inside) < 6:
+            raise ValueError("Not enough contours in one camera to detect tank boundaries")
+        left, right = lo + inside[0], lo + inside[-1] + 1
+        span = right - left
+
+        # Inner walls: deepest valley around each third of the span
+        walls, windows = [], []
+        for k in (1, 2):
+            centre = left + k * span // 3
+            a, b = max(centre - span // 6, left + 1), min(centre + span // 6, right - 1)
+            walls.append(a + int(np.argmin(density[a:b])))
+            windows.append((a, b))
+
+        tanks = [density[left:walls[0]], density[walls[0]:walls[1]], density[walls[1]:right]]
+        level_in = [np.median(t) if len(t) else 0.0 for t in tanks]
+        edge_width = max(smooth_bins, 1)
+        outside_left = density[max(left - edge_width, 0):left].mean() if left > 0 else 0.0
+        outside_right = density[right:right + edge_width].mean() if right < len(density) else 0.0
+
+        boundaries += [left, walls[0], walls[1], right]
+        confidence += [_edge_confidence(density, left, 1, level_in[0], outside_left, edge_width),
+                       _wall_confidence(density, walls[0], *windows[0], min(level_in[0], level_in[1]), min_wall_bins),
+                       _wall_confidence(density, walls[1], *windows[1], min(level_in[1], level_in[2]), min_wall_bins),
+                       _edge_confidence(density, right - 1, -1, level_in[2], outside_right, edge_width)]
+
+    return [float(origin + b * bin_width) for b in boundaries], [round(c, 3) for c in confidence]
+
+
+def detect_tank_boundaries(source, bin_width=DEFAULT_BIN_WIDTH, camera_split=DEFAULT_CAMERA_SPLIT,
+                           sample_blocks=64, cache=True, refresh=False):
+    """
+    Detects the 8 tank boundaries of a night from the density of its contours along cX.
+
+    A histogram of non-glare cX values is built from a sample of the table (see
+    boundaries_from_profile for how walls and the camera gap are found). The result
+    is cached next to a contour file as '<file>.tanks.json', so later calls (and
+    analyze_contours with tank_boundaries='auto') reuse it; a cache is ignored once
+    the file's size or modification time changes, when bin_width, camera_split or
+    sample_blocks differ, or when it comes from an older version of the detection.
+
+    Parameters:
+    - source (str, DataFrame or ContourTable): Contour table of one night, or an in-memory table.
+    - bin_width (float, optional): Histogram bin width in pixels (default: 5).
+    - camera_split (float, optional): Fallback split between the cameras (default: 2001).
+    - sample_blocks (int, optional): Frame-index blocks to sample from indexed files (default: 64).
+    - cache (bool, optional): Read and write the sidecar for file inputs (default: True).
+    - refresh (bool, optional): Ignore an existing sidecar (default: False).
+
+    Returns:
+    - dict: 'boundaries' (8 values), 'confidence' (8 scores between 0 and 1) and 'rows' (sample size).
+    """
+    sidecar = tanks_path(source) if cache and is_path(source) else None
+    key = {'bin_width': bin_width, 'camera_split': camera_split, 'sample_blocks': sample_blocks,
+           'version': TANKS_VERSION}
+    if sidecar is not None:
+        stat = os.stat(source)
+        key.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        if not refresh and os.path.exists(sidecar):
+            with open(sidecar) as f:
+                cached = json.load(f)
+            if all(cached.get(name) == value for name, value in key.items()):
+                return cached
+
+    cx = _sample_cx(source, sample_blocks)
+    cx = cx[np.isfinite(cx)]
+    if not len(cx):
+        raise ValueError("No contours to detect tank boundaries from")
+    edges = np.arange(np.floor(cx.min()), cx.max() + bin_width, bin_width)
+    profile, _ = np.histogram(cx, bins=edges)
+    boundaries, confidence = boundaries_from_profile(profile, bin_width=bin_width, origin=edges[0],
+                                                     camera_split=camera_split)
+
+    result = {'boundaries': boundaries, 'confidence': confidence, 'rows': int(len(cx)), **key}
+    if sidecar is not None:
+        with open(sidecar, 'w') as f:
+            json.dump(result, f, indent=1)
+    return result
+
+
+def background_profile(video_file, samples=25):
+    """
+    Builds a cX profile from the median background frame of a video.
+
+    Frames are sampled evenly through the video and their per-pixel median is taken,
+    which removes moving flashes. The profile is the mean brightness of each image
+    column; pass it to boundaries_from_profile (bin_width=1) when tank walls show
+    up as dark columns.
+
+    Parameters:
+    - video_file (str): Path of one video of the night.
+    - samples (int, optional): Number of frames to sample (default: 25).
+
+    Returns:
+    - ndarray: Mean brightness per image column of the median frame.
+    """
+    cap = cv2.VideoCapture(video_file)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for number in np.linspace(0, max(total - 1, 0), samples).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, number)
+        ret, frame = cap.read()
+        if ret:
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+    if not frames:
+        raise ValueError(f"Could not read frames from {video_file}")
+    return np.median(np.stack(frames), axis=0).mean(axis=0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Detect tank boundaries from contour density.")
+    parser.add_argument("files", nargs="+", help="Contour tables, one per night")
+    parser.add_argument("-b", "--bin_width", type=float, default=DEFAULT_BIN_WIDTH, help="Histogram bin width (default: 5)")
+    parser.add_argument("-r", "--refresh", action="store_true", help="Ignore cached results")
+    args = parser.parse_args()
+
+    for path in args.files:
+        result = detect_tank_boundaries(path, bin_width=args.bin_width, refresh=args.refresh)
+        print(path, ' '.join(f"{b:g}" for b in result['boundaries']),
+              'confidence', ' '.join(f"{c:.2f}" for c in result['confidence']))
@@ -4,6 +4,9 @@ import concurrent.futures
 import gc
 import glob
 from tqdm.auto import tqdm
+from .frame_index import FrameIndexWriter
+from .table_io import open_table
+from .tank_layout import load_layout
 
 def adjust_clip(image, black=0):
     table = np.concatenate((
@@ -12,7 +15,7 @@ def adjust_clip(image, black=0):
     ))
     return cv2.LUT(image, table)
 
-def process_frame(frametext, frame, frame_height, black, minArea, maxArea, video_file, maxy=None):
+def process_frame(frametext, frame, frame_height, black, minArea, maxArea, video_file, maxy=None, layout=None):
     clipped = adjust_clip(frame, black=black)
     imgray = cv2.cvtColor(clipped, cv2.COLOR_BGR2GRAY)
     _, thresh = cv2.threshold(imgray, black, 255, cv2.THRESH_TOZERO)
@@ -36,14 +39,21 @@ def process_frame(frametext, frame, frame_height, black, minArea, maxArea, video
                 min_val, max_val, _, _ = cv2.minMaxLoc(imgray, mask=mask)
                 mean_val = cv2.mean(frame, mask=mask)
 
-                results.append((frametext, cX, cY_flipped, area, min_val, max_val, mean_val[0], video_file))
+                result = (frametext, cX, cY_flipped, area, min_val, max_val, mean_val[0], video_file)
+                if layout is not None:
+                    result += (layout.tank_at(cX, cY_flipped),)
+                results.append(result)
     return results
 
 def process_videos(video_files, black=110, minArea=1.5, maxArea=1000.0,
-                   brightnessThreshold=200, threads=2, outfile='output.tab', maxy=None):
+                   brightnessThreshold=200, threads=2, outfile='output.tab', maxy=None, layout=None):
     cv2.setNumThreads(threads)
-    writefile = open('contours_' + outfile, 'w')
-    writefile.write("frame\tcX\tcY\tarea\tminI\tmaxI\tmeanI\tvideo\n")
+    if layout is not None:
+        # Label tanks at write time from the layout raster
+        layout = load_layout(layout)
+    writefile = FrameIndexWriter(open_table('contours_' + outfile, 'w'), 'contours_' + outfile)
+    writefile.write_header("frame\tcX\tcY\tarea\tminI\tmaxI\tmeanI\tvideo" +
+                           ("\ttank" if layout is not None else "") + "\n")
 
     all_results = []
     cumulative_frame = 0
@@ -87,14 +97,14 @@ def process_videos(video_files, black=110, minArea=1.5, maxArea=1000.0,
                                 results = future.result()
                                 all_results.extend(results)
                                 for result in results:
-                                    writefile.write("\t".join(map(str, result)) + "\n")
+                                    writefile.write_row(result[0], "\t".join(map(str, result)) + "\n")
                             except Exception as exc:
                                 print(f"Frame {frame_id} generated an exception: {exc}")
                             del future_to_frame[future]
 
                     future = executor.submit(
                         process_frame, cumulative_frame, frame, frame_height,
-                        black, minArea, maxArea, video_file, maxy
+                        black, minArea, maxArea, video_file, maxy, layout
                     )
                     future_to_frame[future] = cumulative_frame
                     del frame
@@ -106,7 +116,7 @@ def process_videos(video_files, black=110, minArea=1.5, maxArea=1000.0,
                         results = future.result()
                         all_results.extend(results)
                         for result in results:
-                            writefile.write("\t".join(map(str, result)) + "\n")
+                            writefile.write_row(result[0], "\t".join(map(str, result)) + "\n")
                     except Exception as exc:
                         print(f"Frame {frame_id} generated an exception: {exc}")
 
@@ -116,12 +126,12 @@ def process_videos(video_files, black=110, minArea=1.5, maxArea=1000.0,
     return all_results
 
 def find_contours_from_videos(video_pattern, black=110, minArea=1.5, maxArea=1000.0,
-                              brightnessThreshold=200, threads=2, outfile='output.tab', maxy=None):
+                              brightnessThreshold=200, threads=2, outfile='output.tab', maxy=None, layout=None):
     video_files = sorted(glob.glob(video_pattern))
     if not video_files:
         print(f"No videos found matching pattern: {video_pattern}")
         return
-    return process_videos(video_files, black, minArea, maxArea, brightnessThreshold, threads, outfile, maxy)
+    return process_videos(video_files, black, minArea, maxArea, brightnessThreshold, threads, outfile, maxy, layout)
 
 # ---------- CLI wrapper ----------
 if __name__ == "__main__":
@@ -144,6 +154,8 @@ if __name__ == "__main__":
                         help="Number of threads for parallel processing (default: 2)")
     parser.add_argument("-o", "--outfile", default="output.tab",
                         help="Output filename (default: output.tab)")
+    parser.add_argument("-l", "--layout", default=None,
+                        help="Tank layout JSON; adds a tank column at write time")
 
     args = parser.parse_args()
 
@@ -155,6 +167,7 @@ if __name__ == "__main__":
         brightnessThreshold=args.brightness,
         threads=args.threads,
         outfile=args.outfile,
-        maxy=args.maxy
+        maxy=args.maxy,
+        layout=args.layout
     )
 
@@ -0,0 +1,222 @@
+# lunar/frame_index.py
+
+import io
+import mmap
+import os
+import numpy as np
+import pandas as pd
+from .table_io import compression_of, open_table
+
+INDEX_SUFFIX = '.fidx'
+INDEX_MAGIC = '#lunar-frame-index'
+DEFAULT_BLOCK_ROWS = 65536
+
+
+def index_path(path):
+    """
+    Returns the path of the frame-index sidecar that belongs to a contour table.
+
+    Parameters:
+    - path (str): Path to the tab-delimited contour table.
+
+    Returns:
+    - str: Path of the sidecar index file.
+    """
+    return str(path) + INDEX_SUFFIX
+
+
+class FrameIndexWriter:
+    """
+    Records a frame-range index while rows are written to a contour table.
+
+    Every `block_rows` data rows the writer notes the byte offset of the block,
+    and it keeps the smallest and largest frame seen in the block. Rows do not
+    have to arrive in frame order (the threaded extractor writes them as frames
+    finish), because each block stores its own frame range. Compressed tables
+    cannot be seeked by byte offset, so no sidecar is written for them.
+
+    Parameters:
+    - handle (file): Open text handle that the table is written to.
+    - path (str): Path of the table, used to place the sidecar on close().
+    - block_rows (int, optional): Number of data rows per index block (default: 65536).
+    """
+
+    def __init__(self, handle, path, block_rows=DEFAULT_BLOCK_ROWS):
+        self.handle = handle
+        self.path = path
+        self.block_rows = block_rows
+        self.byte_pos = 0
+        self.row_pos = 0
+        self.blocks = []
+
+    def write_header(self, line):
+        self.handle.write(line)
+        self.byte_pos += len(line.encode())
+
+    def write_row(self, frame, line):
+        if self.row_pos % self.block_rows == 0:
+            # row_offset, byte_offset, nrows, frame_min, frame_max
+            self.blocks.append([self.row_pos, self.byte_pos, 0, frame, frame])
+        block = self.blocks[-1]
+        block[2] += 1
+        block[3] = min(block[3], frame)
+        block[4] = max(block[4], frame)
+        self.handle.write(line)
+        self.byte_pos += len(line.encode())
+        self.row_pos += 1
+
+    def close(self):
+        self.handle.close()
+        if compression_of(self.path) is None:
+            _write_index(self.path, _blocks_frame(self.blocks), self.block_rows)
+
+
+def _blocks_frame(blocks):
+    return pd.DataFrame(blocks, columns=['row_offset', 'byte_offset', 'nrows', 'frame_min', 'frame_max'],
+                        dtype=np.int64)
+
+
+def _write_index(path, blocks, block_rows):
+    size = os.path.getsize(path)
+    with open(index_path(path), 'w') as out:
+        out.write(f"{INDEX_MAGIC}\tsize={size}\tblock_rows={block_rows}\n")
+        blocks.to_csv(out, sep='\t', index=False)
+
+
+def _row_byte_offsets(path, block_rows, bufsize=1 << 24):
+    """
+    Scans a table for newline positions and returns the byte offset of every
+    `block_rows`-th data row (row 0 starts after the header line).
+    """
+    size = os.path.getsize(path)
+    offsets = []
+    with open(path, 'rb') as f:
+        pos = 0
+        newlines = 0
+        while True:
+            buf = f.read(bufsize)
+            if not buf:
+                break
+            nl = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+            # Data row r starts right after newline number r
+            first = (-newlines) % block_rows
+            offsets.append(pos + nl[first::block_rows] + 1)
+            newlines += len(nl)
+            pos += len(buf)
+    offsets = np.concatenate(offsets) if offsets else np.empty(0, dtype=np.int64)
+    return offsets[offsets < size]
+
+
+def build_frame_index(path, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Builds (or rebuilds) the frame-range sidecar index for an existing contour table.
+
+    Parameters:
+    - path (str): Path to the tab-delimited contour table.
+    - block_rows (int, optional): Number of data rows per index block (default: 65536).
+
+    Returns:
+    - DataFrame: One row per block with row_offset, byte_offset, nrows, frame_min and frame_max.
+    """
+    if compression_of(path) is not None:
+        raise ValueError(f"Cannot build a frame index for compressed table {path}")
+    byte_offsets = _row_byte_offsets(path, block_rows)
+
+    blocks = []
+    row_offset = 0
+    with pd.read_csv(path, sep='\t', usecols=['frame'], chunksize=block_rows) as reader:
+        for chunk in reader:
+            frames = chunk['frame'].to_numpy()
+            blocks.append([row_offset, 0, len(frames), frames.min(), frames.max()])
+            row_offset += len(frames)
+
+    blocks = _blocks_frame(blocks)
+    blocks['byte_offset'] = byte_offsets[:len(blocks)]
+    _write_index(path, blocks, block_rows)
+    return blocks
+
+
+def load_frame_index(path, rebuild=True):
+    """
+    Loads the sidecar index of a contour table, rebuilding it when it is missing or stale.
+
+    The index is considered stale when the size recorded in it no longer matches
+    the size of the table (e.g. the table was rewritten after indexing).
+
+    Parameters:
+    - path (str): Path to the tab-delimited contour table.
+    - rebuild (bool, optional): Rebuild a missing or stale index (default: True).
+
+    Returns:
+    - DataFrame or None: The block index, or None if there is no valid index and rebuild is False
+      (always None for compressed tables).
+    """
+    if compression_of(path) is not None:
+        return None
+    sidecar = index_path(path)
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            meta = f.readline().rstrip('\n').split('\t')
+            if meta[0] == INDEX_MAGIC:
+                fields = dict(item.split('=', 1) for item in meta[1:])
+                if int(fields['size']) == os.path.getsize(path):
+                    return pd.read_csv(f, sep='\t', dtype=np.int64)
+    if not rebuild:
+        return None
+    return build_frame_index(path)
+
+
+def read_frames(path, start, stop, columns=None):
+    """
+    Reads only the rows whose frame lies in [start, stop] from a contour table.
+
+    The sidecar index is used to find the blocks whose frame range overlaps the
+    request; those byte ranges are sliced from a memory map of the table and
+    parsed, so the rest of the file is never read. Compressed tables have no
+    index and are scanned with streaming decompression instead.
+
+    Parameters:
+    - path (str): Path to the tab-delimited contour table.
+    - start (int): First frame to return (inclusive).
+    - stop (int): Last frame to return (inclusive).
+    - columns (list, optional): Columns to return (default: all columns).
+
+    Returns:
+    - DataFrame: The requested rows, indexed by their row number in the table.
+    """
+    with open_table(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+    usecols = header if columns is None else [c for c in header if c in columns or c == 'frame']
+
+    blocks = load_frame_index(path)
+    if blocks is None:
+        with open_table(path) as f:
+            chunks = [chunk[(chunk['frame'] >= start) & (chunk['frame'] <= stop)]
+                      for chunk in pd.read_csv(f, sep='\t', usecols=usecols, chunksize=DEFAULT_BLOCK_ROWS * 16)]
+        data = pd.concat(chunks)
+        return data if columns is None else data[list(columns)]
+
+    hits = blocks[(blocks['frame_max'] >= start) & (blocks['frame_min'] <= stop)]
+    if hits.empty:
+        return pd.DataFrame(columns=usecols if columns is None else list(columns))
+
+    # Merge adjacent blocks into contiguous byte ranges
+    new_run = np.diff(hits.index.to_numpy(), prepend=-2) != 1
+    run_id = np.cumsum(new_run)
+    size = os.path.getsize(path)
+    ends = np.append(blocks['byte_offset'].to_numpy()[1:], size)
+
+    pieces = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for _, run in hits.groupby(run_id):
+            first, last = run.index[0], run.index[-1]
+            raw = mm[blocks.at[first, 'byte_offset']:ends[last]]
+            piece = pd.read_csv(io.BytesIO(raw), sep='\t', header=None, names=header, usecols=usecols)
+            piece.index = pd.RangeIndex(blocks.at[first, 'row_offset'],
+                                        blocks.at[first, 'row_offset'] + len(piece))
+            pieces.append(piece[(piece['frame'] >= start) & (piece['frame'] <= stop)])
+
+    data = pd.concat(pieces)
+    if columns is not None:
+        data = data[list(columns)]
+    return data
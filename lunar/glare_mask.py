@@ -0,0 +1,191 @@
+# lunar/glare_mask.py
+
+import os
+import numpy as np
+from .loader import iter_contours
+from .query import night_label
+
+DEFAULT_CELL_SIZE = 8
+
+
+class GlareMask:
+    """
+    Occupancy raster of confirmed glare locations for one camera layout, accumulated across nights.
+
+    The image plane is divided into square cells of `cell_size` pixels. For every
+    cell the mask counts all contours, the contours labeled as glare, and the nights
+    in which the cell held glare. A cell is a hotspot when at least `min_fraction`
+    of its contours were glare and it held glare in at least `min_nights` nights;
+    rows of a new night that fall in a hotspot can then be marked as glare with a
+    single raster lookup.
+
+    Parameters:
+    - cell_size (int, optional): Cell edge in pixels (default: 8).
+    - min_fraction (float, optional): Glare fraction a cell needs to be a hotspot (default: 0.9).
+    - min_nights (int, optional): Number of nights with glare a cell needs to be a hotspot (default: 2).
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, min_fraction=0.9, min_nights=2):
+        self.cell_size = cell_size
+        self.min_fraction = min_fraction
+        self.min_nights = min_nights
+        self.rows = np.zeros((0, 0), dtype=np.int64)
+        self.glare = np.zeros((0, 0), dtype=np.int64)
+        self.glare_nights = np.zeros((0, 0), dtype=np.int32)
+        self.nights = []
+
+    def __repr__(self):
+        return (f"GlareMask({len(self.nights)} nights, {self.rows.shape[1]}x{self.rows.shape[0]} cells "
+                f"of {self.cell_size}px, {int(self.hotspots().sum())} hotspots)")
+
+    @classmethod
+    def load(cls, path, min_fraction=0.9, min_nights=2):
+        """
+        Loads a mask saved with save().
+
+        Parameters:
+        - path (str): Path of the .npz mask file.
+        - min_fraction (float, optional): Hotspot glare fraction (default: 0.9).
+        - min_nights (int, optional): Hotspot night count (default: 2).
+
+        Returns:
+        - GlareMask: The stored mask.
+        """
+        with np.load(path, allow_pickle=False) as stored:
+            mask = cls(int(stored['cell_size']), min_fraction=min_fraction, min_nights=min_nights)
+            mask.rows = stored['rows']
+            mask.glare = stored['glare']
+            mask.glare_nights = stored['glare_nights']
+            mask.nights = [str(night) for night in stored['nights']]
+        return mask
+
+    def save(self, path):
+        """Writes the mask to an .npz file (written to a temporary name first, then renamed)."""
+        tmp = str(path) + '.tmp.npz'
+        np.savez_compressed(tmp, cell_size=self.cell_size, rows=self.rows, glare=self.glare,
+                            glare_nights=self.glare_nights, nights=np.array(self.nights, dtype=str))
+        os.replace(tmp, path)
+
+    def _grow(self, shape):
+        # Enlarge the rasters to at least `shape` cells (rows are cY cells, columns cX cells)
+        shape = (max(shape[0], self.rows.shape[0]), max(shape[1], self.rows.shape[1]))
+        if shape == self.rows.shape:
+            return
+        for name in ('rows', 'glare', 'glare_nights'):
+            old = getattr(self, name)
+            grown = np.zeros(shape, dtype=old.dtype)
+            grown[:old.shape[0], :old.shape[1]] = old
+            setattr(self, name, grown)
+
+    def _cells(self, cX, cY):
+        x = np.maximum(np.asarray(cX, dtype=np.float64) // self.cell_size, 0).astype(np.int64)
+        y = np.maximum(np.asarray(cY, dtype=np.float64) // self.cell_size, 0).astype(np.int64)
+        return y, x
+
+    def add_night(self, source, night=None, chunksize=None):
+        """
+        Adds the glare labels of one night to the mask.
+
+        Nights already in the mask are skipped, so re-running an update over a
+        directory of nights only adds the new ones.
+
+        Parameters:
+        - source (str, DataFrame or ContourTable): Glare-labeled contour table (needs cX, cY and glare).
+        - night (str, optional): Night label (default: the date in the file name).
+        - chunksize (int, optional): Rows read per chunk (default: from the loader's memory budget).
+
+        Returns:
+        - bool: True if the night was added, False if it was already in the mask.
+        """
+        if night is None:
+            if not isinstance(source, (str, os.PathLike)):
+                raise ValueError("night is required for in-memory tables")
+            night = night_label(source)
+        if night in self.nights:
+            return False
+
+        night_glare = np.zeros_like(self.glare)
+        for chunk in iter_contours(source, columns=['cX', 'cY', 'glare'], chunksize=chunksize):
+            y, x = self._cells(chunk['cX'], chunk['cY'])
+            if not len(y):
+                continue
+            self._grow((y.max() + 1, x.max() + 1))
+            if night_glare.shape != self.glare.shape:
+                grown = np.zeros(self.glare.shape, dtype=night_glare.dtype)
+                grown[:night_glare.shape[0], :night_glare.shape[1]] = night_glare
+                night_glare = grown
+            flat = np.ravel_multi_index((y, x), self.rows.shape)
+            is_glare = (chunk['glare'] == 'yes').to_numpy()
+            self.rows += np.bincount(flat, minlength=self.rows.size).reshape(self.rows.shape)
+            night_glare += np.bincount(flat[is_glare], minlength=self.rows.size).reshape(self.rows.shape)
+
+        self.glare += night_glare
+        self.glare_nights += night_glare > 0
+        self.nights.append(night)
+        return True
+
+    def hotspots(self):
+        """
+        Returns the boolean raster of hotspot cells under the current thresholds.
+
+        Returns:
+        - ndarray: 2D boolean array indexed by [cY cell, cX cell].
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(self.rows > 0, self.glare / self.rows, 0.0)
+        return (fraction >= self.min_fraction) & (self.glare_nights >= self.min_nights)
+
+    def lookup(self, cX, cY, hotspots=None):
+        """
+        Marks the contours that fall in a hotspot cell.
+
+        Parameters:
+        - cX (array-like): Contour x coordinates.
+        - cY (array-like): Contour y coordinates.
+        - hotspots (ndarray, optional): Precomputed hotspots() raster, to reuse across chunks.
+
+        Returns:
+        - ndarray: Boolean flag per contour; coordinates outside the raster are never hotspots.
+        """
+        if hotspots is None:
+            hotspots = self.hotspots()
+        y, x = self._cells(cX, cY)
+        inside = (y < hotspots.shape[0]) & (x < hotspots.shape[1])
+        hit = np.zeros(len(y), dtype=bool)
+        hit[inside] = hotspots[y[inside], x[inside]]
+        return hit
+
+
+def update_glare_mask(mask_path, files, cell_size=DEFAULT_CELL_SIZE, chunksize=None):
+    """
+    Adds glare-labeled nights to the mask stored at mask_path, creating it if needed.
+
+    Parameters:
+    - mask_path (str): Path of the .npz mask file for one camera layout.
+    - files (list): Glare-labeled contour tables, one per night.
+    - cell_size (int, optional): Cell edge in pixels for a new mask (default: 8).
+    - chunksize (int, optional): Rows read per chunk (default: from the loader's memory budget).
+
+    Returns:
+    - GlareMask: The updated mask.
+    """
+    mask = GlareMask.load(mask_path) if os.path.exists(mask_path) else GlareMask(cell_size)
+    for path in files:
+        if mask.add_night(path, chunksize=chunksize):
+            print(f"Added {path} to glare mask {mask_path}")
+        else:
+            print(f"{night_label(path)} is already in glare mask {mask_path}")
+    mask.save(mask_path)
+    return mask
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Accumulate glare-labeled nights into a glare hotspot mask.")
+    parser.add_argument("mask", help="Path of the .npz mask file for this camera layout")
+    parser.add_argument("files", nargs="+", help="Glare-labeled contour tables to add")
+    parser.add_argument("-c", "--cell_size", type=int, default=DEFAULT_CELL_SIZE, help="Cell size in pixels (default: 8)")
+    args = parser.parse_args()
+
+    print(update_glare_mask(args.mask, args.files, cell_size=args.cell_size))
@@ -0,0 +1,311 @@
+# lunar/glare_rules.py
+
+import json
+import os
+import numpy as np
+from .loader import iter_contours, table_columns, GLARE_LABELS
+from .contour_table import ContourTable
+from .table_io import open_table
+from .glare_mask import GlareMask
+
+# Keys of a rule set; see apply_glare_rules
+RULE_KEYS = ('clip', 'cx_bands', 'cy_bands', 'vertical', 'mask')
+
+
+def parse_bands(bands):
+    """
+    Parses exclusion bands given as a flat 'low,high,low,high' string or a list of numbers or pairs.
+
+    Parameters:
+    - bands (str or list): e.g. '100,200, 950,1010', [100, 200, 950, 1010] or [[100, 200], [950, 1010]].
+
+    Returns:
+    - list: (low, high) pairs with low <= high.
+    """
+    if isinstance(bands, str):
+        # Remove any spaces and split by commas
+        numbers = [float(x) for x in bands.replace(' ', '').split(',') if x]
+    elif isinstance(bands, (list, tuple)):
+        numbers = []
+        for item in bands:
+            numbers.extend(item if isinstance(item, (list, tuple)) else [item])
+    else:
+        raise ValueError("bands must be a string or a list/tuple of numbers")
+
+    # Ensure bands come in pairs of low and high values
+    if len(numbers) % 2 != 0:
+        raise ValueError("bands must contain pairs of low and high values")
+    return [(min(a, b), max(a, b)) for a, b in zip(numbers[0::2], numbers[1::2])]
+
+
+def band_edges(bands):
+    """
+    Merges open intervals (low, high) into a sorted array of disjoint interval edges.
+
+    Overlapping intervals are merged; intervals that only touch are kept apart,
+    because their shared endpoint belongs to neither of them.
+
+    Parameters:
+    - bands (list): (low, high) pairs.
+
+    Returns:
+    - ndarray: Edges [low1, high1, low2, high2, ...] in increasing order.
+    """
+    merged = []
+    for low, high in sorted(bands):
+        if low >= high:
+            continue
+        if merged and low < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return np.array(merged, dtype=np.float64).ravel()
+
+
+def in_bands(values, edges):
+    """
+    Tests which values lie strictly inside one of the intervals described by band_edges.
+
+    A value is inside an open interval exactly when an odd number of edges lies
+    below it and it is not itself an edge, which two binary searches answer.
+
+    Parameters:
+    - values (array-like): Values to test, e.g. cX.
+    - edges (ndarray): Output of band_edges.
+
+    Returns:
+    - ndarray: Boolean flag per value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    below = np.searchsorted(edges, values, side='left')
+    at_or_below = np.searchsorted(edges, values, side='right')
+    return (below == at_or_below) & (below % 2 == 1)
+
+
+def _add_counts(counts, frames, weights=None):
+    # Adds per-frame counts of one chunk to a running array indexed by frame number, growing it as needed
+    chunk_counts = np.bincount(frames, weights=weights, minlength=len(counts))
+    if len(chunk_counts) > len(counts):
+        counts = np.concatenate([counts, np.zeros(len(chunk_counts) - len(counts), dtype=counts.dtype)])
+    counts += chunk_counts.astype(counts.dtype)
+    return counts
+
+
+def _window_sums(counts, frame_range):
+    # Sums of counts over the trailing window of frame_range frames ending at each frame
+    cumulative = np.cumsum(counts)
+    sums = cumulative.copy()
+    sums[frame_range:] -= cumulative[:-frame_range]
+    return sums
+
+
+def _vertical_glare_chunk_arrays(chunk):
+    frames = np.asarray(chunk['frame'], dtype=np.int64)
+    if isinstance(chunk, ContourTable):
+        marked = chunk['glare'] == GLARE_LABELS.index('yes') if 'glare' in chunk else np.zeros(len(frames), dtype=bool)
+    else:
+        marked = (chunk['glare'] == 'yes').to_numpy() if 'glare' in chunk else np.zeros(len(frames), dtype=bool)
+    return frames, np.asarray(chunk['cY']), marked
+
+
+def vertical_glare_frames(source, vertical_glare_threshold, frame_range, cy_threshold_count, cy_cutoff,
+                          low_clip=None, hi_clip=None, chunksize=None, marker=None, marker_columns=()):
+    """
+    Finds the frames that check_vertical_glare marks as glare, in one streaming pass.
+
+    Per-frame totals, counts with cY > cy_cutoff and counts of rows already marked
+    as glare are accumulated into dense arrays indexed by frame number with
+    np.bincount. Trailing window sums over frame_range frames (frames f - frame_range + 1
+    to f) come from cumulative sums, so the window always spans the same number of
+    frames regardless of how many contours each frame holds. Memory is proportional
+    to the number of frames, not rows.
+
+    Parameters:
+    - source (str, DataFrame or ContourTable): Path to a tab-delimited contour file, or an in-memory table.
+    - vertical_glare_threshold (int): The minimum number of total contours required in a range to consider it for glare.
+    - frame_range (int): The number of frames in the trailing window.
+    - cy_threshold_count (int): The minimum number of contours with cY exceeding the cutoff in the window.
+    - cy_cutoff (float): The cutoff value for cY to consider it for glare.
+    - low_clip (int, optional): Frames below low_clip are glare.
+    - hi_clip (int, optional): Frames above hi_clip are glare.
+    - chunksize (int, optional): Rows read per chunk when streaming a file (default: from the loader's memory budget).
+    - marker (callable, optional): Function of a chunk returning a boolean array of further rows to treat
+      as already marked, e.g. by other glare rules (default: None).
+    - marker_columns (list, optional): Extra columns the marker needs (default: none).
+
+    Returns:
+    - ndarray: Boolean glare flag indexed by frame number (frames beyond the end of the array are not glare).
+    """
+    total = np.zeros(0, dtype=np.int64)
+    above = np.zeros(0, dtype=np.int64)
+    marked = np.zeros(0, dtype=np.int64)
+
+    if isinstance(source, ContourTable):
+        chunks = [source]
+    else:
+        columns = ['frame', 'cY'] + (['glare'] if 'glare' in table_columns(source) else [])
+        columns += [name for name in marker_columns if name not in columns]
+        chunks = iter_contours(source, columns=columns, chunksize=chunksize)
+    for chunk in chunks:
+        frames, cy, chunk_marked = _vertical_glare_chunk_arrays(chunk)
+        if marker is not None:
+            chunk_marked = chunk_marked | marker(chunk)
+        total = _add_counts(total, frames)
+        above = _add_counts(above, frames, weights=cy > cy_cutoff)
+        marked = _add_counts(marked, frames, weights=chunk_marked)
+
+    glare = (_window_sums(total, frame_range) >= vertical_glare_threshold) & \
+            (_window_sums(above, frame_range) >= cy_threshold_count)
+    glare |= marked > 0
+    frame_numbers = np.arange(len(total))
+    if low_clip is not None:
+        glare |= frame_numbers < low_clip
+    if hi_clip is not None:
+        glare |= frame_numbers > hi_clip
+    return glare
+
+
+def glare_of_frames(glare_frames, frames, low_clip=None, hi_clip=None):
+    """
+    Looks up the per-frame flags of vertical_glare_frames for each row.
+
+    Parameters:
+    - glare_frames (ndarray): Boolean flags indexed by frame number.
+    - frames (array-like): Frame number of each row.
+    - low_clip (int, optional): The lower frame limit passed to vertical_glare_frames.
+    - hi_clip (int, optional): The upper frame limit; frames past the flag array are only glare when above it.
+
+    Returns:
+    - ndarray: Boolean glare flag per row.
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    inside = frames < len(glare_frames)
+    glare = np.zeros(len(frames), dtype=bool)
+    glare[inside] = glare_frames[frames[inside]]
+    if hi_clip is not None:
+        glare |= frames > hi_clip
+    return glare
+
+
+def load_glare_rules(rules):
+    """
+    Returns a rule set as a dict, reading it from a JSON file if a path is given.
+
+    Parameters:
+    - rules (str or dict): Path of a JSON rule file, or the rules themselves.
+
+    Returns:
+    - dict: The rule set.
+    """
+    if isinstance(rules, (str, os.PathLike)):
+        with open(rules) as f:
+            rules = json.load(f)
+    unknown = set(rules) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown glare rules {sorted(unknown)}; expected some of {list(RULE_KEYS)}")
+    return rules
+
+
+def _row_marker(rules):
+    """
+    Builds the row-level part of a rule set (clip, bands and mask) as a function of a chunk.
+
+    Returns:
+    - tuple: (marker, columns) where marker(chunk) returns a boolean array and columns
+      are the columns it reads.
+    """
+    low_clip, hi_clip = rules.get('clip') or (None, None)
+    cx_edges = band_edges(parse_bands(rules['cx_bands'])) if rules.get('cx_bands') else None
+    cy_edges = band_edges(parse_bands(rules['cy_bands'])) if rules.get('cy_bands') else None
+    mask = rules.get('mask')
+    if isinstance(mask, (str, os.PathLike)):
+        mask = GlareMask.load(mask)
+    hotspots = mask.hotspots() if mask is not None else None
+
+    columns = []
+    if low_clip is not None or hi_clip is not None:
+        columns.append('frame')
+    if cx_edges is not None or mask is not None:
+        columns.append('cX')
+    if cy_edges is not None or mask is not None:
+        columns.append('cY')
+
+    def marker(chunk):
+        marked = np.zeros(len(chunk), dtype=bool)
+        if low_clip is not None:
+            marked |= np.asarray(chunk['frame']) < low_clip
+        if hi_clip is not None:
+            marked |= np.asarray(chunk['frame']) > hi_clip
+        if cx_edges is not None:
+            marked |= in_bands(chunk['cX'], cx_edges)
+        if cy_edges is not None:
+            marked |= in_bands(chunk['cY'], cy_edges)
+        if mask is not None:
+            marked |= mask.lookup(chunk['cX'], chunk['cY'], hotspots)
+        return marked
+
+    return marker, columns
+
+
+def apply_glare_rules(input_file, output_file, rules, chunksize=None):
+    """
+    Marks glare with a declarative rule set in one streaming pass over a contour table.
+
+    Rules (all optional):
+    - 'clip': [low_clip, hi_clip] - frames below low_clip or above hi_clip are glare (either may be null).
+    - 'cx_bands': cX exclusion bands, e.g. [[100, 200], [950, 1010]] or '100,200,950,1010';
+      rows with low < cX < high are glare.
+    - 'cy_bands': cY exclusion bands, in the same form.
+    - 'vertical': {'vertical_glare_threshold', 'frame_range', 'cy_threshold_count', 'cy_cutoff'},
+      the parameters of check_vertical_glare.
+    - 'mask': path of a GlareMask (.npz) or a GlareMask; rows in hotspot cells are glare.
+
+    Rows already labeled 'yes' stay glare. The row rules are vectorized masks (the bands
+    use a binary search over merged interval edges). The vertical rule needs per-frame
+    counts first, so it adds a counting pass that keeps only arrays the size of the
+    number of frames; as in check_vertical_glare, every row of a frame that holds glare
+    (from any rule) becomes glare. Memory stays bounded by the chunk size.
+
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - output_file (str): Path to the output file.
+    - rules (str or dict): The rule set, or the path of a JSON file holding it.
+    - chunksize (int, optional): Rows per chunk (default: from the loader's memory budget).
+
+    Returns:
+    - int: The number of rows marked as glare.
+    """
+    rules = load_glare_rules(rules)
+    marker, columns = _row_marker(rules)
+    low_clip, hi_clip = rules.get('clip') or (None, None)
+
+    glare_frames = None
+    if rules.get('vertical'):
+        glare_frames = vertical_glare_frames(input_file, **rules['vertical'], low_clip=low_clip, hi_clip=hi_clip,
+                                             chunksize=chunksize, marker=marker, marker_columns=columns)
+
+    marked = 0
+    with open_table(output_file, 'w') as output:
+        for number, chunk in enumerate(iter_contours(input_file, chunksize=chunksize)):
+            glare = marker(chunk)
+            if 'glare' in chunk:
+                glare |= (chunk['glare'] == 'yes').to_numpy()
+            if glare_frames is not None:
+                glare |= glare_of_frames(glare_frames, chunk['frame'], low_clip, hi_clip)
+            chunk['glare'] = np.where(glare, 'yes', 'no')
+            chunk.to_csv(output, sep='\t', index=False, header=number == 0)
+            marked += int(glare.sum())
+    return marked
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mark glare in a contour table with a JSON rule set.")
+    parser.add_argument("input_file", help="Contour table")
+    parser.add_argument("output_file", help="Output table")
+    parser.add_argument("rules", help="JSON rule file")
+    args = parser.parse_args()
+
+    marked = apply_glare_rules(args.input_file, args.output_file, args.rules)
+    print(f"Marked {marked} rows as glare. Results saved to {args.output_file}")
@@ -0,0 +1,153 @@
+# lunar/glare_sweep.py
+
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.cluster import DBSCAN
+from sklearn.neighbors import NearestNeighbors
+from .loader import iter_contours, is_path
+from .table_io import open_table
+from .identify_glare import normalize_data
+from .grid_glare import glare_from_labels
+
+GRAPH_SUFFIX = '.graphs'
+
+
+def neighbour_graph(data, radius):
+    """
+    Computes the sparse radius-neighbour graph of normalized data.
+
+    Parameters:
+    - data (ndarray): Normalized data, shape (n, d).
+    - radius (float): Largest eps that the graph will be used for.
+
+    Returns:
+    - csr_matrix: n x n matrix holding the distance of every pair closer than radius.
+    """
+    nn = NearestNeighbors(radius=radius).fit(data)
+    return nn.radius_neighbors_graph(data, mode='distance', sort_results=True).tocsr()
+
+
+def _cached_graph(cache_dir, key, data, radius):
+    """
+    Loads a chunk's graph from the cache, computing and saving it if missing.
+
+    Graphs are saved as '<key>_r<radius>.npz'. A graph cached for a larger radius
+    holds every edge of a smaller one (DBSCAN on the precomputed graph only keeps
+    the edges within eps), so the smallest cached graph of at least `radius` is used.
+    """
+    if cache_dir is None:
+        return neighbour_graph(data, radius)
+    prefix = key + '_r'
+    cached = []
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and name.endswith('.npz'):
+                try:
+                    cached.append((float(name[len(prefix):-len('.npz')]), name))
+                except ValueError:
+                    continue
+    usable = [(r, name) for r, name in cached if r >= radius]
+    if usable:
+        return sparse.load_npz(os.path.join(cache_dir, min(usable)[1])).tocsr()
+    graph = neighbour_graph(data, radius)
+    os.makedirs(cache_dir, exist_ok=True)
+    sparse.save_npz(os.path.join(cache_dir, f'{prefix}{radius!r}.npz'), graph)
+    # Graphs of smaller radii are covered by this one
+    for _, name in cached:
+        os.remove(os.path.join(cache_dir, name))
+    return graph
+
+
+def setting_column(eps, min_samples, min_cluster_size):
+    """Returns the name of the label column of one sweep setting, e.g. 'glare_e0.5_s5_c10'."""
+    return f'glare_e{eps:g}_s{min_samples}_c{min_cluster_size}'
+
+
+def sweep_glare(input_file, eps_values, min_samples_values, min_cluster_sizes, chunksize=100000,
+                cache_dir='auto', labels_file=None):
+    """
+    Evaluates many DBSCAN glare settings from one neighbour graph per chunk.
+
+    Chunks are read and normalized exactly as in process_large_file (mode='chunk').
+    For each chunk the radius-neighbour graph is computed once at the largest eps
+    and cached on disk as a sparse matrix; every (eps, min_samples) pair is then
+    clustered with DBSCAN on the precomputed graph, which only keeps the edges
+    within eps, and every min_cluster_size is applied to the resulting labels.
+    A second sweep over the same file (same size and modification time) and chunksize
+    reuses the cached graphs whenever its largest eps is not larger than that of an
+    earlier sweep; otherwise the graphs are rebuilt at the new radius and replace
+    the smaller ones.
+
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - eps_values (list): Epsilon values to try.
+    - min_samples_values (list): min_samples values to try.
+    - min_cluster_sizes (list): min_cluster_size values to try.
+    - chunksize (int, optional): Chunk size, as in process_large_file (default: 100000).
+    - cache_dir (str, optional): Directory for the cached graphs; 'auto' (default) uses
+      '<input_file>.graphs' for files and no disk cache for in-memory tables; None disables caching.
+    - labels_file (str, optional): If given, the input is written here with one yes/no column per
+      setting, named by setting_column (default: None).
+
+    Returns:
+    - DataFrame: One row per setting with eps, min_samples, min_cluster_size, rows, glare_rows
+      and glare_fraction.
+    """
+    settings = list(itertools.product(sorted(eps_values), sorted(min_samples_values), sorted(min_cluster_sizes)))
+    max_eps = max(eps_values)
+    if cache_dir == 'auto':
+        cache_dir = str(input_file) + GRAPH_SUFFIX if is_path(input_file) else None
+    # Graphs depend on the file contents and the chunking; the radius is part of each graph's name
+    if is_path(input_file):
+        stamp = f'{os.path.getsize(input_file)}_{os.stat(input_file).st_mtime_ns}_{chunksize}'
+    else:
+        stamp = f'{chunksize}'
+
+    glare_rows = np.zeros(len(settings), dtype=np.int64)
+    rows = 0
+    output = open_table(labels_file, 'w') if labels_file is not None else None
+    try:
+        for number, chunk in enumerate(iter_contours(input_file, chunksize=chunksize)):
+            graph = _cached_graph(cache_dir, f'{stamp}_{number:05d}', normalize_data(chunk), max_eps)
+            rows += len(chunk)
+
+            labels = {}
+            for i, (eps, min_samples, min_cluster_size) in enumerate(settings):
+                if (eps, min_samples) not in labels:
+                    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+                    labels[eps, min_samples] = dbscan.fit_predict(graph)
+                glare = glare_from_labels(labels[eps, min_samples], min_cluster_size)
+                glare_rows[i] += glare.sum()
+                if output is not None:
+                    chunk[setting_column(eps, min_samples, min_cluster_size)] = np.where(glare, 'yes', 'no')
+
+            if output is not None:
+                chunk.to_csv(output, sep='\t', index=False, header=number == 0)
+    finally:
+        if output is not None:
+            output.close()
+
+    result = pd.DataFrame(settings, columns=['eps', 'min_samples', 'min_cluster_size'])
+    result['rows'] = rows
+    result['glare_rows'] = glare_rows
+    result['glare_fraction'] = glare_rows / max(rows, 1)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sweep DBSCAN glare settings over a contour table.")
+    parser.add_argument("input_file", help="Contour table to cluster")
+    parser.add_argument("-e", "--eps", type=float, nargs="+", required=True, help="Epsilon values")
+    parser.add_argument("-s", "--min_samples", type=int, nargs="+", required=True, help="min_samples values")
+    parser.add_argument("-m", "--min_cluster_size", type=int, nargs="+", required=True, help="min_cluster_size values")
+    parser.add_argument("-c", "--chunksize", type=int, default=100000, help="Chunk size (default: 100000)")
+    parser.add_argument("-l", "--labels", default=None, help="Write per-setting glare columns to this file")
+    args = parser.parse_args()
+
+    print(sweep_glare(args.input_file, args.eps, args.min_samples, args.min_cluster_size,
+                      chunksize=args.chunksize, labels_file=args.labels).to_string(index=False))
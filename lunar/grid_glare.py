@@ -0,0 +1,122 @@
+# lunar/grid_glare.py
+
+import itertools
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def _ball_offsets(ndim, reach):
+    """
+    Returns the nonzero cell offsets whose cell centres lie within eps of cell 0.
+
+    With cells of side eps / sqrt(ndim) these cells tile the eps-ball around a
+    cell centre closely, so their point counts estimate a DBSCAN neighbourhood.
+    """
+    offsets = np.array(list(itertools.product(range(-reach, reach + 1), repeat=ndim)), dtype=np.int64)
+    keep = ((offsets ** 2).sum(axis=1) <= ndim) & np.any(offsets != 0, axis=1)
+    return offsets[keep]
+
+
+def _lookup(sorted_keys, targets):
+    # Positions of targets in sorted_keys and whether each target is present
+    pos = np.minimum(np.searchsorted(sorted_keys, targets), len(sorted_keys) - 1)
+    return pos, sorted_keys[pos] == targets
+
+
+def grid_cluster(data, eps, min_samples):
+    """
+    Density clustering on a hash grid, a linear-time stand-in for DBSCAN.
+
+    Points are binned into cells of side eps / sqrt(d). The eps-neighbourhood of
+    a cell is approximated by the cells whose centres lie within eps of its
+    centre, and a cell whose neighbourhood holds at least min_samples points is
+    dense (its points count as core points). Dense cells within each other's
+    neighbourhood are joined into connected components, and points of sparse
+    cells take the component of a dense cell in their neighbourhood (border
+    points) or stay noise. Cell lookups are vectorized with a sorted-key search
+    over a fixed set of offsets, so the cost is linear in the number of points.
+
+    Because densities are counted per cell rather than per point, the result
+    differs from DBSCAN near cluster edges; compare_glare_detectors reports the
+    agreement on a given table.
+
+    Parameters:
+    - data (ndarray): Normalized data for clustering, shape (n, d).
+    - eps (float): Neighbourhood radius, as for DBSCAN.
+    - min_samples (int): Number of points a cell neighbourhood needs to be dense.
+
+    Returns:
+    - ndarray: Cluster labels for each sample in the data (-1 for noise).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    n, ndim = data.shape
+    if n == 0:
+        return np.full(0, -1, dtype=np.int64)
+
+    side = eps / np.sqrt(ndim)
+    reach = int(np.floor(np.sqrt(ndim)))
+    coords = np.floor(data / side).astype(np.int64)
+    # Pad every axis so that neighbour keys never wrap onto another row of the grid
+    coords -= coords.min(axis=0) - reach
+    extent = coords.max(axis=0) + reach + 1
+    if np.prod(extent.astype(np.float64)) >= 2 ** 62:
+        raise ValueError("Grid too large for eps; increase eps or normalize the data")
+    strides = np.cumprod(np.append(extent[1:], 1)[::-1])[::-1]
+
+    cells, cell_of_point, counts = np.unique(coords @ strides, return_inverse=True, return_counts=True)
+    cell_of_point = cell_of_point.ravel()
+    offsets = _ball_offsets(ndim, reach) @ strides
+
+    # Neighbourhood counts of every occupied cell
+    density = counts.copy()
+    for offset in offsets:
+        pos, hit = _lookup(cells, cells + offset)
+        density[hit] += counts[pos[hit]]
+    dense = density >= min_samples
+    dense_cells = cells[dense]
+
+    cell_label = np.full(len(cells), -1, dtype=np.int64)
+    if not len(dense_cells):
+        return cell_label[cell_of_point]
+
+    # Join neighbouring dense cells
+    rows, cols = [], []
+    for offset in offsets[offsets > 0]:
+        pos, hit = _lookup(dense_cells, dense_cells + offset)
+        rows.append(np.flatnonzero(hit))
+        cols.append(pos[hit])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                       shape=(len(dense_cells), len(dense_cells)))
+    _, component = connected_components(graph, directed=False)
+    cell_label[dense] = component
+
+    # Border points: sparse cells adopt the component of a dense cell in their neighbourhood
+    for offset in offsets:
+        open_cells = np.flatnonzero(cell_label == -1)
+        if not len(open_cells):
+            break
+        pos, hit = _lookup(dense_cells, cells[open_cells] + offset)
+        cell_label[open_cells[hit]] = component[pos[hit]]
+
+    return cell_label[cell_of_point]
+
+
+def glare_from_labels(labels, min_cluster_size):
+    """
+    Marks points of clusters with at least min_cluster_size members as glare.
+
+    Parameters:
+    - labels (ndarray): Cluster labels, -1 for noise.
+    - min_cluster_size (int): Minimum number of elements in a cluster to be considered glare.
+
+    Returns:
+    - ndarray: Boolean glare flag per point.
+    """
+    labels = np.asarray(labels)
+    clustered = labels >= 0
+    sizes = np.bincount(labels[clustered]) if clustered.any() else np.zeros(0, dtype=np.int64)
+    glare = np.zeros(len(labels), dtype=bool)
+    glare[clustered] = sizes[labels[clustered]] >= min_cluster_size
+    return glare
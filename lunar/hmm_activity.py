@@ -0,0 +1,358 @@
+# lunar/hmm_activity.py
+
+import numpy as np
+from scipy.special import gammaln
+from .classify1d import split_two, assign_classes
+
+EMISSIONS = ('poisson', 'gaussian')
+
+# The recursions run over sqrt(n) blocks of sqrt(n) frames. Each pass steps through the
+# frames of every block at once, so a night costs about 3 sqrt(n) vectorized steps
+# instead of n Python steps.
+
+
+def _blocks(log_emission):
+    """
+    Lays a (frame x state) array out as (frame-in-block x block x state), padded with zeros, so
+    every step through the blocks reads contiguous memory.
+
+    Returns:
+    - tuple: (blocked, tail), where frames tail.. of the last block are padding.
+    """
+    n, states = log_emission.shape
+    length = max(int(np.ceil(np.sqrt(n))), 1)
+    blocks = max(int(np.ceil(n / length)), 1)
+    blocked = np.zeros((blocks * length, states))
+    blocked[:n] = log_emission
+    return blocked.reshape(blocks, length, states).transpose(1, 0, 2).copy(), n - (blocks - 1) * length
+
+
+def _unblock(blocked, n):
+    # Inverse of _blocks
+    return blocked.transpose(1, 0, 2).reshape(-1, blocked.shape[2])[:n]
+
+
+def log_emissions(values, params):
+    """
+    Log-likelihood of every value under every state.
+
+    Parameters:
+    - values (ndarray): The series (per-frame counts).
+    - params (dict): HMM parameters (see fit_hmm).
+
+    Returns:
+    - ndarray: (frame x state) log-likelihoods.
+    """
+    values = np.asarray(values, dtype=np.float64)[:, None]
+    means = np.asarray(params['means'])[None, :]
+    if params['emission'] == 'poisson':
+        return values * np.log(means) - means - gammaln(values + 1)
+    variances = np.asarray(params['variances'])[None, :]
+    return -0.5 * (np.log(2 * np.pi * variances) + (values - means) ** 2 / variances)
+
+
+def forward_backward(log_emission, start, transitions):
+    """
+    Posterior state probabilities of a hidden Markov model.
+
+    The forward and backward recursions are scaled: every frame's emissions are
+    shifted by their largest log-likelihood and every forward vector is normalised,
+    with all the scale factors kept as logs, so long nights neither overflow nor
+    underflow. Both recursions are blocked (see _blocks): the products of each
+    block's transition-emission matrices give the vector entering every block, and
+    then all blocks are stepped through together.
+
+    Parameters:
+    - log_emission (ndarray): (frame x state) emission log-likelihoods.
+    - start (ndarray): Initial state probabilities.
+    - transitions (ndarray): (state x state) transition probabilities.
+
+    Returns:
+    - tuple: (posterior, transition_counts, log_likelihood), the (frame x state) state
+      probabilities, the expected number of each transition and the log-likelihood of the series.
+    """
+    n, states = log_emission.shape
+    shift = log_emission.max(axis=1)
+    blocked, tail = _blocks(log_emission - shift[:, None])
+    emission = np.exp(blocked)
+    length, blocks, _ = emission.shape
+    start = np.asarray(start, dtype=np.float64)
+    transitions = np.asarray(transitions, dtype=np.float64)
+
+    # Transfer matrix of every block (the padding frames leave the state unchanged)
+    product = np.broadcast_to(np.eye(states), (blocks, states, states)).copy()
+    for l in range(length):
+        last = product[-1].copy()
+        product = (product @ transitions) * emission[l, :, None, :]
+        if l == 0:
+            product[0] = np.tile(start * emission[0, 0], (states, 1))
+        if l >= tail:
+            product[-1] = last
+        product /= product.max(axis=(1, 2))[:, None, None]
+
+    # Vectors entering every block, forwards and backwards
+    entering = np.empty((blocks, states))
+    leaving = np.empty((blocks, states))
+    vector = np.full(states, 1.0 / states)
+    for k in range(blocks):
+        entering[k] = vector
+        vector = vector @ product[k]
+        vector /= vector.sum()
+    vector = np.full(states, 1.0 / states)
+    for k in range(blocks - 1, -1, -1):
+        leaving[k] = vector
+        vector = product[k] @ vector
+        vector /= vector.sum()
+
+    # Scaled forward and backward vectors of every frame
+    forward = np.empty_like(emission)
+    log_scale = np.zeros((length, blocks))
+    vector = entering
+    for l in range(length):
+        last = vector[-1].copy()
+        vector = (vector @ transitions) * emission[l]
+        if l == 0:
+            vector[0] = start * emission[0, 0]
+        if l >= tail:
+            vector[-1] = last
+        scale = vector.sum(axis=1)
+        vector /= scale[:, None]
+        forward[l] = vector
+        log_scale[l] = np.log(scale)
+    backward = np.empty_like(emission)
+    vector = leaving
+    for l in range(length - 1, -1, -1):
+        backward[l] = vector
+        last = vector[-1].copy()
+        vector = (emission[l] * vector) @ transitions.T
+        if l >= tail:
+            vector[-1] = last
+        vector /= vector.sum(axis=1)[:, None]
+
+    forward = _unblock(forward, n)
+    backward = _unblock(backward, n)
+    posterior = forward * backward
+    posterior /= posterior.sum(axis=1)[:, None]
+    # Expected transitions: sum over frames of forward[t, i] A[i, j] e[t+1, j] backward[t+1, j], normalised per t
+    weighted = _unblock(emission, n)[1:] * backward[1:]
+    norm = ((forward[:-1] @ transitions) * weighted).sum(axis=1)
+    transition_counts = transitions * ((forward[:-1] / norm[:, None]).T @ weighted)
+    log_likelihood = float(log_scale.sum() + shift.sum())
+    return posterior, transition_counts, log_likelihood
+
+
+def viterbi(log_emission, start, transitions):
+    """
+    Most likely state sequence of a hidden Markov model.
+
+    The max-product recursion runs in log space, blocked like forward_backward:
+    each block's best-path scores and the back-pointer map from its last frame to
+    the frame before it are combined across blocks, and every block is then traced
+    back at once.
+
+    Parameters:
+    - log_emission (ndarray): (frame x state) emission log-likelihoods.
+    - start (ndarray): Initial state probabilities.
+    - transitions (ndarray): (state x state) transition probabilities.
+
+    Returns:
+    - ndarray: State of every frame.
+    """
+    n, states = log_emission.shape
+    blocked, tail = _blocks(log_emission)
+    length, blocks, _ = blocked.shape
+    with np.errstate(divide='ignore'):
+        log_start = np.log(np.asarray(start, dtype=np.float64))
+        log_transitions = np.log(np.asarray(transitions, dtype=np.float64))
+    identity = np.arange(states)
+
+    # Best-path score of every block from each state before it to each state at its end
+    product = np.where(np.eye(states, dtype=bool), 0.0, -np.inf)
+    product = np.broadcast_to(product, (blocks, states, states)).copy()
+    for l in range(length):
+        last = product[-1].copy()
+        product = (product[:, :, :, None] + log_transitions).max(axis=2) + blocked[l, :, None, :]
+        if l == 0:
+            product[0] = np.tile(log_start + blocked[0, 0], (states, 1))
+        if l >= tail:
+            product[-1] = last
+        product -= product.max(axis=(1, 2))[:, None, None]
+
+    # Scores entering every block
+    entering = np.empty((blocks, states))
+    vector = np.zeros(states)
+    for k in range(blocks):
+        entering[k] = vector
+        vector = (vector[:, None] + product[k]).max(axis=0)
+        vector -= vector.max()
+
+    # Best previous state of every frame and state
+    pointers = np.empty((length, blocks, states), dtype=np.int8 if states < 128 else np.int64)
+    vector = entering
+    for l in range(length):
+        last = vector[-1].copy()
+        scores = vector[:, :, None] + log_transitions
+        pointers[l] = scores.argmax(axis=1)
+        vector = scores.max(axis=1) + blocked[l]
+        if l == 0:
+            vector[0] = log_start + blocked[0, 0]
+        if l >= tail:
+            vector[-1] = last
+            pointers[l, -1] = identity
+        vector -= vector.max(axis=1)[:, None]
+
+    # Map from the state at each block's end to the state at the end of the block before it
+    maps = np.broadcast_to(identity, (blocks, states)).copy()
+    for l in range(length - 1, -1, -1):
+        maps = np.take_along_axis(pointers[l], maps, axis=1)
+    ends = np.empty(blocks, dtype=np.int64)
+    ends[-1] = np.argmax(vector[-1])
+    for k in range(blocks - 1, 0, -1):
+        ends[k - 1] = maps[k, ends[k]]
+
+    # Trace every block back from its end state
+    path = np.empty((length, blocks, 1), dtype=np.int64)
+    state = ends
+    rows = np.arange(blocks)
+    for l in range(length - 1, -1, -1):
+        path[l, :, 0] = state
+        state = pointers[l, rows, state]
+    return _unblock(path, n)[:, 0]
+
+
+def _m_step(values, posterior, transition_counts, params):
+    # Re-estimates the parameters from the posteriors (keeping the old ones where a state is empty)
+    weight = posterior.sum(axis=0)
+    safe = np.maximum(weight, 1e-300)
+    means = (posterior * values[:, None]).sum(axis=0) / safe
+    params['means'] = np.where(weight > 0, means, params['means'])
+    if params['emission'] == 'poisson':
+        params['means'] = np.maximum(params['means'], 1e-6)
+    else:
+        variances = (posterior * (values[:, None] - params['means']) ** 2).sum(axis=0) / safe
+        params['variances'] = np.maximum(np.where(weight > 0, variances, params['variances']),
+                                         params['variance_floor'])
+    rows = transition_counts.sum(axis=1)
+    params['transitions'] = _limit_switching(
+        np.where(rows[:, None] > 0, transition_counts / np.maximum(rows, 1e-300)[:, None], params['transitions']),
+        params.get('min_bout'))
+    params['start'] = posterior[0]
+    return params
+
+
+def _limit_switching(transitions, min_bout):
+    # Raises the probability of staying in each state to at least 1 - 1 / min_bout, so bouts are
+    # expected to last min_bout frames or more, scaling down the probabilities of leaving it
+    if not min_bout or min_bout <= 1:
+        return transitions
+    stay = np.diag(transitions)
+    floor = 1 - 1 / min_bout
+    leave = 1 - stay
+    scale = np.where(leave > 0, (1 - np.maximum(stay, floor)) / np.maximum(leave, 1e-300), 0.0)
+    limited = transitions * scale[:, None]
+    np.fill_diagonal(limited, np.maximum(stay, floor))
+    return limited
+
+
+def init_hmm(values, emission='poisson', min_bout=None):
+    """
+    Starting parameters of a two-state activity HMM, from the optimal two-class split of the series.
+
+    Parameters:
+    - values (ndarray): Per-frame counts.
+    - emission (str, optional): 'poisson' (default) or 'gaussian'.
+    - min_bout (float, optional): Shortest expected bout length in frames (see fit_hmm).
+
+    Returns:
+    - dict: HMM parameters (see fit_hmm), or None when the series has a single value.
+    """
+    if emission not in EMISSIONS:
+        raise ValueError(f"emission must be one of {EMISSIONS}")
+    values = np.asarray(values, dtype=np.float64)
+    threshold = split_two(values)
+    if not np.isfinite(threshold):
+        return None
+    labels = assign_classes(values, threshold)
+    means = np.array([values[labels == 0].mean(), values[labels == 1].mean()])
+    # Transitions counted from the split, with one pseudo-count each
+    counts = np.ones((2, 2))
+    np.add.at(counts, (labels[:-1], labels[1:]), 1)
+    params = {'emission': emission, 'start': np.array([0.5, 0.5]), 'min_bout': min_bout,
+              'transitions': _limit_switching(counts / counts.sum(axis=1)[:, None], min_bout), 'means': means}
+    if emission == 'poisson':
+        params['means'] = np.maximum(means, 1e-6)
+    else:
+        floor = max(values.var() * 1e-6, 1e-12)
+        params['variance_floor'] = floor
+        params['variances'] = np.maximum([values[labels == 0].var(), values[labels == 1].var()], floor)
+    return params
+
+
+def fit_hmm(values, emission='poisson', n_iter=100, tol=1e-6, min_bout=None, params=None):
+    """
+    Fits a two-state (inactive/active) hidden Markov model to per-frame counts by expectation-maximisation.
+
+    Parameters:
+    - values (array-like): Per-frame counts.
+    - emission (str, optional): 'poisson' (default) or 'gaussian' emissions.
+    - n_iter (int, optional): Maximum number of EM iterations (default: 100).
+    - tol (float, optional): Stop when the log-likelihood improves by less than this fraction (default: 1e-6).
+    - min_bout (float, optional): Shortest expected bout length in frames; the probability of staying in
+      a state is kept at or above 1 - 1 / min_bout, so the states cannot fit frame-to-frame noise
+      (default: None, no limit).
+    - params (dict, optional): Starting parameters (default: from init_hmm).
+
+    Returns:
+    - dict: Parameters 'emission', 'start', 'transitions' and 'means' (and 'variances' for Gaussian
+      emissions), with state 1 the more active one, plus 'log_likelihood' and 'iterations'; None when
+      the series has a single value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    params = init_hmm(values, emission, min_bout) if params is None else dict(params)
+    if params is None:
+        return None
+    if min_bout is not None:
+        params['min_bout'] = min_bout
+    previous = -np.inf
+    for iteration in range(1, n_iter + 1):
+        posterior, transition_counts, log_likelihood = forward_backward(
+            log_emissions(values, params), params['start'], params['transitions'])
+        params = _m_step(values, posterior, transition_counts, params)
+        converged = log_likelihood - previous < tol * abs(log_likelihood)
+        previous = log_likelihood
+        if converged:
+            break
+    params['log_likelihood'] = previous
+    params['iterations'] = iteration
+
+    # State 1 is the state with more contours
+    if params['means'][0] > params['means'][1]:
+        order = [1, 0]
+        params['start'] = params['start'][order]
+        params['transitions'] = params['transitions'][np.ix_(order, order)]
+        params['means'] = params['means'][order]
+        if emission == 'gaussian':
+            params['variances'] = params['variances'][order]
+    return params
+
+
+def segment_activity(values, emission='poisson', n_iter=100, tol=1e-6, min_bout=None):
+    """
+    Labels every frame active or inactive with a two-state HMM (fit_hmm, then Viterbi decoding).
+
+    Parameters:
+    - values (array-like): Per-frame counts.
+    - emission (str, optional): 'poisson' (default) or 'gaussian' emissions.
+    - n_iter (int, optional): Maximum number of EM iterations (default: 100).
+    - tol (float, optional): Relative log-likelihood tolerance of the fit (default: 1e-6).
+    - min_bout (float, optional): Shortest expected bout length in frames (see fit_hmm).
+
+    Returns:
+    - tuple: (states, params), the state of every frame (1 = active) and the fitted parameters.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    params = fit_hmm(values, emission, n_iter=n_iter, tol=tol, min_bout=min_bout)
+    if params is None:
+        return np.zeros(len(values), dtype=np.int64), None
+    states = viterbi(log_emissions(values, params), params['start'], params['transitions'])
+    return states, params
@@ -1,11 +1,28 @@
 # lunar/identify_glare.py
 
+import os
+import tempfile
+import time
+from functools import partial
 import pandas as pd
 import numpy as np
 import glob
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import NearestNeighbors
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .loader import read_contours, iter_contours, GLARE_LABELS
+from .contour_table import ContourTable
+from .table_io import open_table, write_table
+from .grid_glare import grid_cluster, glare_from_labels
+from .parallel import ordered_map
+from .glare_mask import GlareMask
+from .glare_rules import vertical_glare_frames, glare_of_frames, parse_bands, apply_glare_rules
+from .classify1d import natural_breaks, assign_classes
+
+# Types the glare stage has always read its input with; they set the number format of its output
+GLARE_INPUT_DTYPES = {'cX': np.float32, 'cY': np.float32, 'frame': np.int32, 'area': np.float32}
 
 def normalize_data(data):
     """
@@ -39,12 +56,12 @@ def cluster_data(data, eps, min_samples):
 
 def concatenate_and_cluster(file_path_pattern: str, n_clusters: int, output_file: str) -> None:
     """
-    Concatenate multiple tab-delimited files, perform k-means clustering on the 'average_contours' column,
-    and write the result to an output file.
+    Concatenate multiple tab-delimited files, split the 'average_contours' column into n_clusters classes
+    (optimal 1D k-means, numbered from the lowest), and write the result to an output file.
     
     Parameters:
     - file_path_pattern: str, file path pattern to match multiple files using an asterisk (e.g., 'data/*.txt').
-    - n_clusters: int, the number of clusters to create with k-means.
+    - n_clusters: int, the number of classes to create.
     - output_file: str, the filename to save the concatenated and clustered data.
     
     Returns:
@@ -52,110 +69,384 @@ def concatenate_and_cluster(file_path_pattern: str, n_clusters: int, output_file
     """
     # Step 1: Concatenate all files matching the pattern
     file_list = glob.glob(file_path_pattern)
-    df_list = [pd.read_csv(file, delimiter='\t') for file in file_list]
+    df_list = [read_contours(file) for file in file_list]
     combined_df = pd.concat(df_list, ignore_index=True)
     
-    # Step 2: Perform k-means clustering on 'average_contours'
-    kmeans = KMeans(n_clusters=n_clusters, n_init = 'auto', random_state=42)
-    combined_df['kclusters'] = kmeans.fit_predict(combined_df[['average_contours']])
+    # Step 2: Split 'average_contours' into its optimal classes (natural breaks, as k-means would),
+    # numbered from the lowest
+    breaks = natural_breaks(combined_df['average_contours'], n_clusters)
+    combined_df['kclusters'] = assign_classes(combined_df['average_contours'], breaks)
     
     # Step 3: Write the result to the output file
-    combined_df.to_csv(output_file, sep='\t', index=False)
+    write_table(combined_df, output_file)
 
 # Example usage:
 # concatenate_and_cluster('data/*.txt', 3, 'clustered_output.txt')
 
 
-def process_large_file(input_file, output_file, min_cluster_size, eps=0.5, min_samples=5, chunksize=100000):
+def process_large_file(input_file, output_file, min_cluster_size, eps=0.5, min_samples=5, chunksize=100000,
+                       mode='chunk', method='dbscan', workers=1, glare_mask=None):
     """
     Processes a large input file in chunks, applying DBSCAN clustering to identify glare.
 
     Parameters:
-    - input_file (str): Path to the input tab-delimited file.
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
     - output_file (str): Path to the output file.
     - min_cluster_size (int): Minimum number of elements in a cluster to be considered glare.
     - eps (float, optional): Epsilon parameter for DBSCAN (default: 0.5).
     - min_samples (int, optional): Minimum number of samples for a cluster in DBSCAN (default: 5).
     - chunksize (int, optional): Chunk size for processing large files (default: 100000).
+    - mode (str, optional): 'chunk' clusters each chunk on its own with its own scaling (default);
+      'window' clusters frame-ordered windows with a halo overlap, global scaling and cluster
+      IDs merged across window seams (see process_large_file_windowed).
+    - method (str, optional): 'dbscan' (default) or 'grid' for the linear-time grid-hash
+      detector of lunar.grid_glare (chunk mode only).
+    - workers (int, optional): Number of processes clustering chunks in parallel (default: 1);
+      at most 2 * workers chunks are held in memory (chunk mode only).
+    - glare_mask (str or GlareMask, optional): Cross-night hotspot mask of this camera layout
+      (see lunar.glare_mask). Rows in hotspot cells are marked as glare by lookup and only the
+      remaining rows are clustered (chunk mode only; default: None).
+    """
+    if method not in ('dbscan', 'grid'):
+        raise ValueError("method must be 'dbscan' or 'grid'")
+    if mode == 'window':
+        if method != 'dbscan' or workers != 1 or glare_mask is not None:
+            raise ValueError("mode='window' does not support method='grid', workers or glare_mask")
+        return process_large_file_windowed(input_file, output_file, min_cluster_size, eps=eps,
+                                           min_samples=min_samples, chunksize=chunksize)
+    if mode != 'chunk':
+        raise ValueError("mode must be 'chunk' or 'window'")
+
+    if isinstance(glare_mask, (str, os.PathLike)):
+        glare_mask = GlareMask.load(glare_mask)
+    hotspots = glare_mask.hotspots() if glare_mask is not None else None
+
+    label = partial(_label_chunk, min_cluster_size=min_cluster_size, eps=eps, min_samples=min_samples, method=method,
+                    glare_mask=glare_mask, hotspots=hotspots)
+    chunks = iter_contours(input_file, chunksize=chunksize, dtype=GLARE_INPUT_DTYPES)
+
+    # Prepare to write the output file; chunks are clustered in a pool and written in row order
+    with open_table(output_file, 'w') as output:
+        for text in ordered_map(label, ((chunk, number == 0) for number, chunk in enumerate(chunks)),
+                                workers=workers):
+            output.write(text)
+
+def _label_chunk(item, min_cluster_size, eps, min_samples, method, glare_mask=None, hotspots=None):
     """
-    # Prepare to write the output file
-    with pd.read_csv(input_file, sep='\t', chunksize=chunksize, 
-                     dtype={'cX': np.float32, 'cY': np.float32, 'frame': np.int32, 'area': np.float32}) as reader, \
-         open(output_file, 'w') as output:
-        first_chunk = True
+    Clusters one chunk and returns it as tab-delimited text with the 'glare' column added.
 
-        for chunk in reader:
-            # Normalize the data for clustering
-            normalized_data = normalize_data(chunk)
+    Runs in the worker processes of process_large_file, so the CSV formatting is
+    parallel as well.
+    """
+    chunk, header = item
+
+    # Rows in known hotspots are glare without clustering
+    known = np.zeros(len(chunk), dtype=bool)
+    if glare_mask is not None:
+        known = glare_mask.lookup(chunk['cX'], chunk['cY'], hotspots)
+    glare = known.copy()
+    rest = chunk[~known] if glare_mask is not None else chunk
+    if len(rest) == 0:
+        chunk['glare'] = np.where(glare, 'yes', 'no')
+        return chunk.to_csv(sep='\t', index=False, header=header)
+
+    # Normalize the data for clustering
+    normalized_data = normalize_data(rest)
+
+    # Cluster the data
+    if method == 'grid':
+        cluster_labels = grid_cluster(normalized_data, eps=eps, min_samples=min_samples)
+    else:
+        cluster_labels = cluster_data(normalized_data, eps=eps, min_samples=min_samples)
+
+    # Add the 'glare' column based on the cluster size
+    glare[~known] = glare_from_labels(cluster_labels, min_cluster_size)
+    chunk['glare'] = np.where(glare, 'yes', 'no')
+    return chunk.to_csv(sep='\t', index=False, header=header)
+
+def compare_glare_detectors(input_file, min_cluster_size, eps=0.5, min_samples=5, chunksize=100000):
+    """
+    Compares grid_cluster with DBSCAN (cluster_data) chunk by chunk, as process_large_file runs them.
 
-            # Cluster the data
-            cluster_labels = cluster_data(normalized_data, eps=eps, min_samples=min_samples)
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - min_cluster_size (int): Minimum number of elements in a cluster to be considered glare.
+    - eps (float, optional): Epsilon parameter for both detectors (default: 0.5).
+    - min_samples (int, optional): Minimum number of samples for both detectors (default: 5).
+    - chunksize (int, optional): Chunk size for processing large files (default: 100000).
 
-            # Add cluster labels to the original dataframe
-            chunk['cluster'] = cluster_labels
+    Returns:
+    - DataFrame: One row per chunk plus a 'total' row, with the number of rows, glare counts of
+      both detectors, the four agreement counts, the agreement fraction, Cohen's kappa and the
+      run time of each detector in seconds.
+    """
+    report = []
+    for number, chunk in enumerate(iter_contours(input_file, columns=['cX', 'cY', 'frame', 'area'],
+                                                 chunksize=chunksize)):
+        normalized_data = normalize_data(chunk)
+
+        start = time.perf_counter()
+        dbscan = glare_from_labels(cluster_data(normalized_data, eps=eps, min_samples=min_samples), min_cluster_size)
+        dbscan_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        grid = glare_from_labels(grid_cluster(normalized_data, eps=eps, min_samples=min_samples), min_cluster_size)
+        grid_s = time.perf_counter() - start
+
+        report.append({
+            'chunk': number, 'rows': len(chunk),
+            'dbscan_glare': int(dbscan.sum()), 'grid_glare': int(grid.sum()),
+            'both': int((dbscan & grid).sum()), 'dbscan_only': int((dbscan & ~grid).sum()),
+            'grid_only': int((~dbscan & grid).sum()), 'neither': int((~dbscan & ~grid).sum()),
+            'dbscan_s': dbscan_s, 'grid_s': grid_s,
+        })
+
+    report = pd.DataFrame(report)
+    if report.empty:
+        return report
+    total = report.drop(columns='chunk').sum()
+    total['chunk'] = 'total'
+    report = pd.concat([report, total.to_frame().T], ignore_index=True)
+    counts = ['rows', 'dbscan_glare', 'grid_glare', 'both', 'dbscan_only', 'grid_only', 'neither']
+    report = report.astype({**{name: np.int64 for name in counts}, 'dbscan_s': np.float64, 'grid_s': np.float64})
+
+    rows = report['rows'].to_numpy(dtype=np.float64)
+    agree = (report['both'] + report['neither']).to_numpy(dtype=np.float64) / rows
+    # Agreement expected by chance from the two glare rates
+    p_dbscan = report['dbscan_glare'].to_numpy(dtype=np.float64) / rows
+    p_grid = report['grid_glare'].to_numpy(dtype=np.float64) / rows
+    chance = p_dbscan * p_grid + (1 - p_dbscan) * (1 - p_grid)
+    report['agreement'] = agree
+    with np.errstate(divide='ignore', invalid='ignore'):
+        report['kappa'] = np.where(chance < 1, (agree - chance) / (1 - chance), 1.0)
+    return report
+
+FEATURES = ['cX', 'cY', 'frame', 'area']
+
+def global_scaling(input_file, chunksize=1000000):
+    """
+    Computes StandardScaler statistics of cX, cY, frame and area over a whole file in one streaming pass.
 
-            # Determine the size of each cluster
-            cluster_counts = chunk['cluster'].value_counts()
+    Chunk means and sums of squared deviations are combined pairwise (Chan et al.),
+    so the result matches StandardScaler fitted on the full file.
 
-            # Add the 'glare' column based on the cluster size
-            chunk['glare'] = chunk['cluster'].apply(
-                lambda x: 'yes' if (x != -1 and cluster_counts[x] >= min_cluster_size) else 'no'
-            )
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - chunksize (int, optional): Rows read per chunk (default: 1000000).
 
-            # Remove the 'cluster' column for the output
-            chunk.drop(columns=['cluster'], inplace=True)
+    Returns:
+    - tuple: (mean, scale, n_rows), with mean and scale as arrays ordered like FEATURES.
+    """
+    n = 0
+    mean = np.zeros(len(FEATURES))
+    m2 = np.zeros(len(FEATURES))
+    for chunk in iter_contours(input_file, columns=FEATURES, chunksize=chunksize):
+        x = chunk.to_numpy(dtype=np.float64)
+        k = len(x)
+        chunk_mean = x.mean(axis=0)
+        chunk_m2 = ((x - chunk_mean) ** 2).sum(axis=0)
+        delta = chunk_mean - mean
+        mean = mean + delta * k / (n + k)
+        m2 = m2 + chunk_m2 + delta ** 2 * n * k / (n + k)
+        n += k
+    scale = np.sqrt(m2 / max(n, 1))
+    scale[scale == 0] = 1.0
+    return mean, scale, n
+
+def _find(parent, i):
+    # Union-find root lookup with path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def process_large_file_windowed(input_file, output_file, min_cluster_size, eps=0.5, min_samples=5, chunksize=100000):
+    """
+    Identifies glare with DBSCAN over windows of rows that overlap at their seams.
+
+    A cheap pre-pass computes global normalisation statistics, so every window is
+    scaled identically, and the frame range of every window. The eps-neighbourhoods
+    of each window of `chunksize` rows are found among the window and a halo: the
+    rows of every other window that lie within eps of it in frame (eps * frame scale
+    frames, which may reach across many windows), so every row gets its exact
+    neighbour count and core status. Core points within eps of each other are joined
+    into clusters with union-find across windows, and border points join, like in
+    sklearn's DBSCAN, the cluster whose first core point comes earliest in the file.
+    Cluster sizes are counted over the whole file, so the glare rows are exactly those
+    of DBSCAN over the whole file (with the same global scaling).
+
+    Only the windows within the halo are in memory at a time; per-row labels live in
+    a temporary memory-mapped file, and the edges between border and core points are
+    spilled to a temporary file and resolved block by block at the end, so memory does
+    not grow with the file. Windows stay few when the input is (approximately) in frame
+    order, as written by find_contours.
 
-            # Write the processed chunk to the output file
-            chunk.to_csv(output, sep='\t', index=False, header=first_chunk, mode='a')
-            first_chunk = False
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - output_file (str): Path to the output file.
+    - min_cluster_size (int): Minimum number of elements in a cluster to be considered glare.
+    - eps (float, optional): Epsilon parameter for DBSCAN (default: 0.5).
+    - min_samples (int, optional): Minimum number of samples for a cluster in DBSCAN (default: 5).
+    - chunksize (int, optional): Rows per window, not counting the halo (default: 100000).
+    """
+    mean, scale, n = global_scaling(input_file)
+    halo = eps * scale[FEATURES.index('frame')]
+    ranges = [(chunk['frame'].min(), chunk['frame'].max())
+              for chunk in iter_contours(input_file, columns=['frame'], chunksize=chunksize)]
+    lo = np.array([r[0] for r in ranges], dtype=np.float64)
+    hi = np.array([r[1] for r in ranges], dtype=np.float64)
+    # Lowest frame of every window from each one on
+    rest_lo = np.minimum.accumulate(lo[::-1])[::-1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        labels = np.memmap(os.path.join(tmp, 'labels'), dtype=np.int64, mode='w+', shape=(max(n, 1),))
+        core = np.memmap(os.path.join(tmp, 'core'), dtype=np.bool_, mode='w+', shape=(max(n, 1),))
+        labels[:] = -1
+        parent = []
+        # (border row, core row) pairs of every edge between a border point and a core point
+        spill_path = os.path.join(tmp, 'borders')
+        open(spill_path, 'wb').close()
+
+        def windows():
+            # Row positions, normalised features and frames of each window
+            start = 0
+            for chunk in iter_contours(input_file, columns=FEATURES, chunksize=chunksize):
+                x = (chunk.to_numpy(dtype=np.float64) - mean) / scale
+                yield np.arange(start, start + len(chunk)), x, chunk['frame'].to_numpy()
+                start += len(chunk)
+
+        source = windows()
+        loaded, last = {}, -1
+        for i in range(len(ranges)):
+            # Read ahead through every later window that can hold rows within the halo of this one,
+            # and drop the earlier windows no window from this one on can reach
+            while last < i or (last + 1 < len(ranges) and rest_lo[last + 1] <= hi[i] + halo):
+                last += 1
+                loaded[last] = next(source)
+            for j in [j for j in loaded if j < i and hi[j] < rest_lo[i] - halo]:
+                del loaded[j]
+            rows, x, frames = loaded[i]
+
+            # This window, then the halo rows of the other windows that can be within eps of it
+            near_rows, near_x = [rows], [x]
+            for j in sorted(loaded):
+                if j == i or lo[j] > hi[i] + halo or hi[j] < lo[i] - halo:
+                    continue
+                other_rows, other_x, other_frames = loaded[j]
+                near = (other_frames >= lo[i] - halo) & (other_frames <= hi[i] + halo)
+                near_rows.append(other_rows[near])
+                near_x.append(other_x[near])
+            near_rows = np.concatenate(near_rows)
+            graph = NearestNeighbors(radius=eps).fit(np.vstack(near_x)).radius_neighbors_graph(x).tocoo()
+            # Neighbour counts include the point itself, as in DBSCAN
+            core[rows] = np.bincount(graph.row, minlength=len(rows)) >= min_samples
+
+            # Clusters of the core points of this window, with global IDs
+            a, b = rows[graph.row], near_rows[graph.col]
+            inner = (b >= rows[0]) & (b <= rows[-1])
+            both = core[a] & inner & core[np.where(inner, b, a)]
+            own = core[rows]
+            _, component = connected_components(
+                coo_matrix((np.ones(both.sum()), (a[both] - rows[0], b[both] - rows[0])), shape=(len(rows),) * 2),
+                directed=False)
+            ids, component = np.unique(component[own], return_inverse=True)
+            base = len(parent)
+            parent.extend(range(base, base + len(ids)))
+            labels[rows[own]] = component + base
+
+            # Core points of earlier windows within eps merge clusters; the edges to later windows
+            # are met again from their side
+            earlier = b < rows[0]
+            merge = earlier & core[a] & core[np.where(earlier, b, a)]
+            for p, q in set(zip(labels[a[merge]].tolist(), labels[b[merge]].tolist())):
+                rp, rq = _find(parent, p), _find(parent, q)
+                if rp != rq:
+                    parent[max(rp, rq)] = min(rp, rq)
+
+            # Border points of this and earlier windows reached by a core point
+            known = inner | earlier
+            a_core, b_core = core[a], core[np.where(known, b, a)]
+            edge = known & (a_core != b_core)
+            pairs = np.column_stack([np.where(a_core, b, a)[edge], np.where(a_core, a, b)[edge]])
+            with open(spill_path, 'ab') as spill:
+                pairs.astype(np.int64).tofile(spill)
+
+        # Resolve every global ID to its root
+        roots = np.array([_find(parent, i) for i in range(len(parent))], dtype=np.int64)
+        first_core = np.full(len(parent), n, dtype=np.int64)
+        for start in range(0, n, chunksize):
+            block = labels[start:start + chunksize]
+            clustered = np.flatnonzero(block >= 0)
+            np.minimum.at(first_core, roots[block[clustered]], clustered + start)
+
+        # Each border point joins the cluster, among those reaching it, whose first core point comes
+        # first; that core point (unique to its cluster) is kept per border point over blocks of edges
+        if os.path.getsize(spill_path):
+            edges = np.memmap(spill_path, dtype=np.int64, mode='r').reshape(-1, 2)
+            best = np.memmap(os.path.join(tmp, 'best'), dtype=np.int64, mode='w+', shape=(n,))
+            best[:] = n
+            for start in range(0, len(edges), chunksize):
+                border, reached = edges[start:start + chunksize, 0], edges[start:start + chunksize, 1]
+                first_reached = first_core[roots[labels[reached]]]
+                order = np.lexsort((first_reached, border))
+                first = np.ones(len(order), dtype=bool)
+                first[1:] = border[order][1:] != border[order][:-1]
+                border, first_reached = border[order][first], first_reached[order][first]
+                best[border] = np.minimum(best[border], first_reached)
+            for start in range(0, n, chunksize):
+                block = best[start:start + chunksize]
+                reached = np.flatnonzero(block < n)
+                labels[reached + start] = roots[labels[block[reached]]]
+            del edges, best
+
+        # Count cluster sizes over the whole file
+        sizes = np.zeros(len(parent), dtype=np.int64)
+        for start in range(0, n, chunksize):
+            block = labels[start:start + chunksize]
+            sizes += np.bincount(roots[block[block >= 0]], minlength=len(parent))
+
+        with open_table(output_file, 'w') as output:
+            start = 0
+            for chunk in iter_contours(input_file, chunksize=chunksize, dtype=GLARE_INPUT_DTYPES):
+                block = labels[start:start + len(chunk)]
+                glare = block >= 0
+                glare[glare] = sizes[roots[block[glare]]] >= min_cluster_size
+                chunk['glare'] = np.where(glare, 'yes', 'no')
+                chunk.to_csv(output, sep='\t', index=False, header=start == 0, mode='a')
+                start += len(chunk)
+        del labels, core
 
 import pandas as pd
 
 def manual_mark_glare(input_file, output_file, low_clip, hi_clip, hmark=None):
-    # Read the input file into a DataFrame
-    df = pd.read_csv(input_file, sep='\t')
-    
-    # Mark the 'glare' column as 'yes' where 'frame' is less than low_clip or more than hi_clip
-    df.loc[(df['frame'] < low_clip) | (df['frame'] > hi_clip), 'glare'] = 'yes'
-    
-    # Process hmark if provided
+    """
+    Marks frames outside [low_clip, hi_clip] and optional cX bands as glare.
+
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - output_file (str): Path to the output file.
+    - low_clip (int): Rows with frame < low_clip are glare.
+    - hi_clip (int): Rows with frame > hi_clip are glare.
+    - hmark (str or list, optional): Pairs of cX values ('low,high,low,high' or a list); rows with
+      low < cX < high are glare.
+    """
+    rules = {'clip': [low_clip, hi_clip]}
     if hmark is not None:
-        # If hmark is a string, split it into numbers
-        if isinstance(hmark, str):
-            # Remove any spaces and split by commas
-            hmark_list = hmark.replace(' ', '').split(',')
-            # Convert to floats
-            hmark_numbers = [float(x) for x in hmark_list]
-        elif isinstance(hmark, (list, tuple)):
-            hmark_numbers = hmark
-        else:
-            raise ValueError("hmark must be a string or a list/tuple of numbers")
-        
-        # Ensure hmark has pairs of low_mark and hi_mark
-        if len(hmark_numbers) % 2 != 0:
-            raise ValueError("hmark must contain pairs of low_mark and hi_mark values")
-        
-        # Iterate over pairs and mark 'glare' accordingly
-        for i in range(0, len(hmark_numbers), 2):
-            mark1 = hmark_numbers[i]
-            mark2 = hmark_numbers[i+1]
-            low_mark = min(mark1, mark2)
-            hi_mark = max(mark1, mark2)
-            # Mark 'glare' as 'yes' where cX is between low_mark and hi_mark
-            df.loc[(df['cX'] > low_mark) & (df['cX'] < hi_mark), 'glare'] = 'yes'
-    
-    # Write the modified DataFrame to the output file
-    df.to_csv(output_file, sep='\t', index=False)
+        # Validates hmark (pairs of numbers) before reading the file
+        rules['cx_bands'] = parse_bands(hmark)
+    apply_glare_rules(input_file, output_file, rules)
 
 def clip_ends(input_file, output_file, low_clip, hi_clip):
-    # Read the input file into a DataFrame
-    df = pd.read_csv(input_file, sep='\t')
-    df.head()
-    # Mark the 'glare' column as 'yes' where 'frame' is less than low_clip or more than hi_clip
-    df.loc[(df['frame'] < low_clip) | (df['frame'] > hi_clip), 'glare'] = 'yes'
+    """
+    Marks rows with frame < low_clip or frame > hi_clip as glare.
 
-    # Write the modified DataFrame to the output file
-    df.to_csv(output_file, sep='\t', index=False)
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - output_file (str): Path to the output file.
+    - low_clip (int): The lower frame limit.
+    - hi_clip (int): The upper frame limit.
+    """
+    apply_glare_rules(input_file, output_file, {'clip': [low_clip, hi_clip]})
 
 
 def check_vertical_glare(data, vertical_glare_threshold, frame_range, cy_threshold_count, cy_cutoff, low_clip=None, hi_clip=None):
@@ -165,10 +456,13 @@ def check_vertical_glare(data, vertical_glare_threshold, frame_range, cy_thresho
     - A minimum total number of contours in the range.
     - A minimum number of contours in the range with cY > cy_cutoff.
 
+    The range is the trailing window of frame_range frames ending at each frame. Every row of a
+    frame that is marked (or that already had a 'yes' row) is set to 'yes', all others to 'no'.
     Also, sets glare to 'yes' for rows outside the specified frame range using low_clip and hi_clip.
+    Rows keep their order; see vertical_glare_frames for the per-frame computation.
 
     Parameters:
-    - data (DataFrame): The input data to check and modify.
+    - data (DataFrame or ContourTable): The input data to check and modify.
     - vertical_glare_threshold (int): The minimum number of total contours required in a range to consider it for glare.
     - frame_range (int): The range (window size) of frames to sum up for sliding window analysis.
     - cy_threshold_count (int): The minimum number of contours with cY exceeding the cutoff required to mark 
@@ -178,60 +472,16 @@ def check_vertical_glare(data, vertical_glare_threshold, frame_range, cy_thresho
     - hi_clip (int, optional): The upper frame limit; rows with frame > hi_clip will have glare set to 'yes'.
 
     Returns:
-    - DataFrame: The modified data with the 'glare' column updated.
+    - DataFrame or ContourTable: The modified data with the 'glare' column updated.
     """
-    # Check if the 'glare' column exists, add it with default 'no' values if missing
-    if 'glare' not in data.columns:
-        data['glare'] = 'no'
-
-    # Set glare to 'yes' for rows outside the specified frame range if not already 'yes'
-    if low_clip is not None:
-        data.loc[(data['frame'] < low_clip) & (data['glare'] != 'yes'), 'glare'] = 'yes'
-    if hi_clip is not None:
-        data.loc[(data['frame'] > hi_clip) & (data['glare'] != 'yes'), 'glare'] = 'yes'
-
-    # Sort the data by frame number
-    data.sort_values(by='frame', inplace=True)
-
-    # Determine the maximum frame and the number of padding rows needed
-    max_frame = data['frame'].max()
-    padding_needed = frame_range - (max_frame % frame_range)
-
-    # Create dummy padding data
-    dummy_data = pd.DataFrame({
-        'frame': range(max_frame + 1, max_frame + 1 + padding_needed),
-        'cY': [0] * padding_needed,  # Assuming 0 will not affect cY cutoff
-        'glare': ['no'] * padding_needed
-    })
-
-    # Append dummy data to the original data
-    data = pd.concat([data, dummy_data], ignore_index=True)
-
-    # Create a rolling count of contours within the frame range
-    data['contours_count'] = data.groupby('frame')['frame'].transform('size')
-
-    # Create a rolling count of contours with cY > cy_cutoff within the frame range
-    data['contours_above_cutoff_count'] = data.groupby('frame')['cY'].transform(lambda x: (x > cy_cutoff).sum())
-
-    # Calculate a rolling sum over the specified frame range
-    total_contours_rolling = data['contours_count'].rolling(window=frame_range, min_periods=1).sum()
-    contours_above_cutoff_rolling = data['contours_above_cutoff_count'].rolling(window=frame_range, min_periods=1).sum()
-
-    # Determine which ranges should be marked as 'glare'
-    glare_mask = (total_contours_rolling >= vertical_glare_threshold) & (contours_above_cutoff_rolling >= cy_threshold_count)
-
-    # Ensure that only rows not already marked as 'yes' are updated
-    data.loc[glare_mask & (data['glare'] != 'yes'), 'glare'] = 'yes'
-
-    # Remove the dummy data
-    data = data[data['frame'] <= max_frame].copy()
-
-    # Clean up temporary columns
-    data.drop(columns=['contours_count', 'contours_above_cutoff_count'], inplace=True)
-
-    # Ensure that rows previously marked as 'yes' are not overwritten
-    data['glare'] = data.groupby('frame')['glare'].transform(lambda x: 'yes' if 'yes' in x.values else 'no')
-
+    glare_frames = vertical_glare_frames(data, vertical_glare_threshold, frame_range, cy_threshold_count,
+                                         cy_cutoff, low_clip, hi_clip)
+    glare = glare_of_frames(glare_frames, data['frame'], low_clip, hi_clip)
+
+    if isinstance(data, ContourTable):
+        data.columns['glare'] = np.where(glare, GLARE_LABELS.index('yes'), GLARE_LABELS.index('no')).astype(np.int8)
+    else:
+        data['glare'] = np.where(glare, 'yes', 'no')
     return data
 
 def check_vertical_glareOLD(data, vertical_glare_threshold, frame_range):
@@ -274,18 +524,21 @@ def vertical_glare_fileio(input_file, output_file, vertical_glare_threshold, fra
     and marks frames with occurrences exceeding the threshold in a sliding window range 
     as 'yes' for glare. Saves the updated data to an output file.
 
+    The file is streamed twice (per-frame counts, then marking), so it never has to fit in memory.
+
     Parameters:
     - input_file (str): Path to the input tab-delimited file.
     - output_file (str): Path to the output tab-delimited file.
     - vertical_glare_threshold (int): The threshold value for frame occurrences.
     - frame_range (int): The range (window size) of frames to sum up for sliding window analysis.
     """
-    # Read the input file
-    data = pd.read_csv(input_file, sep='\t', dtype={'cX': np.float32, 'cY': np.float32, 'frame': np.int32, 'area': np.float32})
-
-    # Check and mark glare using the modified sliding window function
-    data = check_vertical_glare(data, vertical_glare_threshold, frame_range, cy_threshold_count, cy_cutoff, low_clip, hi_clip)
-
-    # Save the updated data to the output file
-    data.to_csv(output_file, sep='\t', index=False)
-
+    # First pass: per-frame counts and the frames to mark
+    glare_frames = vertical_glare_frames(input_file, vertical_glare_threshold, frame_range, cy_threshold_count,
+                                         cy_cutoff, low_clip, hi_clip)
+
+    # Second pass: mark the rows of those frames and save the updated data to the output file
+    with open_table(output_file, 'w') as output:
+        for number, chunk in enumerate(iter_contours(input_file, dtype=GLARE_INPUT_DTYPES)):
+            glare = glare_of_frames(glare_frames, chunk['frame'], low_clip, hi_clip)
+            chunk['glare'] = np.where(glare, 'yes', 'no')
+            chunk.to_csv(output, sep='\t', index=False, header=number == 0)
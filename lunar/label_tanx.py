@@ -2,6 +2,10 @@
 
 import pandas as pd
 import numpy as np
+from .loader import read_contours, iter_contours, is_path, CAMERA_LABELS, TANK_LABELS
+from .table_io import open_table, write_table
+from .detect_tanks import detect_tank_boundaries
+from .tank_layout import load_layout
 
 def determine_camera(cX):
     """
@@ -75,39 +79,132 @@ def calculate_cXtank(cX, tank, boundaries):
     else:
         return np.nan
 
-def analyze_contours(input_file, tank_boundaries):
+# Tank codes (into TANK_LABELS) for each interval between the sorted boundaries:
+# below t1, [t1, t2), [t2, t3), [t3, t4), [t4, t5), [t5, t6), [t6, t7), [t7, t8), t8 and above
+INTERVAL_TANKS = np.array([TANK_LABELS.index(tank) for tank in
+                           ['noise', 'left_tank1', 'left_tank2', 'left_tank3', 'noise',
+                            'right_tank1', 'right_tank2', 'right_tank3', 'noise']], dtype=np.int8)
+
+# Which boundary is subtracted for cXtank in each interval (-1: none, cXtank is NaN)
+INTERVAL_OFFSETS = np.array([-1, 0, 1, 2, -1, 4, 5, 6, -1])
+
+def label_tanks(cX, boundaries, camera_split=2001):
     """
-    Analyzes the input contour data to label tanks and remove glare.
+    Labels camera, tank and cXtank for many contours at once.
+
+    Gives the same results as determine_camera, determine_tank and calculate_cXtank
+    row by row: one np.searchsorted over the 8 boundaries finds each contour's
+    interval, and lookup arrays give the tank code and the boundary to subtract.
 
     Parameters:
-    - input_file (str): Path to the input tab-delimited file.
-    - tank_boundaries (list): List of 8 tank boundaries [t1, t2, t3, t4, t5, t6, t7, t8].
+    - cX (array-like): The x-coordinates of the contours.
+    - boundaries (list): List of 8 tank boundaries [t1, t2, t3, t4, t5, t6, t7, t8].
+    - camera_split (float, optional): cX below which a contour belongs to the left camera (default: 2001).
 
     Returns:
-    - DataFrame: A modified DataFrame with additional columns for camera, tank, and cXtank.
+    - tuple: (camera, tank, cXtank); camera and tank are pandas Categoricals over
+      CAMERA_LABELS and TANK_LABELS, cXtank is a float array with NaN outside the tanks.
     """
-    # Read the input file
-    df = pd.read_csv(input_file, delimiter='\t')
-
-    # Remove rows labeled as glare
+    cX = np.asarray(cX)
+    bounds = np.asarray(boundaries, dtype=np.float64)
+    if bounds.shape != (8,):
+        raise ValueError("boundaries must hold 8 values [t1, t2, t3, t4, t5, t6, t7, t8]")
+
+    interval = np.searchsorted(bounds, cX, side='right')
+    # right_tank3 includes its upper boundary t8
+    interval[cX == bounds[7]] = 7
+
+    tank = INTERVAL_TANKS[interval]
+    offset_index = INTERVAL_OFFSETS[interval]
+    cXtank = np.where(offset_index >= 0, cX - bounds[np.maximum(offset_index, 0)], np.nan)
+
+    camera = np.where(cX < camera_split, CAMERA_LABELS.index('left'), CAMERA_LABELS.index('right')).astype(np.int8)
+    return (pd.Categorical.from_codes(camera, categories=CAMERA_LABELS),
+            pd.Categorical.from_codes(tank, categories=TANK_LABELS),
+            cXtank)
+
+def _analyze_chunk(df, tank_boundaries, camera_split, layout=None):
+    # Remove rows labeled as glare, then add the camera, tank and cXtank columns
+    removed = 0
     if 'glare' in df.columns:
-        glare_rows_count = df[df['glare'] == 'yes'].shape[0]
-        df = df[df['glare'] != 'yes']
-        print(f"Removed {glare_rows_count} rows labeled as glare.")
+        glare = (df['glare'] == 'yes').to_numpy()
+        removed = int(glare.sum())
+        df = df[~glare].copy()
+    if layout is not None:
+        df['camera'], df['tank'], df['cXtank'] = layout.lookup(df['cX'].to_numpy(), df['cY'].to_numpy())
+    else:
+        df['camera'], df['tank'], df['cXtank'] = label_tanks(df['cX'].to_numpy(), tank_boundaries, camera_split)
+    return df, removed
 
-    # Add the 'camera' column
-    df['camera'] = df['cX'].apply(determine_camera)
+def analyze_contours(input_file, tank_boundaries=None, output_file=None, camera_split=2001, chunksize=None,
+                     layout=None):
+    """
+    Analyzes the input contour data to label tanks and remove glare.
 
-    # Add the 'tank' column based on the boundaries provided
-    df['tank'] = df.apply(lambda row: determine_tank(row['cX'], tank_boundaries), axis=1)
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
+    - tank_boundaries (list or str): List of 8 tank boundaries [t1, t2, t3, t4, t5, t6, t7, t8], or 'auto'
+      to detect them from the contour density (see lunar.detect_tanks; cached per night).
+    - output_file (str, optional): Output path (default: 'analyzed_' + input_file;
+      nothing is written for an in-memory input unless a path is given).
+    - camera_split (float, optional): cX below which a contour belongs to the left camera (default: 2001).
+    - chunksize (int, optional): If given, the input is streamed and written chunk by chunk so it
+      never has to fit in memory; nothing is returned in that case, and cXtank is always written
+      as a decimal (default: None).
+    - layout (str, dict or TankLayout, optional): Polygon tank layout (see lunar.tank_layout) used
+      instead of tank_boundaries; tanks are looked up from a raster by cX and cY (default: None).
 
-    # Add the 'cXtank' column by subtracting the appropriate tank boundary from cX
-    df['cXtank'] = df.apply(lambda row: calculate_cXtank(row['cX'], row['tank'], tank_boundaries), axis=1)
+    Returns:
+    - DataFrame: A modified DataFrame with additional columns for camera, tank, and cXtank
+      (None when streaming with chunksize).
+    """
+    if layout is not None:
+        layout = load_layout(layout, camera_split=camera_split)
+    elif tank_boundaries is None:
+        raise ValueError("analyze_contours needs tank_boundaries or a layout")
+    elif isinstance(tank_boundaries, str) and tank_boundaries == 'auto':
+        detected = detect_tank_boundaries(input_file, camera_split=camera_split)
+        tank_boundaries = detected['boundaries']
+        print(f"Detected tank boundaries {' '.join(f'{b:g}' for b in tank_boundaries)} "
+              f"(confidence {' '.join(f'{c:.2f}' for c in detected['confidence'])})")
+        if min(detected['confidence']) < 0.5:
+            print("Warning: low confidence in some tank boundaries; check them with visualize_tanx.py")
+
+    if output_file is None and is_path(input_file):
+        output_file = 'analyzed_' + str(input_file)
+
+    if chunksize is not None:
+        if output_file is None:
+            raise ValueError("analyze_contours needs an output_file when streaming with chunksize")
+        glare_rows_count, had_glare = 0, False
+        with open_table(output_file, 'w') as output:
+            for number, chunk in enumerate(iter_contours(input_file, chunksize=chunksize)):
+                had_glare = had_glare or 'glare' in chunk.columns
+                chunk, removed = _analyze_chunk(chunk, tank_boundaries, camera_split, layout)
+                glare_rows_count += removed
+                chunk.to_csv(output, sep='\t', index=False, header=number == 0)
+        if had_glare:
+            print(f"Removed {glare_rows_count} rows labeled as glare.")
+        print(f"Analysis complete. Results saved to {output_file}")
+        return None
 
-    # Output the modified DataFrame to a new CSV file
-    output_file = 'analyzed_' + input_file
-    df.to_csv(output_file, sep='\t', index=False)
+    # Read the input file
+    df = read_contours(input_file)
+
+    # Remove rows labeled as glare and add the 'camera', 'tank' and 'cXtank' columns
+    had_glare = 'glare' in df.columns
+    df, glare_rows_count = _analyze_chunk(df, tank_boundaries, camera_split, layout)
+    # Integer cX minus integer boundaries gives integer cXtank when every contour is in a tank,
+    # and the table is written as such, as the row-by-row labeling did
+    if (layout is None and np.issubdtype(df['cX'].dtype, np.integer)
+            and all(isinstance(b, (int, np.integer)) for b in tank_boundaries)
+            and not df['cXtank'].isna().any()):
+        df['cXtank'] = df['cXtank'].astype(np.int64)
+    if had_glare:
+        print(f"Removed {glare_rows_count} rows labeled as glare.")
 
-    print(f"Analysis complete. Results saved to {output_file}")
+    # Output the modified DataFrame to a new CSV file
+    if output_file is not None:
+        write_table(df, output_file)
+        print(f"Analysis complete. Results saved to {output_file}")
     return df
-
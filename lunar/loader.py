@@ -0,0 +1,204 @@
+# lunar/loader.py
+
+import os
+import numpy as np
+import pandas as pd
+from .frame_index import load_frame_index
+from .table_io import open_table, text_size
+
+# Label vocabularies written by the pipeline stages
+GLARE_LABELS = ['no', 'yes']
+CAMERA_LABELS = ['left', 'right']
+TANK_LABELS = ['noise', 'left_tank1', 'left_tank2', 'left_tank3', 'right_tank1', 'right_tank2', 'right_tank3']
+MATCH_LABELS = ['match', 'xdif', 'ydif', 'bothdif']
+
+# Column types of the contour tables produced by find_contours and the later stages.
+# Columns that are not listed here (cX and cY, which are integers in find_contours output
+# and decimals after the glare stage) are left to pandas type inference. Numeric types are
+# chosen so tables are rewritten with the same text they were read from.
+CONTOUR_DTYPES = {
+    'frame': np.int32,
+    'area': np.float64,
+    'minI': np.float64,
+    'maxI': np.float64,
+    'meanI': np.float64,
+    'video': 'category',
+    'glare': pd.CategoricalDtype(GLARE_LABELS),
+    'camera': pd.CategoricalDtype(CAMERA_LABELS),
+    'tank': pd.CategoricalDtype(TANK_LABELS),
+    'cXtank': np.float64,
+    'match_status': pd.CategoricalDtype(MATCH_LABELS),
+    'pair_id': np.int64,
+    'bad_match': pd.CategoricalDtype(GLARE_LABELS),
+}
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+
+
+def is_path(source):
+    """Returns True if a stage input is a file path rather than an in-memory table."""
+    return isinstance(source, (str, os.PathLike))
+
+
+def table_columns(path):
+    """
+    Returns the column names of a tab-delimited table without reading its rows.
+
+    Parameters:
+    - path (str, DataFrame or ContourTable): Path to the tab-delimited file (plain, .gz or .zst),
+      or an in-memory table.
+
+    Returns:
+    - list: Column names from the header line.
+    """
+    if not is_path(path):
+        return list(path.columns)
+    with open_table(path) as f:
+        return f.readline().rstrip('\n').split('\t')
+
+
+def _row_bytes(columns):
+    """Estimates the in-memory size of one row with the contour schema."""
+    total = 0
+    for col in columns:
+        dtype = CONTOUR_DTYPES.get(col)
+        if isinstance(dtype, type) and issubclass(dtype, np.generic):
+            total += np.dtype(dtype).itemsize
+        elif dtype is not None:
+            total += 2  # categorical codes
+        else:
+            total += 8
+    return total
+
+
+def _plan(path, columns, frames, where, dtype=None):
+    """Works out the columns to parse, their types, and the columns to drop after filtering."""
+    header = table_columns(path)
+    if not is_path(path):
+        path = 'the input table'
+    wanted = header if columns is None else list(columns)
+    needed = list(wanted)
+    for col in list((where or {}).keys()) + (['frame'] if frames is not None else []):
+        if col not in needed:
+            needed.append(col)
+    missing = [col for col in needed if col not in header]
+    if missing:
+        raise ValueError(f"Columns {missing} not found in {path}")
+    types = dict(CONTOUR_DTYPES, **(dtype or {}))
+    return header, wanted, needed, {col: types[col] for col in needed if col in types}
+
+
+def _apply_filters(chunk, wanted, frames, where):
+    mask = np.ones(len(chunk), dtype=bool)
+    if frames is not None:
+        frame = chunk['frame'].to_numpy()
+        mask &= (frame >= frames[0]) & (frame <= frames[1])
+    for col, values in (where or {}).items():
+        if isinstance(values, (list, tuple, set)):
+            mask &= chunk[col].isin(list(values)).to_numpy()
+        else:
+            mask &= (chunk[col] == values).to_numpy()
+    if not mask.all():
+        chunk = chunk[mask]
+    if list(chunk.columns) != wanted:
+        chunk = chunk[wanted]
+    return chunk
+
+
+def iter_contours(path, columns=None, frames=None, where=None, chunksize=None,
+                  memory_budget=DEFAULT_MEMORY_BUDGET, dtype=None):
+    """
+    Streams a contour table in typed chunks with column projection and row filters.
+    Tables ending in .gz or .zst are decompressed on the fly.
+
+    Parameters:
+    - path (str, DataFrame or ContourTable): Path to the tab-delimited contour table, or an in-memory table.
+    - columns (list, optional): Columns to return (default: all columns).
+    - frames (tuple, optional): (start, stop) frame window to keep, both inclusive.
+      Reading starts at the first frame-index block in the window and stops after the last one;
+      a missing or stale index is rebuilt first.
+    - where (dict, optional): Label filters, mapping a column to a value or a list of accepted values,
+      e.g. {'glare': 'no', 'tank': ['left_tank1', 'right_tank1']}.
+    - chunksize (int, optional): Rows per chunk (default: sized from memory_budget).
+    - memory_budget (int, optional): Approximate bytes per chunk when chunksize is not given (default: 2 GiB).
+    - dtype (dict, optional): Column types overriding the shared schema.
+
+    Yields:
+    - DataFrame: Filtered chunks, indexed by their row number in the table.
+    """
+    header, wanted, needed, types = _plan(path, columns, frames, where, dtype)
+    if chunksize is None:
+        chunksize = max(int(memory_budget // _row_bytes(needed)), 1)
+
+    if not is_path(path):
+        data = read_contours(path, columns=columns, frames=frames, where=where, dtype=dtype)
+        for start in range(0, len(data), chunksize):
+            yield data.iloc[start:start + chunksize]
+        return
+
+    start_row, nrows, blocks = 0, None, None
+    if frames is not None:
+        blocks = load_frame_index(path)
+    if blocks is not None:
+        hits = blocks[(blocks['frame_max'] >= frames[0]) & (blocks['frame_min'] <= frames[1])]
+        if hits.empty:
+            return
+        start_row = int(hits['row_offset'].iloc[0])
+        nrows = int(hits['row_offset'].iloc[-1] + hits['nrows'].iloc[-1]) - start_row
+
+    with (open(path, 'rb') if blocks is not None else open_table(path)) as f:
+        if blocks is not None:
+            f.seek(int(hits['byte_offset'].iloc[0]))
+        else:
+            f.readline()
+        with pd.read_csv(f, sep='\t', header=None, names=header, usecols=needed, dtype=types,
+                         chunksize=chunksize, nrows=nrows) as reader:
+            for chunk in reader:
+                chunk.index = chunk.index + start_row
+                chunk = _apply_filters(chunk, wanted, frames, where)
+                if len(chunk):
+                    yield chunk
+
+
+def read_contours(path, columns=None, frames=None, where=None, memory_budget=DEFAULT_MEMORY_BUDGET, dtype=None):
+    """
+    Reads a contour table with the shared schema, projecting columns and pushing down filters.
+
+    Tables ending in .gz or .zst are decompressed on the fly. Files larger than
+    memory_budget (uncompressed) are streamed chunk by chunk, so only the rows and
+    columns that survive the filters are ever held in memory at once. An in-memory
+    DataFrame or ContourTable is accepted in place of a path, so consecutive stages can
+    pass data along without re-reading it; it is projected and filtered the same way,
+    and the result is a copy the stage may modify freely.
+
+    Parameters:
+    - path (str, DataFrame or ContourTable): Path to the tab-delimited contour table, or an in-memory table.
+    - columns (list, optional): Columns to return (default: all columns).
+    - frames (tuple, optional): (start, stop) frame window to keep, both inclusive.
+    - where (dict, optional): Label filters, mapping a column to a value or a list of accepted values.
+    - memory_budget (int, optional): File size above which the table is streamed (default: 2 GiB).
+    - dtype (dict, optional): Column types overriding the shared schema.
+
+    Returns:
+    - DataFrame: The filtered table, indexed by row number in the file.
+    """
+    if not is_path(path):
+        header, wanted, needed, types = _plan(path, columns, frames, where, dtype)
+        data = path if isinstance(path, pd.DataFrame) else path.to_frame(columns=needed)
+        data = _apply_filters(data, wanted, frames, where).copy()
+        overrides = {col: kind for col, kind in (dtype or {}).items() if col in data.columns}
+        return data.astype(overrides) if overrides else data
+
+    if frames is None and text_size(path) <= memory_budget:
+        header, wanted, needed, types = _plan(path, columns, frames, where, dtype)
+        with open_table(path) as f:
+            data = pd.read_csv(f, sep='\t', usecols=needed, dtype=types)
+        return _apply_filters(data, wanted, frames, where)
+
+    chunks = list(iter_contours(path, columns=columns, frames=frames, where=where,
+                                memory_budget=memory_budget, dtype=dtype))
+    if not chunks:
+        header, wanted, needed, types = _plan(path, columns, frames, where, dtype)
+        empty = pd.DataFrame({col: pd.Series(dtype=types.get(col, object)) for col in wanted})
+        return empty
+    return pd.concat(chunks)
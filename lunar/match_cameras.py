@@ -1,87 +1,271 @@
 # lunar/match_cameras.py
 
+import itertools
+from functools import partial
 import pandas as pd
 import numpy as np
+from .loader import read_contours, iter_contours, TANK_LABELS, MATCH_LABELS
+from .table_io import open_table, write_table
+from .parallel import ordered_map
+from .match_engine import match_pairs, match_pairs_window, pair_status, tank_codes, TANK_SIDE
+from .camera_offset import estimate_camera_offset, MIN_CORRELATION
 
-def match_cameras(input_file, output_file, distance_x=200, distance_y=200):
+def _row_ids(df):
+    # Row numbers in the input table (the loader's index), or positions for other indexes
+    if pd.api.types.is_integer_dtype(df.index):
+        return df.index.to_numpy(dtype=np.int64)
+    return np.arange(len(df), dtype=np.int64)
+
+
+def _pair_codes(df, left, right, distance_x, distance_y, status=None, pair_id=None):
+    """
+    Returns the match status code and pair ID of every row from the pairs found.
+
+    Both rows of a pair share its status, and its ID: the row number of its left
+    contour in the input table. Unpaired rows keep status -1 (empty) and pair ID -1.
+    """
+    if status is None:
+        status = np.full(len(df), -1, dtype=np.int8)
+    if pair_id is None:
+        pair_id = np.full(len(df), -1, dtype=np.int64)
+    x = df['cXtank'].to_numpy(dtype=np.float64)
+    y = df['cY'].to_numpy(dtype=np.float64)
+    pair = pair_status(x, y, left, right, distance_x, distance_y)
+    status[left] = pair
+    status[right] = pair
+    ids = _row_ids(df)[left]
+    pair_id[left] = ids
+    pair_id[right] = ids
+    return status, pair_id
+
+
+def _add_match_columns(df, status, pair_id):
+    df['match_status'] = pd.Categorical.from_codes(status, categories=MATCH_LABELS)
+    df['pair_id'] = pair_id
+    return df
+
+
+def _match_same_frame(df, distance_x, distance_y, mode='greedy', frame_offset=0):
+    # Match status codes and pair IDs for same-frame matching of an in-memory table
+    frame, tank = df['frame'].to_numpy(dtype=np.int64), tank_codes(df['tank'])
+    # Shift the right camera onto the left camera's clock
+    shifted = np.where(TANK_SIDE[np.maximum(tank, 0)] == 1, frame - frame_offset, frame)
+    left, right = match_pairs(shifted, tank, df['cXtank'], df['cY'], mode=mode)
+    return _pair_codes(df, left, right, distance_x, distance_y)
+
+
+def _frame_ends(chunks):
+    """
+    Returns the position of the last row of every frame in a stream of chunks.
+
+    Returns:
+    - Series: Position of the last row (counted over the whole stream) by frame.
+    """
+    ends, start = [], 0
+    for chunk in chunks:
+        positions = pd.Series(np.arange(start, start + len(chunk)), index=chunk['frame'].to_numpy(dtype=np.int64))
+        ends.append(positions.groupby(level=0).max())
+        start += len(chunk)
+    if not ends:
+        return pd.Series([], dtype=np.int64)
+    return pd.concat(ends).groupby(level=0).max()
+
+
+def _frame_partitions(chunks, ends):
+    """
+    Re-cuts a stream of chunks on frame boundaries.
+
+    A frame is complete once its last row (from _frame_ends over the same stream)
+    has been read. Each partition ends before the first row of a frame that is not
+    complete yet, at the last row no frame of the partition reaches past, and the
+    rest is held back and prepended to the next chunk, so no frame straddles two
+    partitions and rows keep their order. The input need not be sorted by frame; the
+    rows held back stay few as long as it nearly is.
+    """
+    carry, read = None, 0
+    for chunk in chunks:
+        read += len(chunk)
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        frame = chunk['frame'].to_numpy(dtype=np.int64)
+        incomplete = ends.reindex(frame).to_numpy() >= read
+        cut = int(np.argmax(incomplete)) if incomplete.any() else len(chunk)
+        # Rows of complete frames can still sit behind the first incomplete one
+        positions = pd.Series(np.arange(len(frame)), index=frame)
+        reach = np.maximum.accumulate(positions.groupby(level=0).transform('max').to_numpy()[:cut])
+        closed = np.flatnonzero(reach == np.arange(cut))
+        cut = int(closed[-1]) + 1 if len(closed) else 0
+        carry = chunk.iloc[cut:]
+        if cut:
+            yield chunk.iloc[:cut]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _match_partition(item, distance_x, distance_y, mode):
+    """
+    Matches one frame partition and returns it as tab-delimited text with the 'match_status' and 'pair_id' columns.
+
+    Runs in the worker processes of match_cameras, so the CSV formatting is parallel as well.
+    """
+    chunk, header = item
+    chunk = _add_match_columns(chunk.copy(), *_match_same_frame(chunk, distance_x, distance_y, mode))
+    return chunk.to_csv(sep='\t', index=False, header=header)
+
+
+def _match_stream(input_file, output_file, where, distance_x, distance_y, frame_tolerance, chunksize, frame_offset=0):
+    """
+    Streams a table through match_pairs_window, writing rows once their status is final.
+
+    A first pass over the frame column finds where every frame ends (_frame_ends), so
+    with F the lowest frame whose rows have not all been read, no row of a frame below
+    F is still to come. Left contours below frame min(F, F - offset - tolerance) have
+    all their candidates in memory and no earlier left contour is still to come, so
+    they are resolved; right contours below frame min(F - 2 * tolerance, F + offset -
+    tolerance) can then no longer be claimed. Rows are written in input order up to the
+    first one that is not final, and the rest is carried into the next chunk, so the
+    input need not be sorted by frame; memory stays bounded by the chunk size plus
+    about tolerance + max(tolerance, |offset|) frames as long as it nearly is.
+    """
+    ends = _frame_ends(iter_contours(input_file, columns=['frame'], where=where, chunksize=chunksize))
+    # Lowest frame among those ending at or after each position, in order of their last rows
+    ends = ends.sort_values(kind='stable')
+    last_rows = ends.to_numpy()
+    lowest_after = np.minimum.accumulate(ends.index.to_numpy(dtype=np.int64)[::-1])[::-1]
+
+    carry, read = None, 0
+    status = np.empty(0, dtype=np.int8)
+    pair_id = np.empty(0, dtype=np.int64)
+    used = np.empty(0, dtype=bool)
+    done = np.empty(0, dtype=bool)
+    written = 0
+    with open_table(output_file, 'w') as output:
+        # A final None flushes the carried rows
+        for chunk in itertools.chain(iter_contours(input_file, where=where, chunksize=chunksize), [None]):
+            if chunk is not None:
+                read += len(chunk)
+                carry = chunk if carry is None else pd.concat([carry, chunk])
+                status = np.concatenate([status, np.full(len(chunk), -1, dtype=np.int8)])
+                pair_id = np.concatenate([pair_id, np.full(len(chunk), -1, dtype=np.int64)])
+                used = np.concatenate([used, np.zeros(len(chunk), dtype=bool)])
+                done = np.concatenate([done, np.zeros(len(chunk), dtype=bool)])
+            if carry is None or not len(carry):
+                continue
+
+            frame = carry['frame'].to_numpy(dtype=np.int64)
+            incomplete = np.searchsorted(last_rows, read, side='left')
+            if chunk is None or incomplete == len(last_rows):
+                todo, ready = ~done, len(frame)
+            else:
+                # Frames from `lowest` on may still continue in the next chunks
+                lowest = lowest_after[incomplete]
+                todo = ~done & (frame < min(lowest, lowest - frame_offset - frame_tolerance))
+                final = frame < lowest - frame_tolerance - max(frame_tolerance, abs(frame_offset))
+                ready = int(np.argmin(final)) if not final.all() else len(frame)
+            left, right = match_pairs_window(frame, tank_codes(carry['tank']), carry['cXtank'], carry['cY'],
+                                             frame_tolerance, todo=todo, used=used, offset=frame_offset)
+            _pair_codes(carry, left, right, distance_x, distance_y, status, pair_id)
+            done |= todo
+
+            if ready:
+                out = _add_match_columns(carry.iloc[:ready].copy(), status[:ready], pair_id[:ready])
+                out.to_csv(output, sep='\t', index=False, header=written == 0)
+                written += ready
+                carry, status, pair_id = carry.iloc[ready:], status[ready:], pair_id[ready:]
+                used, done = used[ready:], done[ready:]
+    return written
+
+
+def match_cameras(input_file, output_file, distance_x=200, distance_y=200, mode='greedy', frame_tolerance=0,
+                  chunksize=None, frame_offset=0, workers=1):
     """
     Matches camera data based on cX and cY values and writes the updated DataFrame to an output file.
 
+    Left and right contours of the same frame and tank number are paired by their
+    (cXtank, cY) distance (see lunar.match_engine.match_pairs), and both rows of a
+    pair get its status: 'match', or 'xdif'/'ydif'/'bothdif' when the coordinates
+    differ by more than distance_x and/or distance_y. Unpaired rows are left empty.
+    Both rows of a pair also get the same 'pair_id', the row number of the left
+    contour in the input table (-1 for unpaired rows), so pairs can be rebuilt with
+    a single join.
+
+    When the cameras are not synchronised, frame_tolerance lets a left contour pair
+    with a right contour up to that many frames away (see
+    lunar.match_engine.match_pairs_window).
+    A known clock offset between the cameras is given as frame_offset, or estimated
+    from the data with frame_offset='auto' (see lunar.camera_offset); an estimate whose
+    correlation is below camera_offset.MIN_CORRELATION is not trusted, and no offset is
+    applied.
+
     Parameters:
-    - input_file (str): Path to the input tab-delimited file.
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
     - output_file (str): Path to the output file.
     - distance_x (float): Maximum allowed difference for cX values.
     - distance_y (float): Maximum allowed difference for cY values.
+    - mode (str, optional): 'greedy' (default) pairs each left contour, in file order, with the nearest
+      free right contour; 'optimal' minimises the total distance within each frame and tank
+      (only with frame_tolerance=0).
+    - frame_tolerance (int, optional): Largest frame difference between paired contours (default: 0).
+    - chunksize (int, optional): If given, the input is streamed and written chunk by chunk so it
+      never has to fit in memory; nothing is returned in that case (default: None).
+    - frame_offset (int or str, optional): Frame lag of the right camera, so that right frame
+      f + frame_offset is matched with left frame f, or 'auto' to estimate it (default: 0).
+    - workers (int, optional): Number of processes matching frame partitions in parallel (default: 1;
+      None uses all cores). The input is streamed in chunks re-cut on frame boundaries, found in a
+      first pass over the frame column so the input need not be sorted by frame, and at most
+      2 * workers partitions are held in memory; only for same-frame matching
+      (frame_tolerance=0, frame_offset=0).
+
+    Returns:
+    - DataFrame: The matched data with the 'match_status' and 'pair_id' columns (None when streaming
+      with chunksize or workers).
     """
-    # Read the CSV file
-    df = pd.read_csv(input_file, delimiter='\t')
-
-    # Filter out rows where 'tank' is 'noise'
-    df = df[df['tank'] != 'noise']
-
-    # Add a new column for the match status
-    df['match_status'] = ""
-
-    # Function to find the closest pairs between two lists considering both cX and cY values
-    def find_closest_pairs(left, right, left_indices, right_indices):
-        pairs = []
-        used_right_indices = set()
-        for left_val, left_idx in zip(left, left_indices):
-            closest_idx = None
-            closest_dist = float('inf')
-            for idx, (right_val, right_idx) in enumerate(zip(right, right_indices)):
-                if idx in used_right_indices:
-                    continue
-                # Calculate Euclidean distance between the left and right points
-                dist = np.sqrt((left_val[0] - right_val[0])**2 + (left_val[1] - right_val[1])**2)
-                if dist < closest_dist:
-                    closest_dist = dist
-                    closest_idx = idx
-            if closest_idx is not None:
-                pairs.append((left_val, right[closest_idx], left_idx, right_indices[closest_idx]))
-                used_right_indices.add(closest_idx)
-        return pairs
-
-    # Prepare lists to store matched, included, and excluded pairs for each tank
-    included_pairs = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_x = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_y = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_both = {f'tank{i}': [] for i in range(1, 4)}
-
-    # Group by frame and process each group
-    for frame, group in df.groupby('frame'):
-        for tank_num in range(1, 4):
-            left_tank = group[group['tank'] == f'left_tank{tank_num}'][['cXtank', 'cY']].values
-            right_tank = group[group['tank'] == f'right_tank{tank_num}'][['cXtank', 'cY']].values
-            left_indices = group[group['tank'] == f'left_tank{tank_num}'].index
-            right_indices = group[group['tank'] == f'right_tank{tank_num}'].index
-
-            pairs = find_closest_pairs(left_tank, right_tank, left_indices, right_indices)
-
-            for (left_val, right_val, left_idx, right_idx) in pairs:
-                left_val_x, left_val_y = left_val
-                right_val_x, right_val_y = right_val
-                x_diff_too_high = abs(left_val_x - right_val_x) > distance_x
-                y_diff_too_high = abs(left_val_y - right_val_y) > distance_y
-
-                if x_diff_too_high and y_diff_too_high:
-                    excluded_pairs_both[f'tank{tank_num}'].append((left_val, right_val))
-                    df.at[left_idx, 'match_status'] = 'bothdif'
-                    df.at[right_idx, 'match_status'] = 'bothdif'
-                elif x_diff_too_high:
-                    excluded_pairs_x[f'tank{tank_num}'].append((left_val, right_val))
-                    df.at[left_idx, 'match_status'] = 'xdif'
-                    df.at[right_idx, 'match_status'] = 'xdif'
-                elif y_diff_too_high:
-                    excluded_pairs_y[f'tank{tank_num}'].append((left_val, right_val))
-                    df.at[left_idx, 'match_status'] = 'ydif'
-                    df.at[right_idx, 'match_status'] = 'ydif'
-                else:
-                    included_pairs[f'tank{tank_num}'].append((left_val, right_val))
-                    df.at[left_idx, 'match_status'] = 'match'
-                    df.at[right_idx, 'match_status'] = 'match'
+    if frame_tolerance < 0:
+        raise ValueError("frame_tolerance must be >= 0")
+    where = {'tank': [t for t in TANK_LABELS if t != 'noise']}
+    if isinstance(frame_offset, str) and frame_offset == 'auto':
+        estimate = estimate_camera_offset(input_file, chunksize=chunksize)
+        print(f"Estimated camera offset: {estimate['lag']} frames (correlation {estimate['correlation']:.2f})")
+        frame_offset = estimate['lag']
+        if estimate['correlation'] < MIN_CORRELATION:
+            print(f"Warning: camera offset correlation below {MIN_CORRELATION}; matching without an offset")
+            frame_offset = 0
+    same_frame = frame_tolerance == 0 and frame_offset == 0
+    if workers != 1 and not same_frame:
+        raise ValueError("workers is only available for same-frame matching (frame_tolerance=0, frame_offset=0)")
+    streaming = chunksize is not None or workers != 1
+    if mode == 'optimal' and (frame_tolerance or (streaming and not same_frame)):
+        raise ValueError("mode='optimal' is only available for matching within a frame")
+
+    if streaming and same_frame:
+        # Frames are independent, so partitions cut on frame boundaries are matched in a pool
+        match = partial(_match_partition, distance_x=distance_x, distance_y=distance_y, mode=mode)
+        ends = _frame_ends(iter_contours(input_file, columns=['frame'], where=where, chunksize=chunksize))
+        partitions = _frame_partitions(iter_contours(input_file, where=where, chunksize=chunksize), ends)
+        with open_table(output_file, 'w') as output:
+            for text in ordered_map(match, ((part, number == 0) for number, part in enumerate(partitions)),
+                                    workers=workers):
+                output.write(text)
+        print(f"Updated data has been written to {output_file}")
+        return None
+    if streaming:
+        _match_stream(input_file, output_file, where, distance_x, distance_y, frame_tolerance, chunksize,
+                      frame_offset)
+        print(f"Updated data has been written to {output_file}")
+        return None
+
+    # Read the CSV file, filtering out rows where 'tank' is 'noise'
+    df = read_contours(input_file, where=where)
+
+    if frame_tolerance:
+        left, right = match_pairs_window(df['frame'].to_numpy(dtype=np.int64), tank_codes(df['tank']),
+                                         df['cXtank'], df['cY'], frame_tolerance, offset=frame_offset)
+        status, pair_id = _pair_codes(df, left, right, distance_x, distance_y)
+    else:
+        status, pair_id = _match_same_frame(df, distance_x, distance_y, mode, frame_offset)
+    _add_match_columns(df, status, pair_id)
 
     # Write the updated DataFrame to a new tab-delimited file
-    df.to_csv(output_file, sep='\t', index=False)
+    write_table(df, output_file)
     print(f"Updated data has been written to {output_file}")
-
+    return df
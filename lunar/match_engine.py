@@ -0,0 +1,272 @@
+# lunar/match_engine.py
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from .loader import TANK_LABELS, MATCH_LABELS
+
+# Tank number (1-3) and side (0 left, 1 right) of each tank code; noise is tank 0
+TANK_NUMBER = np.array([0, 1, 2, 3, 1, 2, 3], dtype=np.int64)
+TANK_SIDE = np.array([-1, 0, 0, 0, 1, 1, 1], dtype=np.int64)
+assert [TANK_LABELS[i] for i in (1, 2, 3, 4, 5, 6)] == ['left_tank1', 'left_tank2', 'left_tank3',
+                                                        'right_tank1', 'right_tank2', 'right_tank3']
+
+MODES = ('greedy', 'optimal')
+
+
+def tank_codes(tank):
+    """Returns the TANK_LABELS codes of a tank column (labels or Categorical) as an int array (-1 if unknown)."""
+    if hasattr(tank, 'cat'):
+        tank = tank.cat.set_categories(TANK_LABELS)
+        return tank.cat.codes.to_numpy().astype(np.int64)
+    lookup = {label: code for code, label in enumerate(TANK_LABELS)}
+    return np.array([lookup.get(label, -1) for label in tank], dtype=np.int64)
+
+
+def _segment_first_min(group, value):
+    """
+    Returns, for each group, the position of its smallest finite value (the earliest position on ties).
+    """
+    finite = np.isfinite(value)
+    candidates = np.flatnonzero(finite)
+    order = candidates[np.lexsort((candidates, value[candidates], group[candidates]))]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = group[order][1:] != group[order][:-1]
+    return order[first]
+
+
+def _distances(lx, ly, rx, ry):
+    return np.sqrt((lx[:, None] - rx[None, :]) ** 2 + (ly[:, None] - ry[None, :]) ** 2)
+
+
+def match_pairs(frame, tank, x, y, mode='greedy'):
+    """
+    Pairs left and right contours of the same frame and tank number.
+
+    Rows are sorted once by (frame, tank number, side) and every group is sliced
+    from offsets. Groups where one side has a single contour (by far the most common
+    case) are paired with vectorized segment reductions; larger groups are paired
+    with a small distance matrix per group.
+
+    mode='greedy' reproduces the original match_cameras exactly: left contours, in
+    row order, each take the nearest right contour not yet taken (the first one on
+    ties). mode='optimal' instead minimises the total distance within each group
+    (scipy linear_sum_assignment).
+
+    Parameters:
+    - frame (ndarray): Frame of each row.
+    - tank (ndarray): TANK_LABELS code of each row (noise and unknown rows are never paired).
+    - x (ndarray): cXtank of each row.
+    - y (ndarray): cY of each row.
+    - mode (str, optional): 'greedy' (default) or 'optimal'.
+
+    Returns:
+    - tuple: (left, right) arrays of row positions, one entry per pair.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    tank = np.asarray(tank, dtype=np.int64)
+    valid = np.flatnonzero((tank >= 0) & (TANK_SIDE[np.maximum(tank, 0)] >= 0))
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Sort once by (frame, tank number, side, row); groups are runs of equal (frame, tank number)
+    frame = np.asarray(frame, dtype=np.int64)
+    rows = valid[np.lexsort((valid, TANK_SIDE[tank[valid]], TANK_NUMBER[tank[valid]], frame[valid]))]
+    frame_s, number_s, side_s = frame[rows], TANK_NUMBER[tank[rows]], TANK_SIDE[tank[rows]]
+
+    new_group = np.ones(len(rows), dtype=bool)
+    new_group[1:] = (frame_s[1:] != frame_s[:-1]) | (number_s[1:] != number_s[:-1])
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], len(rows))
+    n_left = np.add.reduceat((side_s == 0).astype(np.int64), starts) if len(starts) else np.empty(0, dtype=np.int64)
+    n_right = (ends - starts) - n_left
+    split = starts + n_left  # first right row of each group
+
+    lefts, rights = [], []
+
+    # One left contour: it takes the nearest right contour
+    sel = np.flatnonzero((n_left == 1) & (n_right >= 1))
+    if len(sel):
+        member = np.repeat(sel, n_right[sel])
+        pos = _ranges(split[sel], ends[sel])
+        left_rows = rows[starts[member]]
+        d = np.sqrt((x[left_rows] - x[rows[pos]]) ** 2 + (y[left_rows] - y[rows[pos]]) ** 2)
+        best = _segment_first_min(member, d)
+        lefts.append(left_rows[best])
+        rights.append(rows[pos[best]])
+
+    # One right contour (and several lefts): greedy gives it to the first left that can reach it,
+    # optimal to the nearest left
+    sel = np.flatnonzero((n_right == 1) & (n_left > 1))
+    if len(sel):
+        member = np.repeat(sel, n_left[sel])
+        pos = _ranges(starts[sel], split[sel])
+        right_rows = rows[split[member]]
+        d = np.sqrt((x[rows[pos]] - x[right_rows]) ** 2 + (y[rows[pos]] - y[right_rows]) ** 2)
+        if mode == 'optimal':
+            best = _segment_first_min(member, d)
+        else:
+            best = _segment_first_min(member, np.where(np.isfinite(d), 0.0, np.inf))
+        lefts.append(rows[pos[best]])
+        rights.append(right_rows[best])
+
+    # Several contours on both sides: distance matrix per group
+    for g in np.flatnonzero((n_left > 1) & (n_right > 1)):
+        left_rows = rows[starts[g]:split[g]]
+        right_rows = rows[split[g]:ends[g]]
+        d = _distances(x[left_rows], y[left_rows], x[right_rows], y[right_rows])
+        if mode == 'optimal':
+            d = np.where(np.isfinite(d), d, 1e300)
+            li, ri = linear_sum_assignment(d)
+            keep = d[li, ri] < 1e300
+            li, ri = li[keep], ri[keep]
+        else:
+            li, ri = _greedy(d)
+        lefts.append(left_rows[li])
+        rights.append(right_rows[ri])
+
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lefts).astype(np.int64), np.concatenate(rights).astype(np.int64)
+
+
+def match_pairs_window(frame, tank, x, y, tolerance, todo=None, used=None, offset=0):
+    """
+    Pairs left and right contours of the same tank number up to `tolerance` frames apart.
+
+    This is a sorted-merge join over frame-ordered arrays: the right contours of each
+    tank number are in frame order, so the candidates of a left contour are the
+    slice found by binary search for frames f + offset - tolerance .. f + offset + tolerance. Left
+    contours are resolved greedily in frame order (row order within a frame), each taking
+    the nearest free candidate, with ties going to the lag closest to the offset and then
+    to the earlier row. With tolerance 0 this gives the same pairs as match_pairs(mode='greedy').
+
+    Rows that are not sorted by frame are stable-sorted first (todo and used with
+    them), and the pairs are returned as positions in the original order.
+
+    Parameters:
+    - frame (ndarray): Frame of each row.
+    - tank (ndarray): TANK_LABELS code of each row.
+    - x (ndarray): cXtank of each row.
+    - y (ndarray): cY of each row.
+    - tolerance (int): Largest frame difference between paired contours.
+    - todo (ndarray, optional): Boolean mask of the left contours to resolve (default: all).
+    - used (ndarray, optional): Boolean mask of right contours already taken; it is updated
+      in place, so a stream can resolve left contours in several calls (default: none taken).
+    - offset (int, optional): Frame lag of the right camera; the right contour of frame f + offset
+      shows the same moment as the left contour of frame f (default: 0).
+
+    Returns:
+    - tuple: (left, right) arrays of row positions, one entry per pair.
+    """
+    frame = np.asarray(frame, dtype=np.int64)
+    tank = np.asarray(tank, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(frame) and np.any(np.diff(frame) < 0):
+        order = np.argsort(frame, kind='stable')
+        sorted_used = None if used is None else used[order]
+        left, right = match_pairs_window(frame[order], tank[order], x[order], y[order], tolerance,
+                                         todo=None if todo is None else todo[order], used=sorted_used,
+                                         offset=offset)
+        if used is not None:
+            used[order] = sorted_used
+        return order[left], order[right]
+    known = tank >= 0
+    side = np.where(known, TANK_SIDE[np.maximum(tank, 0)], -1)
+    number = np.where(known, TANK_NUMBER[np.maximum(tank, 0)], 0)
+    if todo is None:
+        todo = np.ones(len(frame), dtype=bool)
+    if used is None:
+        used = np.zeros(len(frame), dtype=bool)
+
+    # Candidate (left, right) pairs of every tank number, from the frame window of each left contour
+    cand_left, cand_right = [], []
+    for n in (1, 2, 3):
+        right_rows = np.flatnonzero((side == 1) & (number == n) & ~used)
+        left_rows = np.flatnonzero((side == 0) & (number == n) & todo)
+        if not len(right_rows) or not len(left_rows):
+            continue
+        lo = np.searchsorted(frame[right_rows], frame[left_rows] + offset - tolerance, side='left')
+        hi = np.searchsorted(frame[right_rows], frame[left_rows] + offset + tolerance, side='right')
+        cand_left.append(np.repeat(left_rows, hi - lo))
+        cand_right.append(right_rows[_ranges(lo, hi)])
+    if not cand_left:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    cand_left = np.concatenate(cand_left)
+    cand_right = np.concatenate(cand_right)
+    d = np.sqrt((x[cand_left] - x[cand_right]) ** 2 + (y[cand_left] - y[cand_right]) ** 2)
+    finite = np.isfinite(d)
+    cand_left, cand_right, d = cand_left[finite], cand_right[finite], d[finite]
+    lag = np.abs(frame[cand_right] - frame[cand_left] - offset)
+    order = np.lexsort((cand_right, lag, d, cand_left))
+    cand_left, cand_right = cand_left[order], cand_right[order]
+
+    # A left contour whose candidates no other left contour wants simply takes its first one
+    contested = np.zeros(len(frame), dtype=bool)
+    contested[cand_left[np.bincount(cand_right, minlength=len(frame))[cand_right] > 1]] = True
+    alone = ~contested[cand_left]
+    first = np.ones(len(cand_left), dtype=bool)
+    first[1:] = cand_left[1:] != cand_left[:-1]
+    lefts = [cand_left[alone & first]]
+    rights = [cand_right[alone & first]]
+    used[rights[0]] = True
+
+    # The others, in order, each take their first candidate that is still free
+    current, li, ri = -1, [], []
+    for left, right in zip(cand_left[~alone].tolist(), cand_right[~alone].tolist()):
+        if left == current or used[right]:
+            continue
+        used[right] = True
+        current = left
+        li.append(left)
+        ri.append(right)
+    lefts.append(np.array(li, dtype=np.int64))
+    rights.append(np.array(ri, dtype=np.int64))
+    return np.concatenate(lefts), np.concatenate(rights)
+
+
+def _ranges(starts, ends):
+    # Concatenation of np.arange(s, e) for every (s, e) pair
+    lengths = ends - starts
+    if not len(lengths) or lengths.sum() == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum()) + offsets
+
+
+def _greedy(d):
+    # Each left row, in order, takes the nearest untaken right column (first on ties)
+    d = np.where(np.isnan(d), np.inf, d)
+    li, ri = [], []
+    for i in range(d.shape[0]):
+        j = int(np.argmin(d[i]))
+        if d[i, j] < np.inf:
+            li.append(i)
+            ri.append(j)
+            d[:, j] = np.inf
+    return np.array(li, dtype=np.int64), np.array(ri, dtype=np.int64)
+
+
+def pair_status(x, y, left, right, distance_x, distance_y):
+    """
+    Classifies pairs by their coordinate differences.
+
+    Parameters:
+    - x (ndarray): cXtank of each row.
+    - y (ndarray): cY of each row.
+    - left (ndarray): Row positions of the left contour of each pair.
+    - right (ndarray): Row positions of the right contour of each pair.
+    - distance_x (float): Maximum allowed difference for cX values.
+    - distance_y (float): Maximum allowed difference for cY values.
+
+    Returns:
+    - ndarray: MATCH_LABELS code per pair ('match', 'xdif', 'ydif' or 'bothdif').
+    """
+    x_diff_too_high = np.abs(x[left] - x[right]) > distance_x
+    y_diff_too_high = np.abs(y[left] - y[right]) > distance_y
+    status = np.full(len(left), MATCH_LABELS.index('match'), dtype=np.int8)
+    status[x_diff_too_high] = MATCH_LABELS.index('xdif')
+    status[y_diff_too_high] = MATCH_LABELS.index('ydif')
+    status[x_diff_too_high & y_diff_too_high] = MATCH_LABELS.index('bothdif')
+    return status
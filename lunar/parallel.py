@@ -0,0 +1,40 @@
+# lunar/parallel.py
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def ordered_map(func, items, workers=None, max_pending=None):
+    """
+    Applies func to every item in a process pool and yields the results in input order.
+
+    Items are pulled from the iterable only as results are consumed, so at most
+    `max_pending` items (and their results) are held at once. This keeps memory
+    bounded when items are large chunks of a file that is read lazily, and lets
+    the caller write results in the original row order as they come in.
+
+    Parameters:
+    - func (callable): Picklable function of one argument (e.g. a module-level function or a functools.partial).
+    - items (iterable): Inputs, consumed lazily.
+    - workers (int, optional): Number of worker processes (default: all cores); 1 runs in-process.
+    - max_pending (int, optional): Maximum number of items in flight (default: 2 * workers).
+
+    Yields:
+    - The result of func for each item, in the order of items.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
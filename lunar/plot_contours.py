@@ -1,18 +1,23 @@
 import pandas as pd
 import matplotlib.pyplot as plt
+from .loader import read_contours, table_columns
 
-def plot_contours(file_path, glare=False, zoomx=None, zoomy=None):
+def plot_contours(file_path, glare=False, zoomx=None, zoomy=None, frames=None):
     """
     Plots frame vs. cX from a tab-delimited file containing contour data.
 
     Parameters:
-    - file_path (str): Path to the tab-delimited file.
+    - file_path (str, DataFrame or ContourTable): Path to the tab-delimited file, or an in-memory table.
     - glare (bool): If True, color points based on the 'glare' column values.
     - zoomx (tuple): A tuple specifying the x-axis range (min, max) for a zoomed-in plot.
     - zoomy (tuple): A tuple specifying the y-axis range (min, max) for a zoomed-in plot.
+    - frames (tuple): A (start, stop) frame window; only those rows are read, using the frame index sidecar.
     """
-    # Load the file into a DataFrame
-    data = pd.read_csv(file_path, delimiter='\t')
+    # Load only the columns needed for plotting
+    columns = ['frame', 'cX']
+    if glare and 'glare' in table_columns(file_path):
+        columns.append('glare')
+    data = read_contours(file_path, columns=columns, frames=frames)
 
     # Convert columns to numpy arrays before plotting
     frame = data['frame'].to_numpy()
@@ -66,6 +71,8 @@ if __name__ == "__main__":
                         help="Zoom x-axis range (e.g., --zoomx 1000 2000)")
     parser.add_argument("--zoomy", nargs=2, type=int, metavar=("YMIN", "YMAX"),
                         help="Zoom y-axis range (e.g., --zoomy 300 400)")
+    parser.add_argument("--frames", nargs=2, type=int, metavar=("START", "STOP"),
+                        help="Only read this frame window, using the frame index (e.g., --frames 1000 2000)")
 
     args = parser.parse_args()
 
@@ -76,6 +83,7 @@ if __name__ == "__main__":
         file_path=args.file,
         glare=args.glare,
         zoomx=zoomx_tuple,
-        zoomy=zoomy_tuple
+        zoomy=zoomy_tuple,
+        frames=tuple(args.frames) if args.frames else None
     )
 
@@ -1,5 +1,6 @@
 import pandas as pd
 import matplotlib.pyplot as plt
+from .loader import read_contours
 
 def plot_days(file_name, x_axis='frame'):
     """
@@ -13,7 +14,7 @@ def plot_days(file_name, x_axis='frame'):
     - None
     """
     # Read the tab-delimited file into a DataFrame
-    data = pd.read_csv(file_name, delimiter='\t')
+    data = read_contours(file_name)
     
     # Ensure required columns exist, including the chosen x-axis
     required_columns = {'date', 'average_contours', 'kclusters', x_axis}
@@ -85,7 +86,7 @@ def plot_days(file_name, x_axis='frame'):
 
 def plot_days_old(file_name):
     # Read the tab-delimited file into a DataFrame
-    data = pd.read_csv(file_name, delimiter='\t')
+    data = read_contours(file_name)
     
     # Ensure 'date', 'frame', 'average_contours', and 'kclusters' columns exist
     required_columns = {'date', 'frame', 'average_contours', 'kclusters'}
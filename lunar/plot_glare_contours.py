@@ -2,20 +2,21 @@
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from .loader import read_contours
 
 def plot_glare_contours(input_file, color_by_cluster=False):
     """
     Scatter plot of Frame vs. cX, colored by glare or cluster.
 
     Parameters:
-    - input_file (str): Path to the input tab-delimited file.
+    - input_file (str, DataFrame or ContourTable): Path to the input tab-delimited file, or an in-memory table.
     - color_by_cluster (bool): If True, color by cluster; otherwise, color by glare.
     
     Returns:
     - None
     """
-    # Load the input file
-    df = pd.read_csv(input_file, sep='\t')
+    # Load only the columns needed for plotting
+    df = read_contours(input_file, columns=['frame', 'cX', 'cluster' if color_by_cluster else 'glare'])
 
     plt.figure(figsize=(10, 6))
 
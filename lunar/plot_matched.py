@@ -1,85 +1,95 @@
 # lunar/plot_matched.py
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from .loader import read_contours, table_columns, MATCH_LABELS
+from .match_engine import tank_codes, TANK_NUMBER, TANK_SIDE
 
-def plot_matched(input_file):
+# Colour and legend label of each match status, in plotting order
+STATUS_STYLES = {
+    'match': ('#1f77b4', 'Included'),
+    'xdif': ('red', 'Excluded (x)'),
+    'ydif': ('yellow', 'Excluded (y)'),
+    'bothdif': ('orange', 'Excluded (both)'),
+}
+
+
+def matched_pairs(input_file):
     """
-    Plots the correlations between left and right tanks based on the matched results.
+    Rebuilds the left/right pairs of a matched table with a single join.
+
+    Tables written by match_cameras carry a 'pair_id' shared by both rows of a pair
+    and are joined on it. Older tables without it are joined on frame, tank number
+    and match status, which gives the same pairs as the original per-row search.
 
     Parameters:
-    - input_file (str): Path to the tab-delimited input file containing match statuses.
+    - input_file (str, DataFrame or ContourTable): Matched table, or an in-memory table.
+
+    Returns:
+    - DataFrame: One row per pair with tank (1-3), match_status, and cXtank/cY of the
+      left and right contours (suffixes _left and _right).
     """
-    # Read the input file
-    df = pd.read_csv(input_file, delimiter='\t')
+    has_ids = 'pair_id' in table_columns(input_file)
+    columns = ['frame', 'tank', 'cXtank', 'cY', 'match_status'] + (['pair_id'] if has_ids else [])
+    df = read_contours(input_file, columns=columns)
+    df = df[df['match_status'].notna()]
 
-    # Prepare lists for matched, included, and excluded pairs
-    included_pairs = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_x = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_y = {f'tank{i}': [] for i in range(1, 4)}
-    excluded_pairs_both = {f'tank{i}': [] for i in range(1, 4)}
+    codes = tank_codes(df['tank'])
+    known = codes >= 0
+    df = df[known]
+    codes = codes[known]
+    sides = pd.DataFrame({'frame': df['frame'].to_numpy(), 'tank': TANK_NUMBER[codes],
+                          'match_status': df['match_status'].to_numpy(),
+                          'cXtank': df['cXtank'].to_numpy(), 'cY': df['cY'].to_numpy()})
+    if has_ids:
+        sides['pair_id'] = df['pair_id'].to_numpy()
+        keys = ['pair_id']
+    else:
+        keys = ['frame', 'tank', 'match_status']
+    side = TANK_SIDE[codes]
+    left, right = sides[side == 0], sides[side == 1]
+    pairs = left.merge(right[keys + ['cXtank', 'cY']], on=keys, suffixes=('_left', '_right'))
+    return pairs[['tank', 'match_status', 'cXtank_left', 'cY_left', 'cXtank_right', 'cY_right']]
 
-    # Fill lists based on the match status in the DataFrame
-    for tank_num in range(1, 4):
-        df_left = df[df['tank'] == f'left_tank{tank_num}']
-        df_right = df[df['tank'] == f'right_tank{tank_num}']
-        
-        # Iterate over each row in the left tank data
-        for _, left_row in df_left.iterrows():
-            # Find matching rows in the right tank data by frame and match status
-            matched_right = df_right[(df_right['frame'] == left_row['frame']) & 
-                                     (df_right['match_status'] == left_row['match_status'])]
-
-            # Add pairs to the appropriate lists based on the match status
-            for _, right_row in matched_right.iterrows():
-                pair = ((left_row['cXtank'], left_row['cY']), (right_row['cXtank'], right_row['cY']))
-                
-                if left_row['match_status'] == 'match':
-                    included_pairs[f'tank{tank_num}'].append(pair)
-                elif left_row['match_status'] == 'xdif':
-                    excluded_pairs_x[f'tank{tank_num}'].append(pair)
-                elif left_row['match_status'] == 'ydif':
-                    excluded_pairs_y[f'tank{tank_num}'].append(pair)
-                elif left_row['match_status'] == 'bothdif':
-                    excluded_pairs_both[f'tank{tank_num}'].append(pair)
+
+def plot_matched(input_file, max_points=100000, seed=0):
+    """
+    Plots the correlations between left and right tanks based on the matched results.
+
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the tab-delimited input file containing match statuses,
+      or an in-memory table.
+    - max_points (int, optional): Largest number of pairs drawn per tank; larger sets are randomly
+      downsampled, keeping the mix of statuses (default: 100000; None draws all).
+    - seed (int, optional): Seed of the downsampling (default: 0).
+    """
+    pairs = matched_pairs(input_file)
+    rng = np.random.default_rng(seed)
 
     # Plotting
     plt.figure(figsize=(15, 10))
 
     for tank_num in range(1, 4):
         plt.subplot(3, 1, tank_num)
-        
-        # Plot included pairs
-        if included_pairs[f'tank{tank_num}']:
-            left_vals, right_vals = zip(*included_pairs[f'tank{tank_num}'])
-            left_vals_x, left_vals_y = zip(*left_vals)
-            right_vals_x, right_vals_y = zip(*right_vals)
-            plt.scatter(left_vals_x, right_vals_x, color='#1f77b4', s=20, alpha=0.7, label='Included')
-
-        # Plot excluded pairs by x difference
-        if excluded_pairs_x[f'tank{tank_num}']:
-            left_vals_excl, right_vals_excl = zip(*excluded_pairs_x[f'tank{tank_num}'])
-            left_vals_excl_x, left_vals_excl_y = zip(*left_vals_excl)
-            right_vals_excl_x, right_vals_excl_y = zip(*right_vals_excl)
-            plt.scatter(left_vals_excl_x, right_vals_excl_x, color='red', s=20, alpha=0.7, label='Excluded (x)')
-
-        # Plot excluded pairs by y difference
-        if excluded_pairs_y[f'tank{tank_num}']:
-            left_vals_excl, right_vals_excl = zip(*excluded_pairs_y[f'tank{tank_num}'])
-            left_vals_excl_x, left_vals_excl_y = zip(*left_vals_excl)
-            right_vals_excl_x, right_vals_excl_y = zip(*right_vals_excl)
-            plt.scatter(left_vals_excl_x, right_vals_excl_x, color='yellow', s=20, alpha=0.7, label='Excluded (y)')
-
-        # Plot excluded pairs by both differences
-        if excluded_pairs_both[f'tank{tank_num}']:
-            left_vals_excl, right_vals_excl = zip(*excluded_pairs_both[f'tank{tank_num}'])
-            left_vals_excl_x, left_vals_excl_y = zip(*left_vals_excl)
-            right_vals_excl_x, right_vals_excl_y = zip(*right_vals_excl)
-            plt.scatter(left_vals_excl_x, right_vals_excl_x, color='orange', s=20, alpha=0.7, label='Excluded (both)')
+        tank_pairs = pairs[pairs['tank'] == tank_num]
+        title = f"Correlation between Left Tank {tank_num} and Right Tank {tank_num}"
+        if max_points is not None and len(tank_pairs) > max_points:
+            keep = np.sort(rng.choice(len(tank_pairs), max_points, replace=False))
+            title += f" ({max_points} of {len(tank_pairs)} pairs)"
+            tank_pairs = tank_pairs.iloc[keep]
+
+        status = tank_pairs['match_status'].to_numpy()
+        for name in MATCH_LABELS:
+            color, label = STATUS_STYLES[name]
+            selected = tank_pairs[status == name]
+            if len(selected):
+                plt.scatter(selected['cXtank_left'], selected['cXtank_right'], color=color, s=20, alpha=0.7,
+                            label=label, rasterized=len(tank_pairs) > 10000)
 
         plt.xlim(0, 600)
         plt.ylim(0, 600)
-        plt.title(f"Correlation between Left Tank {tank_num} and Right Tank {tank_num}")
+        plt.title(title)
         plt.xlabel(f"Left Tank {tank_num} cX")
         plt.ylabel(f"Right Tank {tank_num} cX")
         plt.grid(True)
@@ -87,4 +97,3 @@ def plot_matched(input_file):
 
     plt.tight_layout()
     plt.show()
-
@@ -0,0 +1,260 @@
+# lunar/query.py
+
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .loader import iter_contours
+
+# Columns stored for each kind of table; columns missing from an input file are stored as NULL
+CONTOUR_COLUMNS = {
+    'night': 'TEXT', 'frame': 'INTEGER', 'time': 'TEXT', 'cX': 'REAL', 'cY': 'REAL', 'area': 'REAL',
+    'minI': 'REAL', 'maxI': 'REAL', 'meanI': 'REAL', 'video': 'TEXT', 'glare': 'TEXT',
+    'camera': 'TEXT', 'tank': 'TEXT', 'cXtank': 'REAL', 'match_status': 'TEXT',
+    'pair_id': 'INTEGER', 'X': 'REAL', 'Y': 'REAL', 'Z': 'REAL', 'residual': 'REAL', 'bad_match': 'TEXT',
+}
+SMOOTH_COLUMNS = {
+    'night': 'TEXT', 'frame': 'INTEGER', 'time': 'TEXT', 'average_contours': 'REAL', 'sem': 'REAL',
+    'cluster': 'INTEGER', 'date': 'TEXT',
+}
+TABLES = {'contours': CONTOUR_COLUMNS, 'smooth': SMOOTH_COLUMNS}
+
+# Times are stored as sortable text that SQLite's date functions understand
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS contours_night_frame ON contours (night, frame)",
+    "CREATE INDEX IF NOT EXISTS contours_tank_time ON contours (tank, time)",
+    "CREATE INDEX IF NOT EXISTS contours_night_tank_frame ON contours (night, tank, frame)",
+    "CREATE INDEX IF NOT EXISTS contours_time ON contours (time)",
+    "CREATE INDEX IF NOT EXISTS smooth_night_frame ON smooth (night, frame)",
+    "CREATE INDEX IF NOT EXISTS smooth_time ON smooth (time)",
+]
+
+VIEWS = [
+    # One row per night with its extent
+    """CREATE VIEW IF NOT EXISTS nights AS
+       SELECT night, COUNT(*) AS contours, MIN(frame) AS first_frame, MAX(frame) AS last_frame,
+              MIN(time) AS first_time, MAX(time) AS last_time
+       FROM contours GROUP BY night""",
+    # Contour counts per night and tank
+    """CREATE VIEW IF NOT EXISTS contours_per_tank AS
+       SELECT night, tank, COUNT(*) AS contours, MIN(frame) AS first_frame, MAX(frame) AS last_frame
+       FROM contours WHERE tank IS NOT NULL GROUP BY night, tank""",
+    # Contour counts per night, tank and clock minute (needs a time column)
+    """CREATE VIEW IF NOT EXISTS contours_per_minute AS
+       SELECT night, tank, strftime('%Y-%m-%d %H:%M', time) AS minute, COUNT(*) AS contours
+       FROM contours WHERE time IS NOT NULL GROUP BY night, tank, minute""",
+    # Left/right pairs accepted by match_cameras
+    """CREATE VIEW IF NOT EXISTS events AS
+       SELECT * FROM contours WHERE match_status = 'match'""",
+    # Smoothed activity per night and clock minute
+    """CREATE VIEW IF NOT EXISTS smooth_per_minute AS
+       SELECT night, strftime('%Y-%m-%d %H:%M', time) AS minute, AVG(average_contours) AS average_contours
+       FROM smooth WHERE time IS NOT NULL GROUP BY night, minute""",
+]
+
+
+def night_label(path):
+    """
+    Derives a night label from a file name, e.g. 'contours_22Jul2024_glare.tab' -> '22Jul2024'.
+
+    Parameters:
+    - path (str): Path of the table.
+
+    Returns:
+    - str: The date found in the file name, or the file name without extensions.
+    """
+    name = os.path.basename(str(path))
+    found = re.search(r'\d{1,2}[A-Z][a-z]{2}\d{4}', name)
+    return found.group(0) if found else name.split('.')[0]
+
+
+def _connect(db_path):
+    # The connection is closed if the tables cannot be created; callers close it otherwise
+    con = sqlite3.connect(db_path)
+    try:
+        for table, columns in TABLES.items():
+            spec = ', '.join(f'"{name}" {kind}' for name, kind in columns.items())
+            con.execute(f"CREATE TABLE IF NOT EXISTS {table} ({spec})")
+    except BaseException:
+        con.close()
+        raise
+    return con
+
+
+def _night_view_name(night):
+    return 'night_' + re.sub(r'\W', '_', night)
+
+
+def _frame_times(frames, frame1_time, fps):
+    # Same conversion as add_time: frame 1 is frame1_time
+    start = pd.Timestamp(datetime.strptime(frame1_time, '%Y-%m-%d %H:%M:%S'))
+    offsets = pd.to_timedelta((np.asarray(frames, dtype=np.float64) - 1) / fps, unit='s')
+    return (start + offsets).strftime(TIME_FORMAT)
+
+
+def ingest(db_path, files, kind='contours', night=None, frame1_time=None, fps=30, chunksize=500000):
+    """
+    Loads contour-type or smooth tables into an SQLite database, one night per file.
+
+    Contour, glare, analyzed and matched tables all go into the 'contours' table
+    (columns a file lacks are NULL); smooth_*.tsv files go into 'smooth'. Files are
+    streamed in chunks, so a night never has to fit in memory. After loading, the
+    frame/time/tank indexes and the summary views are (re)created, plus one
+    'night_<label>' view per night.
+
+    Parameters:
+    - db_path (str): Path of the SQLite database (created if missing).
+    - files (list): Paths of the tables to load.
+    - kind (str, optional): 'contours' or 'smooth' (default: 'contours').
+    - night (str, optional): Night label for all files (default: the date in each file name).
+    - frame1_time (str, optional): Time of frame 1, 'YYYY-MM-DD HH:MM:SS', used to fill the time
+      column of files that have no 'time' column (default: None).
+    - fps (float, optional): Frames per second for frame1_time (default: 30).
+    - chunksize (int, optional): Rows inserted per batch (default: 500000).
+
+    Returns:
+    - list: The night labels that were loaded.
+    """
+    if kind not in TABLES:
+        raise ValueError(f"kind must be one of {list(TABLES)}")
+    columns = TABLES[kind]
+
+    con = _connect(db_path)
+    loaded = []
+    try:
+        for path in files:
+            label = night or night_label(path)
+            # Replace a night that is loaded again
+            con.execute(f"DELETE FROM {kind} WHERE night = ?", (label,))
+            for chunk in iter_contours(path, chunksize=chunksize):
+                out = chunk.reindex(columns=list(columns))
+                out['night'] = label
+                if 'time' not in chunk and frame1_time is not None:
+                    out['time'] = _frame_times(chunk['frame'], frame1_time, fps)
+                elif 'time' in chunk:
+                    out['time'] = pd.to_datetime(chunk['time']).dt.strftime(TIME_FORMAT)
+                out.to_sql(kind, con, if_exists='append', index=False)
+            quoted = label.replace("'", "''")
+            con.execute(f"CREATE VIEW IF NOT EXISTS {_night_view_name(label)} AS "
+                        f"SELECT * FROM {kind} WHERE night = '{quoted}'")
+            con.commit()
+            loaded.append(label)
+            print(f"Loaded {path} as night {label}")
+
+        for statement in INDEXES + VIEWS:
+            con.execute(statement)
+        con.commit()
+    finally:
+        con.close()
+    return loaded
+
+
+def query(db_path, sql, params=()):
+    """
+    Runs an SQL query against a lunar database and returns the result.
+
+    Parameters:
+    - db_path (str): Path of the SQLite database.
+    - sql (str): The query, e.g. "SELECT * FROM contours_per_tank".
+    - params (tuple or dict, optional): Query parameters for '?' or ':name' placeholders.
+
+    Returns:
+    - DataFrame: The query result.
+    """
+    # sqlite3's own context manager only commits; closing() closes the connection
+    with closing(sqlite3.connect(db_path)) as con:
+        return pd.read_sql_query(sql, con, params=params)
+
+
+def pulses_per_minute(db_path, tank=None, start=None, end=None, nights=None, matched=False):
+    """
+    Counts contours per clock minute, optionally for one tank, a time-of-day window and some nights.
+
+    Parameters:
+    - db_path (str): Path of the SQLite database.
+    - tank (int or str, optional): Tank number (both cameras, e.g. 2 -> left_tank2 and right_tank2)
+      or a full tank label (default: all tanks).
+    - start (str, optional): Start of the time-of-day window, 'HH:MM' (inclusive).
+    - end (str, optional): End of the time-of-day window, 'HH:MM' (exclusive); a window that
+      crosses midnight (e.g. 21:00 to 02:00) is handled.
+    - nights (list, optional): Night labels to include (default: all nights).
+    - matched (bool, optional): Count only rows with match_status 'match' (default: False).
+
+    Returns:
+    - DataFrame: night, tank, minute and pulses for every minute with at least one contour.
+    """
+    conditions = ["time IS NOT NULL"]
+    params = []
+    if isinstance(tank, int):
+        conditions.append("tank IN (?, ?)")
+        params += [f'left_tank{tank}', f'right_tank{tank}']
+    elif tank is not None:
+        conditions.append("tank = ?")
+        params.append(tank)
+    clock = "strftime('%H:%M', time)"
+    if start is not None and end is not None and start > end:
+        conditions.append(f"({clock} >= ? OR {clock} < ?)")
+        params += [start, end]
+    else:
+        if start is not None:
+            conditions.append(f"{clock} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{clock} < ?")
+            params.append(end)
+    if nights:
+        conditions.append(f"night IN ({', '.join('?' * len(nights))})")
+        params += list(nights)
+    if matched:
+        conditions.append("match_status = 'match'")
+
+    sql = (f"SELECT night, tank, strftime('%Y-%m-%d %H:%M', time) AS minute, COUNT(*) AS pulses "
+           f"FROM contours WHERE {' AND '.join(conditions)} "
+           f"GROUP BY night, tank, minute ORDER BY night, minute, tank")
+    return query(db_path, sql, params)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Query multi-night contour datasets with SQLite.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ingest = sub.add_parser("ingest", help="Load contour or smooth tables into a database")
+    p_ingest.add_argument("db", help="Path of the SQLite database")
+    p_ingest.add_argument("files", nargs="+", help="Tables to load")
+    p_ingest.add_argument("-k", "--kind", choices=list(TABLES), default="contours", help="Table kind (default: contours)")
+    p_ingest.add_argument("-n", "--night", default=None, help="Night label (default: date in each file name)")
+    p_ingest.add_argument("--frame1", default=None, help="Time of frame 1, 'YYYY-MM-DD HH:MM:SS'")
+    p_ingest.add_argument("--fps", type=float, default=30, help="Frames per second (default: 30)")
+
+    p_sql = sub.add_parser("sql", help="Run an SQL query")
+    p_sql.add_argument("db", help="Path of the SQLite database")
+    p_sql.add_argument("sql", help="Query to run")
+
+    p_ppm = sub.add_parser("ppm", help="Pulses per minute")
+    p_ppm.add_argument("db", help="Path of the SQLite database")
+    p_ppm.add_argument("-t", "--tank", default=None, help="Tank number or label")
+    p_ppm.add_argument("-s", "--start", default=None, help="Start time of day, HH:MM")
+    p_ppm.add_argument("-e", "--end", default=None, help="End time of day, HH:MM")
+    p_ppm.add_argument("-n", "--nights", nargs="+", default=None, help="Nights to include")
+    p_ppm.add_argument("-m", "--matched", action="store_true", help="Only count matched pulses")
+
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ingest(args.db, args.files, kind=args.kind, night=args.night, frame1_time=args.frame1, fps=args.fps)
+    else:
+        if args.command == "sql":
+            result = query(args.db, args.sql)
+        else:
+            tank = int(args.tank) if args.tank is not None and args.tank.isdigit() else args.tank
+            result = pulses_per_minute(args.db, tank=tank, start=args.start, end=args.end,
+                                       nights=args.nights, matched=args.matched)
+        result.to_csv(sys.stdout, sep='\t', index=False)
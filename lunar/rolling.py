@@ -0,0 +1,212 @@
+# lunar/rolling.py
+
+import numpy as np
+import pandas as pd
+from .loader import iter_contours, TANK_LABELS
+from .match_engine import tank_codes
+
+# Count columns of the left and right camera of each tank
+TANK_PAIRS = [(TANK_LABELS.index(f'left_tank{n}'), TANK_LABELS.index(f'right_tank{n}')) for n in (1, 2, 3)]
+
+
+def frame_counts(source, chunksize=None):
+    """
+    Counts the contours of every tank in every frame.
+
+    The table is streamed with only its frame and tank columns. Each chunk is
+    counted with np.bincount over its own frame span and added into a dense
+    (tank x frame) int32 array, which grows by doubling as later frames arrive.
+
+    Parameters:
+    - source (str, DataFrame or ContourTable): Analyzed contour table (needs frame and tank).
+    - chunksize (int, optional): Rows read per chunk (default: from the loader's memory budget).
+
+    Returns:
+    - tuple: (first_frame, counts), where counts[code, f - first_frame] is the number of contours
+      with TANK_LABELS code `code` in frame f.
+    """
+    first, last = None, None
+    counts = np.zeros((len(TANK_LABELS), 0), dtype=np.int32)
+    for chunk in iter_contours(source, columns=['frame', 'tank'], chunksize=chunksize):
+        frames = chunk['frame'].to_numpy(dtype=np.int64)
+        codes = tank_codes(chunk['tank'])
+        keep = codes >= 0
+        frames, codes = frames[keep], codes[keep]
+        if not len(frames):
+            continue
+        low, high = int(frames.min()), int(frames.max())
+        if first is None:
+            first, last = low, high
+        if low < first:
+            counts = np.concatenate([np.zeros((len(TANK_LABELS), first - low), dtype=np.int32), counts], axis=1)
+            first = low
+        last = max(last, high)
+        if last - first + 1 > counts.shape[1]:
+            grown = np.zeros((len(TANK_LABELS), max(last - first + 1, 2 * counts.shape[1])), dtype=np.int32)
+            grown[:, :counts.shape[1]] = counts
+            counts = grown
+        span = high - low + 1
+        for code in np.unique(codes):
+            counts[code, low - first:high - first + 1] += np.bincount(frames[codes == code] - low, minlength=span)
+    if first is None:
+        return 0, counts
+    return first, counts[:, :last - first + 1]
+
+
+def tank_averages(counts):
+    """
+    Averages the two cameras of each tank and summarises the three tanks per frame.
+
+    Parameters:
+    - counts (ndarray): (tank x frame) counts from frame_counts.
+
+    Returns:
+    - tuple: (overall_avg, sem), the mean of the three tank averages per frame and its
+      standard error across tanks (sample SD / sqrt(3)).
+    """
+    # The overall average is the total count of the six tank halves over 6, rounded once
+    overall_avg = _total(counts) / 6
+    variance = np.zeros(counts.shape[1])
+    for left, right in TANK_PAIRS:
+        variance += ((counts[left] + counts[right]) / 2 - overall_avg) ** 2
+    return overall_avg, np.sqrt(variance / 2) / np.sqrt(3)
+
+
+def _total(counts):
+    # Contours of the six tank halves per frame
+    total = np.zeros(counts.shape[1], dtype=np.int64)
+    for left, right in TANK_PAIRS:
+        total += counts[left]
+        total += counts[right]
+    return total
+
+
+def window_sums(values, window, pad=False):
+    """
+    Sums every trailing window of a series in O(n) from a cumulative sum.
+
+    Integer series are summed exactly in int64; float series are centred on their
+    mean first, so the cumulative sum stays small and the differences accurate
+    over long nights.
+
+    Parameters:
+    - values (ndarray): The series.
+    - window (int): Window length.
+    - pad (bool, optional): Treat the series as preceded by window - 1 zeros, so every window
+      holds `window` values; otherwise early windows hold the values available (default: False).
+
+    Returns:
+    - tuple: (sums, counts), the sum and number of values of the window ending at each position.
+    """
+    values = np.asarray(values)
+    available = np.minimum(np.arange(1, len(values) + 1), window)
+    exact = np.issubdtype(values.dtype, np.integer) or values.dtype == bool
+    centre = 0 if exact or not len(values) else float(np.mean(values))
+    sums = np.cumsum(values, dtype=np.int64) if exact else np.cumsum(values - centre)
+    # Windows that start after the first value subtract the cumulative sum just before them
+    sums[window:] -= sums[:-window].copy()
+    if centre:
+        sums += available * centre
+    return sums, (np.full(len(values), window) if pad else available)
+
+
+def rolling_mean(values, window, pad=False):
+    """Trailing moving average, like pandas rolling(window, min_periods=1).mean() (see window_sums for pad)."""
+    sums, counts = window_sums(values, window, pad)
+    return sums / counts
+
+
+def rolling_std(values, window, pad=False, ddof=1):
+    """
+    Trailing moving standard deviation from cumulative sums of the values and their squares.
+
+    Both sums are taken of deviations from the series mean (see window_sums), which
+    keeps them accurate over long nights. Windows with no more than ddof values are
+    NaN, as in pandas.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    centre = values.mean() if len(values) else 0.0
+    centred = values - centre
+    sums, available = window_sums(centred, window)
+    squares, _ = window_sums(centred ** 2, window)
+    counts = available
+    if pad:
+        # Padding zeros lie at -centre from the mean
+        missing = window - available
+        sums = sums - missing * centre
+        squares = squares + missing * centre ** 2
+        counts = np.full(len(values), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (squares - sums ** 2 / counts) / (counts - ddof)
+    if not pad and len(values):
+        # Windows of identical values have exactly zero variance (counted exactly, without rounding)
+        changed = np.concatenate([[False], values[1:] != values[:-1]])
+        changes, _ = window_sums(changed, window)
+        first = np.maximum(np.arange(len(values)) - window + 1, 0)
+        variance[changes - changed[first] == 0] = 0.0
+    return np.where(counts > ddof, np.sqrt(np.maximum(variance, 0)), np.nan)
+
+
+def rolling_stats(values, windows, pad=False):
+    """
+    Computes the moving mean, SD and SEM of a series for several window sizes.
+
+    Parameters:
+    - values (ndarray): The series.
+    - windows (int or list): Window lengths.
+    - pad (bool, optional): Zero-pad the start of the series (see window_sums; default: False).
+
+    Returns:
+    - DataFrame: Columns mean_w{w}, sd_w{w} and sem_w{w} for every window w.
+    """
+    windows = [windows] if np.isscalar(windows) else list(windows)
+    result = {}
+    for window in windows:
+        counts = np.full(len(values), window) if pad else np.minimum(np.arange(1, len(values) + 1), window)
+        result[f'mean_w{window}'] = rolling_mean(values, window, pad)
+        result[f'sd_w{window}'] = rolling_std(values, window, pad)
+        result[f'sem_w{window}'] = result[f'sd_w{window}'] / np.sqrt(counts)
+    return pd.DataFrame(result)
+
+
+def smooth_counts(source, windows, pad=False, chunksize=None, stats=('avg', 'sem', 'sd')):
+    """
+    Streams a contour table into smoothed per-frame contour averages.
+
+    Contours are counted per frame and tank (frame_counts), missing frames count as
+    zero, and the average of the three tanks and its SEM across tanks are smoothed
+    with every requested window. The table itself is never held in memory.
+
+    Parameters:
+    - source (str, DataFrame or ContourTable): Analyzed contour table (needs frame and tank).
+    - windows (int or list): Smoothing window lengths in frames.
+    - pad (bool, optional): Zero-pad the start of the night (default: False).
+    - chunksize (int, optional): Rows read per chunk (default: from the loader's memory budget).
+    - stats (tuple, optional): Smoothed statistics to compute, among 'avg', 'sem' and 'sd' (default: all).
+
+    Returns:
+    - DataFrame: Indexed by frame, with overall_avg (and its SEM across tanks, sem, when 'sem' is
+      requested) per frame, and for every window w: avg_w{w} and sem_w{w} (moving averages of
+      overall_avg and sem) and sd_w{w} (moving SD of overall_avg).
+    """
+    first, counts = frame_counts(source, chunksize=chunksize)
+    # overall_avg is the integer count of the six tank halves over 6, so its windows are summed exactly
+    total = _total(counts)
+    if 'sem' in stats:
+        overall_avg, sem = tank_averages(counts)
+    else:
+        overall_avg, sem = total / 6, None
+    del counts
+    windows = [windows] if np.isscalar(windows) else list(windows)
+    result = pd.DataFrame({'overall_avg': overall_avg}, index=pd.RangeIndex(first, first + len(total), name='frame'))
+    if sem is not None:
+        result['sem'] = sem
+    for window in windows:
+        if 'avg' in stats:
+            sums, n = window_sums(total, window, pad)
+            result[f'avg_w{window}'] = sums / (6 * n)
+        if 'sem' in stats:
+            result[f'sem_w{window}'] = rolling_mean(sem, window, pad)
+        if 'sd' in stats:
+            result[f'sd_w{window}'] = rolling_std(overall_avg, window, pad)
+    return result
@@ -2,88 +2,159 @@
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba
 import numpy as np
-from sklearn.cluster import KMeans
+from .loader import read_contours
+from .table_io import write_table
+from .rolling import smooth_counts
+from .classify1d import split_two, assign_classes
+from .hmm_activity import segment_activity
 
-def smooth_contours(input_file, outfile_suffix=None, window=10, pad=False, date=None):
+def active_spans(frames, active):
     """
-    Plots the overall average number of contours per frame with clustering for active and inactive periods
-    and saves the smoothed data to an output file.
+    Collapses per-frame activity flags into run-length spans.
+
+    A span ends where activity stops or the frame numbers skip, so each span covers
+    consecutive active frames only.
 
     Parameters:
-    - input_file (str): Path to the CSV file.
-    - outfile_suffix (str, optional): Suffix for the output files (usually ending in .tsv).
-    - window (int, optional): Window size for smoothing (default: 10 frames).
-    - pad (bool, optional): Whether to pad early frames with zeros to avoid edge effects (default: False).
-    - date (str, optional): Date to be added as a column in the output file.
+    - frames (array-like): Frame numbers, in increasing order.
+    - active (array-like): Activity flag (or 0/1 label) of each frame.
+
+    Returns:
+    - tuple: (starts, ends), the first and last frame of every run of active frames.
+    """
+    frames = np.asarray(frames)
+    active = np.asarray(active).astype(bool)
+    if not len(frames):
+        return frames[:0], frames[:0]
+    # An active frame continues a run if the previous frame is active and directly precedes it
+    continues = np.zeros(len(frames) + 1, dtype=bool)
+    continues[1:-1] = active[:-1] & active[1:] & (np.diff(frames) == 1)
+    starts = np.flatnonzero(active & ~continues[:-1])
+    ends = np.flatnonzero(active & ~continues[1:])
+    return frames[starts], frames[ends]
+
+def activity_bouts(frames, active):
     """
-    # Read the CSV file
-    df = pd.read_csv(input_file, delimiter='\t')
+    Run-length encodes per-frame activity into bouts.
 
-    # Calculate the number of contours per frame for each tank
-    df['contour_count'] = df.groupby(['frame', 'tank'])['tank'].transform('count')
+    Parameters:
+    - frames (array-like): Frame numbers, in increasing order.
+    - active (array-like): Activity flag (or 0/1 label) of each frame.
 
-    # Create a DataFrame with the number of contours per frame for each tank
-    contour_counts = df.groupby(['frame', 'tank']).size().unstack(fill_value=0)
+    Returns:
+    - DataFrame: One row per bout of consecutive active frames, with its start and end frame and its length in frames.
+    """
+    starts, ends = active_spans(frames, active)
+    return pd.DataFrame({'start': starts, 'end': ends, 'frames': ends - starts + 1})
 
-    # Fill missing frames with zero contours
-    contour_counts = contour_counts.reindex(range(contour_counts.index.min(), contour_counts.index.max() + 1), fill_value=0)
+def activity_labels(smoothed, window, hmm=None):
+    """
+    Labels every frame inactive (0) or active (1).
 
-    # Calculate the average number of contours for each pair of tanks
-    contour_counts['tank1_avg'] = contour_counts[['left_tank1', 'right_tank1']].mean(axis=1)
-    contour_counts['tank2_avg'] = contour_counts[['left_tank2', 'right_tank2']].mean(axis=1)
-    contour_counts['tank3_avg'] = contour_counts[['left_tank3', 'right_tank3']].mean(axis=1)
+    By default the smoothed averages are split into the two classes 2-means would
+    find (split_two). With hmm, a two-state hidden Markov model is fitted to the
+    unsmoothed per-frame contour counts and decoded with Viterbi, which keeps short
+    dips and peaks from flickering the labels around transitions; bouts are expected
+    to last at least one smoothing window.
 
-    # Calculate the overall average across all three tanks
-    contour_counts['overall_avg'] = contour_counts[['tank1_avg', 'tank2_avg', 'tank3_avg']].mean(axis=1)
+    Parameters:
+    - smoothed (DataFrame): Output of smooth_counts, with overall_avg and avg_w{window}.
+    - window (int): Smoothing window.
+    - hmm (str, optional): HMM emissions, 'poisson' or 'gaussian' (default: None, no HMM).
 
-    # Apply zero padding to handle edge effects
-    if pad:
-        # Pad the beginning of the data with zeros
-        padding = pd.DataFrame(0, index=range(-window + 1, 0), columns=['overall_avg'])
-        padded_data = pd.concat([padding, contour_counts[['overall_avg']]])
-        # Apply smoothing using a running average
-        smoothed_counts = padded_data.rolling(window=window, min_periods=window).mean()
-    else:
-        # Apply smoothing using a running average without padding
-        smoothed_counts = contour_counts[['overall_avg']].rolling(window=window, min_periods=1).mean()
+    Returns:
+    - ndarray: Activity label of every frame.
+    """
+    if hmm is not None:
+        # overall_avg is the count of the six tank halves over 6
+        counts = np.rint(smoothed['overall_avg'].to_numpy() * 6)
+        return segment_activity(counts, emission=hmm, min_bout=window)[0]
+    averages = smoothed[f'avg_w{window}'].to_numpy()
+    return assign_classes(averages, split_two(averages))
+
+def shade_active(frames, active, alpha=0.5, **kwargs):
+    """
+    Shades the active periods of a plot with one collection of spans, one per run of active frames.
 
-    # Prepare the data for K-means clustering
-    combined_data = smoothed_counts['overall_avg'].values.reshape(-1, 1)
+    Each active frame used to get its own axvspan (lightgray, with an edge of the
+    same colour), and the half-transparent spans of the frames sharing a pixel column
+    stacked up. A run gets the alpha compounded over its frames per pixel (or over
+    all its frames when it is narrower than a pixel), so the shading looks as before
+    with a single artist.
 
-    # Remove any NaN values before clustering
-    combined_data = combined_data[~np.isnan(combined_data).any(axis=1)]
+    Returns:
+    - PolyCollection: The spans.
+    """
+    ax = plt.gca()
+    frames = np.asarray(frames)
+    starts, ends = active_spans(frames, active)
+    stacked = np.ones(len(starts))
+    if len(frames):
+        # Frames per pixel column, over the frame range with the default x margins
+        width = max(ax.get_window_extent().width, 1)
+        margin = 1 + 2 * plt.rcParams['axes.xmargin']
+        stacked = np.minimum(ends - starts + 1, max((frames.max() - frames.min() + 1) * margin / width, 1))
+    colors = np.tile(to_rgba('lightgray'), (len(starts), 1))
+    colors[:, 3] = 1 - (1 - alpha) ** stacked
+    spans = PolyCollection([[(start - 0.5, 0), (start - 0.5, 1), (end + 0.5, 1), (end + 0.5, 0)]
+                            for start, end in zip(starts, ends)],
+                           facecolors=colors, edgecolors=colors, transform=ax.get_xaxis_transform(), **kwargs)
+    ax.add_collection(spans, autolim=False)
+    # The spans reach half a frame beyond the frames they cover, as the axvspans did
+    if len(starts):
+        ax.update_datalim([(starts.min() - 0.5, 0), (ends.max() + 0.5, 0)], updatey=False)
+        ax.autoscale_view()
+    return spans
+
+def smooth_contours(input_file, outfile_suffix=None, window=10, pad=False, date=None, hmm=None):
+    """
+    Plots the overall average number of contours per frame with clustering for active and inactive periods
+    and saves the smoothed data to an output file.
 
-    # Apply K-means clustering to classify frames into "active" and "inactive"
-    kmeans = KMeans(n_clusters=2, random_state=0, n_init=10).fit(combined_data)
-    labels = kmeans.labels_
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Path to the CSV file, or an in-memory table.
+    - outfile_suffix (str, optional): Suffix for the output files (usually ending in .tsv; .tsv.gz or .tsv.zst compresses the output).
+    - window (int, optional): Window size for smoothing (default: 10 frames).
+    - pad (bool, optional): Whether to pad early frames with zeros to avoid edge effects (default: False).
+    - date (str, optional): Date to be added as a column in the output file.
+    - hmm (str, optional): Segment activity with a two-state HMM on the per-frame contour counts, with
+      'poisson' or 'gaussian' emissions, instead of splitting the smoothed averages (default: None).
 
-    # Determine which cluster represents "active" (higher average contour count)
-    active_cluster = np.argmax(kmeans.cluster_centers_)
+    Returns:
+    - DataFrame: The activity bouts (see activity_bouts), with frames numbered as in the output file.
+    """
+    # Count contours per frame and tank in one pass and smooth the overall average with cumulative sums
+    smoothed = smooth_counts(input_file, [window], pad=pad, stats=('avg',))
+    labels = activity_labels(smoothed, window, hmm)
+    smoothed_counts = pd.DataFrame({'overall_avg': smoothed[f'avg_w{window}'].to_numpy()},
+                                   index=smoothed.index.to_numpy())
 
-    # Map the labels back to the smoothed data
-    smoothed_counts = smoothed_counts.dropna()  # Drop rows with NaN values after smoothing
+    # Frames are "inactive" (0) or "active" (1, higher average contour count)
     smoothed_counts['cluster'] = labels
-    smoothed_counts['active'] = (labels == active_cluster).astype(int)
+    smoothed_counts['active'] = labels
+    smoothed_counts = smoothed_counts.dropna()  # Drop rows with NaN values after smoothing
 
     # Create an output DataFrame with the required columns
     output_df = pd.DataFrame({
         'frame': smoothed_counts.index + 1,  # Frame numbers starting at 1
         'average_contours': smoothed_counts['overall_avg'],
-        'cluster': smoothed_counts['cluster'],  # KMeans cluster label
+        'cluster': smoothed_counts['cluster'],  # Activity class (1 = active)
         'date': date
     })
 
     # Determine the output file names based on outfile_suffix
-    if outfile_suffix and outfile_suffix.endswith('.tsv'):
+    if outfile_suffix and outfile_suffix.endswith(('.tsv', '.tsv.gz', '.tsv.zst')):
         output_file_name = f"smooth_{outfile_suffix}"
-        plot_file_name = f"{outfile_suffix[:-4]}.png"
+        plot_file_name = f"{outfile_suffix.rsplit('.tsv', 1)[0]}.png"
     else:
         output_file_name = f"smooth_{outfile_suffix}.tsv" if outfile_suffix else "smooth_output.tsv"
         plot_file_name = f"{outfile_suffix}.png" if outfile_suffix else "output.png"
 
     # Save the smoothed data to a TSV file
-    output_df.to_csv(output_file_name, index=False, sep='\t')
+    write_table(output_df, output_file_name)
     print(f"Smoothed data saved to {output_file_name}")
 
     # Convert indices and data to numpy arrays for plotting
@@ -99,9 +170,7 @@ def smooth_contours(input_file, outfile_suffix=None, window=10, pad=False, date=
     plt.plot(frames, overall_avg, color='blue', alpha=0.7)
 
     # Shade the active periods
-    for i in range(len(frames)):
-        if smoothed_counts['active'].iloc[i] == 1:  # Active frames
-            plt.axvspan(frames[i] - 0.5, frames[i] + 0.5, color='lightgray', alpha=0.5)
+    shade_active(frames, smoothed_counts['active'])
 
     # Customize the plot
     plt.title("Overall Average Number of Contours per Frame (Smoothed)")
@@ -114,97 +183,57 @@ def smooth_contours(input_file, outfile_suffix=None, window=10, pad=False, date=
     plt.savefig(plot_file_name, bbox_inches='tight')
     print(f"Plot saved to {plot_file_name}")
 
-def smooth_contours_sem(input_file, outfile_suffix=None, window=10, pad=False, date=None):
+    return activity_bouts(output_df['frame'].to_numpy(), smoothed_counts['active'].to_numpy())
+
+def smooth_contours_sem(input_file, outfile_suffix=None, window=10, pad=False, date=None, hmm=None):
     """
     Plots the overall average number of contours per frame with clustering for active and inactive periods
     and saves the smoothed data to an output file.
 
     Parameters:
-    - input_file (str): Path to the CSV file.
-    - outfile_suffix (str, optional): Suffix for the output files (usually ending in .tsv).
+    - input_file (str, DataFrame or ContourTable): Path to the CSV file, or an in-memory table.
+    - outfile_suffix (str, optional): Suffix for the output files (usually ending in .tsv; .tsv.gz or .tsv.zst compresses the output).
     - window (int, optional): Window size for smoothing (default: 10 frames).
     - pad (bool, optional): Whether to pad early frames with zeros to avoid edge effects (default: False).
     - date (str, optional): Date to be added as a column in the output file.
-    """
-    # Read the CSV file
-    df = pd.read_csv(input_file, delimiter='\t')
-
-    # Calculate the number of contours per frame for each tank
-    df['contour_count'] = df.groupby(['frame', 'tank'])['tank'].transform('count')
-
-    # Create a DataFrame with the number of contours per frame for each tank
-    contour_counts = df.groupby(['frame', 'tank']).size().unstack(fill_value=0)
-
-    # Fill missing frames with zero contours
-    contour_counts = contour_counts.reindex(range(contour_counts.index.min(), contour_counts.index.max() + 1), fill_value=0)
-
-    # Calculate the average number of contours for each pair of tanks
-    contour_counts['tank1_avg'] = contour_counts[['left_tank1', 'right_tank1']].mean(axis=1)
-    contour_counts['tank2_avg'] = contour_counts[['left_tank2', 'right_tank2']].mean(axis=1)
-    contour_counts['tank3_avg'] = contour_counts[['left_tank3', 'right_tank3']].mean(axis=1)
-
-    # Calculate the overall average across all three tanks
-    contour_counts['overall_avg'] = contour_counts[['tank1_avg', 'tank2_avg', 'tank3_avg']].mean(axis=1)
-
-    # **Calculate the Standard Deviation (SD) and Standard Error of the Mean (SEM)**
-    contour_counts['std_dev'] = contour_counts[['tank1_avg', 'tank2_avg', 'tank3_avg']].std(axis=1)
-    contour_counts['sem'] = contour_counts['std_dev'] / np.sqrt(3)  # Since n=3 tanks
-
-    # Apply zero padding to handle edge effects
-    if pad:
-        # Pad the beginning of the data with zeros for both mean and SEM
-        padding_avg = pd.DataFrame(0, index=range(-window + 1, 0), columns=['overall_avg'])
-        padding_sem = pd.DataFrame(0, index=range(-window + 1, 0), columns=['sem'])
-        padded_avg = pd.concat([padding_avg, contour_counts[['overall_avg']]])
-        padded_sem = pd.concat([padding_sem, contour_counts[['sem']]])
-        # Apply smoothing using a running average
-        smoothed_avg = padded_avg.rolling(window=window, min_periods=window).mean()
-        smoothed_sem = padded_sem.rolling(window=window, min_periods=window).mean()
-    else:
-        # Apply smoothing using a running average without padding
-        smoothed_avg = contour_counts[['overall_avg']].rolling(window=window, min_periods=1).mean()
-        smoothed_sem = contour_counts[['sem']].rolling(window=window, min_periods=1).mean()
+    - hmm (str, optional): Segment activity with a two-state HMM on the per-frame contour counts, with
+      'poisson' or 'gaussian' emissions, instead of splitting the smoothed averages (default: None).
 
-    # Combine smoothed mean and SEM into one DataFrame
-    smoothed_counts = pd.concat([smoothed_avg, smoothed_sem], axis=1)
-
-    # Prepare the data for K-means clustering
-    combined_data = smoothed_counts['overall_avg'].values.reshape(-1, 1)
-
-    # Remove any NaN values before clustering
-    combined_data = combined_data[~np.isnan(combined_data).any(axis=1)]
-
-    # Apply K-means clustering to classify frames into "active" and "inactive"
-    kmeans = KMeans(n_clusters=2, random_state=0, n_init=10).fit(combined_data)
-    labels = kmeans.labels_
-
-    # Determine which cluster represents "active" (higher average contour count)
-    active_cluster = np.argmax(kmeans.cluster_centers_)
-
-    # Map the labels back to the smoothed data
-    smoothed_counts = smoothed_counts.dropna()  # Drop rows with NaN values after smoothing
+    Returns:
+    - DataFrame: The activity bouts (see activity_bouts), with frames numbered as in the output file.
+    """
+    # Count contours per frame and tank in one pass; smooth the overall average and its SEM across
+    # tanks with cumulative sums
+    smoothed = smooth_counts(input_file, [window], pad=pad, stats=('avg', 'sem'))
+    labels = activity_labels(smoothed, window, hmm)
+    smoothed_counts = pd.DataFrame({'overall_avg': smoothed[f'avg_w{window}'].to_numpy(),
+                                    'sem': smoothed[f'sem_w{window}'].to_numpy()},
+                                   index=smoothed.index.to_numpy())
+
+    # Frames are "inactive" (0) or "active" (1, higher average contour count)
     smoothed_counts['cluster'] = labels
-    smoothed_counts['active'] = (labels == active_cluster).astype(int)
+    smoothed_counts['active'] = labels
+    smoothed_counts = smoothed_counts.dropna()  # Drop rows with NaN values after smoothing
 
     # Create an output DataFrame with the required columns
     output_df = pd.DataFrame({
         'frame': smoothed_counts.index + 1,  # Frame numbers starting at 1
         'average_contours': smoothed_counts['overall_avg'],
         'sem': smoothed_counts['sem'],
-        'cluster': smoothed_counts['cluster'],  # KMeans cluster label
+        'cluster': smoothed_counts['cluster'],  # Activity class (1 = active)
         'date': date
     })
 
     # Determine the output file names based on outfile_suffix
-    if outfile_suffix and outfile_suffix.endswith('.tsv'):
+    if outfile_suffix and outfile_suffix.endswith(('.tsv', '.tsv.gz', '.tsv.zst')):
         output_file_name = f"smooth_{outfile_suffix}"
-        plot_file_name = f"{outfile_suffix[:-4]}.png"
+        plot_file_name = f"{outfile_suffix.rsplit('.tsv', 1)[0]}.png"
     else:
         output_file_name = f"smooth_{outfile_suffix}.tsv" if outfile_suffix else "smooth_output.tsv"
         plot_file_name = f"{outfile_suffix}.png" if outfile_suffix else "output.png"
 
     # Save the smoothed data to a TSV file
-    output_df.to_csv(output_file_name, index=False, sep='\t')
+    write_table(output_df, output_file_name)
     print(f"Smoothed data saved to {output_file_name}")
 
     # Convert indices and data to numpy arrays for plotting
@@ -230,10 +259,7 @@ def smooth_contours_sem(input_file, outfile_suffix=None, window=10, pad=False, d
     plt.figure(figsize=(12, 6))
 
     # **Plot the gray shading first (active periods)**
-    for i in range(len(frames)):
-        if smoothed_counts['active'].iloc[i] == 1:  # Active frames
-            plt.axvspan(frames[i] - 0.5, frames[i] + 0.5,
-                        color='lightgray', alpha=0.5, zorder=1)  # Lower zorder
+    shade_active(frames, smoothed_counts['active'], zorder=1)  # Lower zorder
 
     # **Plot the shaded SEM region next**
     plt.fill_between(frames, lower_bound, upper_bound,
@@ -255,3 +281,5 @@ def smooth_contours_sem(input_file, outfile_suffix=None, window=10, pad=False, d
     plt.savefig(plot_file_name, bbox_inches='tight')
     print(f"Plot saved to {plot_file_name}")
 
+    return activity_bouts(output_df['frame'].to_numpy(), smoothed_counts['active'].to_numpy())
+
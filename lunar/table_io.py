@@ -0,0 +1,143 @@
+# lunar/table_io.py
+
+import gzip
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for .zst files
+    zstandard = None
+
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Rough text-to-compressed size ratio, used to size memory budgets for compressed tables
+COMPRESSION_RATIO_ESTIMATE = 6
+
+
+def compression_of(path):
+    """
+    Returns the compression implied by a file name.
+
+    Parameters:
+    - path (str): Path of the table, e.g. 'contours_22Jul2024.tab.zst'.
+
+    Returns:
+    - str or None: 'gzip' for .gz, 'zstd' for .zst, None for plain text.
+    """
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(str(path))[1])
+
+
+def text_size(path):
+    """Estimates the uncompressed size of a table in bytes."""
+    size = os.path.getsize(path)
+    return size * COMPRESSION_RATIO_ESTIMATE if compression_of(path) else size
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("Reading or writing .zst tables requires the 'zstandard' package "
+                          "(conda install zstandard)")
+
+
+class _ParallelGzipWriter(io.RawIOBase):
+    """
+    Binary writer that gzips fixed-size blocks on a thread pool and writes them in order.
+
+    Each block becomes its own gzip member; concatenated members form a valid gzip
+    file that gzip, zcat and pandas read as one stream. zlib releases the GIL while
+    compressing, so the blocks compress in parallel.
+    """
+
+    def __init__(self, path, level=6, threads=None, block_size=1 << 22):
+        super().__init__()
+        self.file = open(path, 'wb')
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.pool.submit(gzip.compress, block, self.level))
+        # Bound the number of blocks held in memory
+        while len(self.pending) > 2 * self.threads:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if not self.closed:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            self.pool.shutdown()
+            self.file.close()
+        super().close()
+
+
+def open_table(path, mode='r', threads=None, level=None):
+    """
+    Opens a table for streaming text I/O, compressing or decompressing by file suffix.
+
+    Plain files are opened directly. '.gz' files are read with streaming gzip
+    decompression and written as parallel gzip members; '.zst' files use zstandard
+    streaming decompression and multithreaded zstd compression.
+
+    Parameters:
+    - path (str): Path of the table.
+    - mode (str, optional): 'r' to read or 'w' to write (default: 'r').
+    - threads (int, optional): Compression threads when writing (default: all cores).
+    - level (int, optional): Compression level (default: 6 for gzip, 3 for zstd).
+
+    Returns:
+    - file: A text-mode file object.
+    """
+    compression = compression_of(path)
+    if mode not in ('r', 'w'):
+        raise ValueError("mode must be 'r' or 'w'")
+
+    if compression is None:
+        return open(path, mode)
+
+    if compression == 'gzip':
+        if mode == 'r':
+            return gzip.open(path, 'rt')
+        raw = _ParallelGzipWriter(path, level=6 if level is None else level, threads=threads)
+        return io.TextIOWrapper(io.BufferedWriter(raw), encoding='utf-8')
+
+    _require_zstandard()
+    if mode == 'r':
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                          threads=-1 if threads is None else threads)
+    writer = compressor.stream_writer(open(path, 'wb'), closefd=True)
+    return io.TextIOWrapper(writer, encoding='utf-8')
+
+
+def write_table(df, path, threads=None, level=None):
+    """
+    Writes a DataFrame as a tab-delimited table, compressed according to the file suffix.
+
+    Parameters:
+    - df (DataFrame): The data to write.
+    - path (str): Output path; '.gz' and '.zst' suffixes are compressed.
+    - threads (int, optional): Compression threads (default: all cores).
+    - level (int, optional): Compression level (default: codec default).
+    """
+    with open_table(path, 'w', threads=threads, level=level) as output:
+        df.to_csv(output, sep='\t', index=False)
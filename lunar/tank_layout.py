@@ -0,0 +1,209 @@
+# lunar/tank_layout.py
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from matplotlib.path import Path
+from .loader import CAMERA_LABELS, TANK_LABELS
+
+RASTER_SUFFIX = '.raster.npz'
+NO_CAMERA = 255
+
+
+class TankLayout:
+    """
+    Tank and camera regions given as polygons, rasterised into pixel lookup images.
+
+    A layout file is JSON in contour coordinates (cX, and cY measured from the bottom
+    of the frame as written by find_contours):
+
+        {"width": 4000, "height": 1100,
+         "tanks": {"left_tank1": [[185, 0], [655, 0], [650, 1100], [190, 1100]], ...},
+         "cameras": {"left": [[0, 0], [2001, 0], [2001, 1100], [0, 1100]], ...}}
+
+    Tank names must be labels from lunar.loader.TANK_LABELS; "cameras" is optional
+    (without it, contours left of camera_split belong to the left camera). The
+    polygons are rasterised once into uint8 images of tank and camera codes, so
+    labeling a contour is a single lookup labels[cY, cX]. cXtank is measured from the
+    leftmost vertex of the contour's tank polygon, unless an optional "offsets"
+    mapping gives the x to subtract per tank.
+
+    Parameters:
+    - layout (dict): The parsed layout.
+    - camera_split (float, optional): Camera split used when the layout has no camera polygons (default: 2001).
+    """
+
+    def __init__(self, layout, camera_split=2001):
+        self.layout = layout
+        self.camera_split = camera_split
+        unknown = set(layout['tanks']) - set(TANK_LABELS)
+        if unknown:
+            raise ValueError(f"Unknown tank labels in layout: {sorted(unknown)}")
+        points = np.concatenate([np.asarray(p, dtype=np.float64) for p in layout['tanks'].values()] +
+                                [np.asarray(p, dtype=np.float64) for p in layout.get('cameras', {}).values()])
+        self.width = int(layout.get('width', np.ceil(points[:, 0].max()) + 1))
+        self.height = int(layout.get('height', np.ceil(points[:, 1].max()) + 1))
+
+        # Boundary subtracted for cXtank, per tank code (NaN for noise)
+        self.offsets = np.full(len(TANK_LABELS), np.nan)
+        for tank, polygon in layout['tanks'].items():
+            self.offsets[TANK_LABELS.index(tank)] = np.asarray(polygon, dtype=np.float64)[:, 0].min()
+        for tank, offset in layout.get('offsets', {}).items():
+            self.offsets[TANK_LABELS.index(tank)] = offset
+
+        self.tanks = None
+        self.cameras = None
+
+    def __repr__(self):
+        return f"TankLayout({self.width}x{self.height}, tanks={list(self.layout['tanks'])})"
+
+    @classmethod
+    def load(cls, path, camera_split=2001):
+        """
+        Loads a layout file and its raster, rasterising (and caching) it if needed.
+
+        The raster is cached next to the layout as '<layout>.raster.npz' and rebuilt
+        whenever the layout file changes.
+
+        Parameters:
+        - path (str): Path of the JSON layout file.
+        - camera_split (float, optional): Camera split used when the layout has no camera polygons (default: 2001).
+
+        Returns:
+        - TankLayout: The layout with its rasters.
+        """
+        with open(path) as f:
+            text = f.read()
+        layout = cls(json.loads(text), camera_split=camera_split)
+
+        cache = str(path) + RASTER_SUFFIX
+        if os.path.exists(cache):
+            with np.load(cache, allow_pickle=False) as stored:
+                if str(stored['layout']) == text and float(stored['camera_split']) == camera_split:
+                    layout.tanks, layout.cameras = stored['tanks'], stored['cameras']
+                    return layout
+        layout.rasterise()
+        np.savez_compressed(cache, tanks=layout.tanks, cameras=layout.cameras, layout=text,
+                            camera_split=camera_split)
+        return layout
+
+    def _fill(self, raster, polygon, code):
+        # Set the pixels whose coordinates lie inside the polygon (only its bounding box is tested)
+        polygon = np.asarray(polygon, dtype=np.float64)
+        x0, y0 = np.maximum(np.floor(polygon.min(axis=0)).astype(int), 0)
+        x1 = min(int(np.ceil(polygon[:, 0].max())) + 1, self.width)
+        y1 = min(int(np.ceil(polygon[:, 1].max())) + 1, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        ys, xs = np.mgrid[y0:y1, x0:x1]
+        inside = Path(polygon).contains_points(np.column_stack([xs.ravel(), ys.ravel()]))
+        raster[y0:y1, x0:x1][inside.reshape(ys.shape)] = code
+
+    def rasterise(self):
+        """Builds the uint8 tank and camera rasters (indexed [cY, cX]) from the polygons."""
+        self.tanks = np.zeros((self.height, self.width), dtype=np.uint8)
+        for tank, polygon in self.layout['tanks'].items():
+            self._fill(self.tanks, polygon, TANK_LABELS.index(tank))
+
+        self.cameras = np.full((self.height, self.width), NO_CAMERA, dtype=np.uint8)
+        for camera, polygon in self.layout.get('cameras', {}).items():
+            self._fill(self.cameras, polygon, CAMERA_LABELS.index(camera))
+        # Pixels outside every camera polygon fall back to the camera split
+        split = np.where(np.arange(self.width) < self.camera_split,
+                         CAMERA_LABELS.index('left'), CAMERA_LABELS.index('right')).astype(np.uint8)
+        unassigned = self.cameras == NO_CAMERA
+        self.cameras[unassigned] = np.broadcast_to(split, self.cameras.shape)[unassigned]
+        return self
+
+    def _pixels(self, cX, cY):
+        x = np.floor(np.nan_to_num(np.asarray(cX, dtype=np.float64), nan=-1)).astype(np.int64)
+        y = np.floor(np.nan_to_num(np.asarray(cY, dtype=np.float64), nan=-1)).astype(np.int64)
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        return x, y, inside
+
+    def lookup(self, cX, cY):
+        """
+        Labels camera, tank and cXtank for many contours at once.
+
+        Parameters:
+        - cX (array-like): The x-coordinates of the contours.
+        - cY (array-like): The y-coordinates of the contours (flipped, as written by find_contours).
+
+        Returns:
+        - tuple: (camera, tank, cXtank) like label_tanks; contours outside the raster are noise,
+          with their camera from the camera split.
+        """
+        if self.tanks is None:
+            self.rasterise()
+        cX = np.asarray(cX)
+        x, y, inside = self._pixels(cX, cY)
+        tank = np.zeros(len(x), dtype=np.int8)
+        tank[inside] = self.tanks[y[inside], x[inside]]
+        camera = np.where(cX < self.camera_split, CAMERA_LABELS.index('left'),
+                          CAMERA_LABELS.index('right')).astype(np.int8)
+        camera[inside] = self.cameras[y[inside], x[inside]]
+        cXtank = cX - self.offsets[tank]
+        return (pd.Categorical.from_codes(camera, categories=CAMERA_LABELS),
+                pd.Categorical.from_codes(tank, categories=TANK_LABELS),
+                cXtank)
+
+    def tank_at(self, cX, cY):
+        """Returns the tank label of a single contour (used by the extractor at write time)."""
+        if self.tanks is None:
+            self.rasterise()
+        x, y = int(np.floor(cX)), int(np.floor(cY))
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TANK_LABELS[self.tanks[y, x]]
+        return 'noise'
+
+
+def load_layout(layout, camera_split=2001):
+    """Returns a TankLayout for a layout path, dict or TankLayout."""
+    if isinstance(layout, TankLayout):
+        return layout
+    if isinstance(layout, dict):
+        return TankLayout(layout, camera_split=camera_split).rasterise()
+    return TankLayout.load(layout, camera_split=camera_split)
+
+
+def layout_from_boundaries(boundaries, height, camera_split=2001):
+    """
+    Builds the layout equivalent to 8 vertical tank boundaries, as a starting point for editing.
+
+    Parameters:
+    - boundaries (list): List of 8 tank boundaries [t1, t2, t3, t4, t5, t6, t7, t8].
+    - height (int): Frame height in pixels.
+    - camera_split (float, optional): Split between the cameras (default: 2001).
+
+    Returns:
+    - dict: Layout with one rectangle per tank and per camera (covering integer pixels left <= x < right)
+      and the tank boundaries as cXtank offsets.
+    """
+    t = list(boundaries)
+    # right_tank3 includes its upper boundary, as in determine_tank
+    spans = {'left_tank1': (t[0], t[1]), 'left_tank2': (t[1], t[2]), 'left_tank3': (t[2], t[3]),
+             'right_tank1': (t[4], t[5]), 'right_tank2': (t[5], t[6]), 'right_tank3': (t[6], t[7] + 1)}
+
+    def rectangle(left, right):
+        # Integer pixels left <= x < right lie inside this polygon
+        return [[left - 0.5, -0.5], [right - 0.5, -0.5], [right - 0.5, height - 0.5], [left - 0.5, height - 0.5]]
+
+    width = int(np.ceil(max(t[7], camera_split))) + 1
+    return {'width': width, 'height': int(height),
+            'tanks': {tank: rectangle(*span) for tank, span in spans.items()},
+            'cameras': {'left': rectangle(0, camera_split), 'right': rectangle(camera_split, width)},
+            'offsets': {tank: span[0] for tank, span in spans.items()}}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rasterise a tank layout file and report its tank areas.")
+    parser.add_argument("layout", help="JSON layout file")
+    args = parser.parse_args()
+
+    layout = TankLayout.load(args.layout)
+    codes, counts = np.unique(layout.tanks, return_counts=True)
+    for code, count in zip(codes, counts):
+        print(f"{TANK_LABELS[code]}\t{count} px")
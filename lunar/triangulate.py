@@ -0,0 +1,197 @@
+# lunar/triangulate.py
+
+import json
+import numpy as np
+import pandas as pd
+from .loader import read_contours, table_columns, GLARE_LABELS
+from .table_io import write_table
+from .match_engine import tank_codes, TANK_NUMBER, TANK_SIDE
+
+DEFAULT_MAX_RESIDUAL = 5.0
+
+
+def load_calibration(calibration):
+    """
+    Loads a per-tank stereo calibration.
+
+    The calibration is JSON with one entry per tank ('tank1'..'tank3') in contour
+    coordinates (cX, and cY as written by find_contours), either as 3x4 camera
+    matrices or as 3x3 homographies onto a common plane:
+
+        {"tank1": {"P_left": [[...], [...], [...]], "P_right": [[...], [...], [...]]},
+         "tank2": {"H_left": [[...], [...], [...]], "H_right": [[...], [...], [...]]}, ...}
+
+    Parameters:
+    - calibration (str or dict): Path of the JSON file, or the parsed calibration.
+
+    Returns:
+    - dict: Tank number (1-3) mapped to its entry, with the matrices as arrays.
+    """
+    if not isinstance(calibration, dict):
+        with open(calibration) as f:
+            calibration = json.load(f)
+    tanks = {}
+    for name, entry in calibration.items():
+        number = int(name.replace('tank', ''))
+        if {'P_left', 'P_right'} <= set(entry):
+            shapes = (3, 4)
+            keys = ('P_left', 'P_right')
+        elif {'H_left', 'H_right'} <= set(entry):
+            shapes = (3, 3)
+            keys = ('H_left', 'H_right')
+        else:
+            raise ValueError(f"Calibration of {name} needs P_left/P_right or H_left/H_right")
+        tanks[number] = {key: np.asarray(entry[key], dtype=np.float64) for key in keys}
+        for key in keys:
+            if tanks[number][key].shape != shapes:
+                raise ValueError(f"{key} of {name} must be {shapes[0]}x{shapes[1]}")
+    return tanks
+
+
+def triangulate_points(P_left, P_right, left_xy, right_xy):
+    """
+    Triangulates many point pairs at once with the linear (DLT) method.
+
+    Each pair gives a 4x4 system whose rows are scaled to unit length; all systems
+    are solved in one batched SVD, and the reprojection error in both views is
+    returned as the residual.
+
+    Parameters:
+    - P_left (ndarray): 3x4 camera matrix of the left view.
+    - P_right (ndarray): 3x4 camera matrix of the right view.
+    - left_xy (ndarray): Left image points, shape (n, 2).
+    - right_xy (ndarray): Right image points, shape (n, 2).
+
+    Returns:
+    - tuple: (points, residual), the 3D points with shape (n, 3) and the RMS reprojection
+      error of each point in pixels.
+    """
+    left_xy = np.asarray(left_xy, dtype=np.float64).reshape(-1, 2)
+    right_xy = np.asarray(right_xy, dtype=np.float64).reshape(-1, 2)
+    if not len(left_xy):
+        return np.empty((0, 3)), np.empty(0)
+    A = np.stack([left_xy[:, :1] * P_left[2] - P_left[0],
+                  left_xy[:, 1:] * P_left[2] - P_left[1],
+                  right_xy[:, :1] * P_right[2] - P_right[0],
+                  right_xy[:, 1:] * P_right[2] - P_right[1]], axis=1)
+    A /= np.linalg.norm(A, axis=2, keepdims=True)
+    _, _, vt = np.linalg.svd(A)
+    homogeneous = vt[:, -1, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        points = homogeneous[:, :3] / homogeneous[:, 3:]
+    return points, _reprojection_error(points, (P_left, P_right), (left_xy, right_xy))
+
+
+def _apply(matrix, points):
+    # Projective map of row points through a 3xk matrix
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mapped = np.column_stack([points, np.ones(len(points))]) @ matrix.T
+        return mapped[:, :2] / mapped[:, 2:]
+
+
+def _reprojection_error(points, cameras, observed):
+    squared = [np.sum((_apply(P, points) - xy) ** 2, axis=1) for P, xy in zip(cameras, observed)]
+    return np.sqrt(np.mean(squared, axis=0))
+
+
+def map_points(H_left, H_right, left_xy, right_xy):
+    """
+    Maps point pairs onto a common plane with one homography per view.
+
+    Parameters:
+    - H_left (ndarray): 3x3 homography of the left view.
+    - H_right (ndarray): 3x3 homography of the right view.
+    - left_xy (ndarray): Left image points, shape (n, 2).
+    - right_xy (ndarray): Right image points, shape (n, 2).
+
+    Returns:
+    - tuple: (points, residual), the midpoints of the two mapped points with shape (n, 2)
+      and the distance between them, in plane units.
+    """
+    left = _apply(H_left, np.asarray(left_xy, dtype=np.float64).reshape(-1, 2))
+    right = _apply(H_right, np.asarray(right_xy, dtype=np.float64).reshape(-1, 2))
+    return (left + right) / 2, np.sqrt(np.sum((left - right) ** 2, axis=1))
+
+
+def triangulate_matches(input_file, calibration, output_file=None, max_residual=DEFAULT_MAX_RESIDUAL):
+    """
+    Adds 3D positions to the pairs of a matched table.
+
+    Pairs are rebuilt from 'pair_id' (written by match_cameras) and triangulated per
+    tank in one batch from their cX and cY. Both rows of a pair get the same X, Y, Z
+    and residual; with a homography calibration Z is left empty and X, Y are plane
+    coordinates. Pairs whose residual exceeds max_residual are flagged with
+    bad_match 'yes', which usually means the two contours are not the same flash.
+
+    Parameters:
+    - input_file (str, DataFrame or ContourTable): Matched table with 'pair_id', or an in-memory table.
+    - calibration (str or dict): Per-tank calibration (see load_calibration).
+    - output_file (str, optional): Output path (default: nothing is written).
+    - max_residual (float, optional): Largest residual of a good pair, in pixels for camera
+      matrices or plane units for homographies (default: 5).
+
+    Returns:
+    - DataFrame: The table with 'X', 'Y', 'Z', 'residual' and 'bad_match' columns
+      (empty for unpaired rows and tanks without calibration).
+    """
+    if 'pair_id' not in table_columns(input_file):
+        raise ValueError("The table has no pair_id column; run match_cameras on it again")
+    calibration = load_calibration(calibration)
+    df = read_contours(input_file)
+
+    # Left row of every pair, and the right row that shares its pair_id
+    codes = tank_codes(df['tank'])
+    side = np.where(codes >= 0, TANK_SIDE[np.maximum(codes, 0)], -1)
+    pair_id = df['pair_id'].to_numpy(dtype=np.int64)
+    left = np.flatnonzero((side == 0) & (pair_id >= 0))
+    right = np.flatnonzero((side == 1) & (pair_id >= 0))
+    right = right[np.argsort(pair_id[right], kind='stable')]
+    found = np.zeros(len(left), dtype=np.int64)
+    paired = np.zeros(len(left), dtype=bool)
+    if len(right):
+        found = np.minimum(np.searchsorted(pair_id[right], pair_id[left]), len(right) - 1)
+        paired = pair_id[right[found]] == pair_id[left]
+    left, right = left[paired], right[found[paired]]
+
+    xyz = np.full((len(df), 3), np.nan)
+    residual = np.full(len(df), np.nan)
+    cx = df['cX'].to_numpy(dtype=np.float64)
+    cy = df['cY'].to_numpy(dtype=np.float64)
+    number = TANK_NUMBER[codes[left]]
+    for tank_num, entry in calibration.items():
+        sel = number == tank_num
+        l, r = left[sel], right[sel]
+        left_xy = np.column_stack([cx[l], cy[l]])
+        right_xy = np.column_stack([cx[r], cy[r]])
+        if 'P_left' in entry:
+            points, error = triangulate_points(entry['P_left'], entry['P_right'], left_xy, right_xy)
+        else:
+            points, error = map_points(entry['H_left'], entry['H_right'], left_xy, right_xy)
+            points = np.column_stack([points, np.full(len(points), np.nan)])
+        for rows in (l, r):
+            xyz[rows] = points
+            residual[rows] = error
+
+    df['X'], df['Y'], df['Z'] = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    df['residual'] = residual
+    bad = np.where(np.isnan(residual), -1, (residual > max_residual).astype(np.int8)).astype(np.int8)
+    df['bad_match'] = pd.Categorical.from_codes(bad, categories=GLARE_LABELS)
+
+    if output_file is not None:
+        write_table(df, output_file)
+        print(f"Triangulated data has been written to {output_file}")
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Triangulate the matched pairs of a contour table.")
+    parser.add_argument("input_file", help="Matched contour table (with pair_id)")
+    parser.add_argument("calibration", help="JSON calibration with camera matrices or homographies per tank")
+    parser.add_argument("-o", "--output", required=True, help="Output file")
+    parser.add_argument("-r", "--max_residual", type=float, default=DEFAULT_MAX_RESIDUAL,
+                        help="Largest residual of a good pair (default: 5)")
+    args = parser.parse_args()
+
+    triangulate_matches(args.input_file, args.calibration, args.output, max_residual=args.max_residual)